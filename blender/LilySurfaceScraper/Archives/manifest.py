@@ -0,0 +1,87 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Record of the files extracted from an archive into a variant directory, so
+that the maps are found again without listing the directory and that an
+interrupted extraction is not mistaken for a complete one.
+"""
+
+import json
+import os
+
+from ..Storage.blobStore import hashFile
+
+
+class Manifest():
+    def __init__(self, url="", etag=None, files=None):
+        self.url = url
+        self.etag = etag
+        self.files = files if files is not None else {}  # name -> {"size": bytes, "sha256": digest}
+
+    @property
+    def names(self):
+        return list(self.files)
+
+    @classmethod
+    def build(cls, directory, names, url, etag=None):
+        """Describe the given files of directory, hashing them"""
+        files = {}
+        for name in names:
+            path = os.path.join(directory, *name.split("/"))
+            files[name] = {"size": os.path.getsize(path), "sha256": hashFile(path)}
+        return cls(url, etag, files)
+
+    @classmethod
+    def load(cls, path):
+        """Return the manifest saved at path, or None if there is none"""
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cls(data.get("url", ""), data.get("etag"), data.get("files", {}))
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"url": self.url, "etag": self.etag, "files": self.files}, f, indent=4)
+        os.replace(tmp_path, path)
+
+    def missing(self, directory, check_hashes=False):
+        """Return the names of the files of the manifest that are absent
+        from directory or differ from what was extracted"""
+        missing = []
+        for name, info in self.files.items():
+            path = os.path.join(directory, *name.split("/"))
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                missing.append(name)
+                continue
+            if size != info["size"] or (check_hashes and hashFile(path) != info["sha256"]):
+                missing.append(name)
+        return missing
+
+    def digests(self):
+        return {name: info["sha256"] for name, info in self.files.items()}
@@ -0,0 +1,213 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Read only some members of a remote zip archive. The central directory is
+fetched with a Range request on the tail of the file, then only the byte
+ranges of the wanted members are downloaded, so that previews, sidecar
+files and unused maps never cross the network.
+"""
+
+import struct
+
+import requests
+
+from .zipStream import ChunkReader, StreamingUnsupported, extractEntry
+from ..Network import scheduler
+
+END_OF_CENTRAL_DIR = struct.Struct("<IHHHHIIH")
+END_OF_CENTRAL_DIR_SIGNATURE = 0x06054b50
+ZIP64_LOCATOR = struct.Struct("<IIQI")
+ZIP64_LOCATOR_SIGNATURE = 0x07064b50
+ZIP64_END_OF_CENTRAL_DIR = struct.Struct("<IQHHIIQQQQ")
+ZIP64_END_OF_CENTRAL_DIR_SIGNATURE = 0x06064b50
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+CENTRAL_HEADER_SIGNATURE = 0x02014b50
+ZIP64_EXTRA_ID = 0x0001
+
+# The end of central directory record is 22 bytes plus a comment of at most
+# 64 KiB, and the central directory itself usually fits in the same request.
+TAIL_SIZE = 1 << 17
+MAX_PARALLEL_RANGES = 4
+CHUNK_SIZE = 1 << 16
+
+
+class RangesUnsupported(Exception):
+    pass
+
+
+class RemoteEntry():
+    def __init__(self, name, compressed_size, file_size, header_offset):
+        self.name = name
+        self.compressed_size = compressed_size
+        self.file_size = file_size
+        self.header_offset = header_offset
+        # Offset of whatever follows this entry, filled once all are known
+        self.end_offset = None
+
+
+def _zip64Extra(extra, file_size, compressed_size, header_offset):
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, size = struct.unpack_from("<HH", extra, offset)
+        if header_id == ZIP64_EXTRA_ID:
+            values = extra[offset + 4:offset + 4 + size]
+            fields = list(struct.unpack_from("<{}Q".format(len(values) // 8), values))
+            if file_size == 0xFFFFFFFF and fields:
+                file_size = fields.pop(0)
+            if compressed_size == 0xFFFFFFFF and fields:
+                compressed_size = fields.pop(0)
+            if header_offset == 0xFFFFFFFF and fields:
+                header_offset = fields.pop(0)
+            break
+        offset += 4 + size
+    return file_size, compressed_size, header_offset
+
+
+class RemoteZip():
+    def __init__(self, session, url, on_chunk=None, on_headers=None):
+        self.session = session
+        self.url = url
+        self.on_chunk = on_chunk
+        self.on_headers = on_headers
+        self.size = None
+        self.entries = None
+
+    def _get(self, start, end):
+        """Return bytes start to end (inclusive) of the remote file"""
+        headers = {"Range": "bytes={}-{}".format(start, end), "Accept-Encoding": "identity"}
+        r = self.session.get(self.url, headers=headers)
+        if r.status_code != 206:
+            raise RangesUnsupported("Range request refused for {}".format(self.url))
+        return r.content
+
+    def open(self):
+        """Find the size of the archive and read its central directory"""
+        r = self.session.head(self.url, allow_redirects=True, headers={"Accept-Encoding": "identity"})
+        length = r.headers.get("Content-Length")
+        if r.status_code != 200 or length is None or r.headers.get("Accept-Ranges", "").lower() != "bytes":
+            raise RangesUnsupported("{} does not support range requests".format(self.url))
+        self.url = r.url
+        self.size = int(length)
+        if self.on_headers is not None:
+            self.on_headers(r.headers)
+
+        tail_start = max(0, self.size - TAIL_SIZE)
+        tail = self._get(tail_start, self.size - 1)
+        eocd = tail.rfind(struct.pack("<I", END_OF_CENTRAL_DIR_SIGNATURE))
+        if eocd < 0:
+            raise StreamingUnsupported("No central directory found in {}".format(self.url))
+        (_, _, _, _, count, cd_size, cd_offset, _) = END_OF_CENTRAL_DIR.unpack_from(tail, eocd)
+
+        locator = eocd - ZIP64_LOCATOR.size
+        if locator >= 0 and struct.unpack_from("<I", tail, locator)[0] == ZIP64_LOCATOR_SIGNATURE:
+            zip64_offset = ZIP64_LOCATOR.unpack_from(tail, locator)[2] - tail_start
+            if zip64_offset < 0:
+                raise StreamingUnsupported("Zip64 record out of reach in {}".format(self.url))
+            fields = ZIP64_END_OF_CENTRAL_DIR.unpack_from(tail, zip64_offset)
+            count, cd_size, cd_offset = fields[7], fields[8], fields[9]
+
+        if cd_offset >= tail_start:
+            central_dir = tail[cd_offset - tail_start:cd_offset - tail_start + cd_size]
+        else:
+            central_dir = self._get(cd_offset, cd_offset + cd_size - 1)
+        self.entries = self._parseCentralDirectory(central_dir, count)
+
+        # An entry ends where the next one starts, or at the central directory
+        ordered = sorted(self.entries, key=lambda e: e.header_offset)
+        for entry, following in zip(ordered, ordered[1:] + [None]):
+            entry.end_offset = following.header_offset if following is not None else cd_offset
+        return self.entries
+
+    def _parseCentralDirectory(self, data, count):
+        entries = []
+        offset = 0
+        for _ in range(count):
+            fields = CENTRAL_HEADER.unpack_from(data, offset)
+            if fields[0] != CENTRAL_HEADER_SIGNATURE:
+                raise StreamingUnsupported("Corrupted central directory in {}".format(self.url))
+            flags, compressed_size, file_size = fields[3], fields[8], fields[9]
+            name_length, extra_length, comment_length = fields[10], fields[11], fields[12]
+            header_offset = fields[16]
+            offset += CENTRAL_HEADER.size
+            name = data[offset:offset + name_length].decode("utf-8" if flags & 0x0800 else "cp437")
+            extra = data[offset + name_length:offset + name_length + extra_length]
+            file_size, compressed_size, header_offset = _zip64Extra(
+                extra, file_size, compressed_size, header_offset)
+            offset += name_length + extra_length + comment_length
+            entries.append(RemoteEntry(name, compressed_size, file_size, header_offset))
+        return entries
+
+    def _chunks(self, r):
+        for chunk in r.iter_content(CHUNK_SIZE):
+            if self.on_chunk is not None:
+                self.on_chunk(chunk)
+            yield chunk
+
+    def _extractRun(self, run, dest_dir):
+        """Download a run of contiguous entries with a single range request"""
+        start, end = run[0].header_offset, run[-1].end_offset - 1
+        headers = {"Range": "bytes={}-{}".format(start, end), "Accept-Encoding": "identity"}
+        try:
+            with self.session.get(self.url, stream=True, headers=headers) as r:
+                if r.status_code != 206:
+                    raise RangesUnsupported("Range request refused for {}".format(self.url))
+                reader = ChunkReader(self._chunks(r))
+                for entry in run:
+                    extractEntry(reader, dest_dir, sizes=(entry.compressed_size, entry.file_size))
+        except requests.RequestException as err:
+            raise StreamingUnsupported("Download of {} interrupted: {}".format(self.url, err))
+
+    def _wanted(self, member_filter):
+        if self.entries is None:
+            self.open()
+        return sorted((e for e in self.entries if not e.name.endswith("/") and member_filter(e.name)),
+                      key=lambda e: e.header_offset)
+
+    def footprint(self, member_filter):
+        """Return the number of bytes to download to extract the members for
+        which member_filter(name) is True, and their size once extracted"""
+        wanted = self._wanted(member_filter)
+        return (sum(e.end_offset - e.header_offset for e in wanted),
+                sum(e.file_size for e in wanted))
+
+    def extract(self, dest_dir, member_filter, priority=scheduler.INTERACTIVE):
+        """Download and extract the members for which member_filter(name) is
+        True, with parallel requests as far as the scheduler has free slots
+        for the given priority. Return the list of extracted names."""
+        wanted = self._wanted(member_filter)
+
+        # Merge entries that follow each other in the archive
+        runs = []
+        for entry in wanted:
+            if runs and runs[-1][-1].end_offset == entry.header_offset:
+                runs[-1].append(entry)
+            else:
+                runs.append([entry])
+
+        total = sum(e.end_offset - e.header_offset for e in wanted)
+        print("Fetching {} of {} members ({} / {} bytes) from {}".format(
+            len(wanted), len(self.entries), total, self.size, self.url))
+        scheduler.getScheduler().runEach(lambda run: self._extractRun(run, dest_dir), runs,
+                                         MAX_PARALLEL_RANGES, url=self.url, priority=priority)
+        return [e.name for e in wanted]
@@ -0,0 +1,98 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Extract a zip archive that is already on disk, decompressing several members
+in parallel. Each worker thread reads the archive through its own file
+handle, and zlib releases the GIL while inflating, so that large maps are
+extracted concurrently rather than one after the other.
+"""
+
+import concurrent.futures
+import os
+import shutil
+import threading
+import zipfile
+
+from .zipStream import safeMemberPath, StreamingUnsupported
+
+COPY_SIZE = 1 << 20
+
+
+class ProgressReader():
+    """File-like wrapper calling progress(done) after each read"""
+    def __init__(self, f, progress):
+        self.f = f
+        self.progress = progress
+        self.done = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        if data:
+            self.done += len(data)
+            self.progress(self.done)
+        return data
+
+
+def extractMembers(zip_path, dest_dir, member_filter=None, max_workers=None, progress=None):
+    """Extract the members of zip_path for which member_filter(name) is True
+    (all files if there is no filter) into dest_dir.
+    progress(name, done, total) is called as bytes of each member are written.
+    Return the list of extracted member names."""
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        members = [info for info in zip_ref.infolist()
+                   if not info.is_dir() and (member_filter is None or member_filter(info.filename))]
+
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def archive():
+        if not hasattr(local, "zip_ref"):
+            local.zip_ref = zipfile.ZipFile(zip_path, "r")
+            with handles_lock:
+                handles.append(local.zip_ref)
+        return local.zip_ref
+
+    def extractOne(info):
+        try:
+            path = safeMemberPath(dest_dir, info.filename)
+        except StreamingUnsupported as err:
+            print("Skipping {}".format(err))
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part_path = path + ".part"
+        with archive().open(info) as src, open(part_path, "wb") as dst:
+            if progress is not None:
+                src = ProgressReader(src, lambda done: progress(info.filename, done, info.file_size))
+            shutil.copyfileobj(src, dst, COPY_SIZE)
+        os.replace(part_path, path)
+        return info.filename
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            names = list(executor.map(extractOne, members))
+    finally:
+        for zip_ref in handles:
+            zip_ref.close()
+    return [name for name in names if name is not None]
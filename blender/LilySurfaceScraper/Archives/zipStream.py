@@ -0,0 +1,242 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Extract a zip archive while it is being downloaded. Instead of reading the
+central directory at the end of the file, members are decoded one after the
+other from their local file headers, so that decompression overlaps with
+the transfer and the archive itself never needs to be written to disk.
+
+Entries whose size is only known after their data (a 'data descriptor')
+can still be streamed when deflated, since a deflate stream tells where it
+ends, but not when stored. StreamingUnsupported is raised for those and
+for anything else that requires the central directory, so that the caller
+can fall back to downloading the whole archive.
+"""
+
+import os
+import struct
+import zlib
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+CENTRAL_HEADER_SIGNATURE = 0x02014b50
+END_OF_CENTRAL_DIR_SIGNATURE = 0x06054b50
+DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+
+FLAG_ENCRYPTED = 0x0001
+FLAG_DATA_DESCRIPTOR = 0x0008
+FLAG_UTF8 = 0x0800
+
+STORED = 0
+DEFLATED = 8
+
+ZIP64_EXTRA_ID = 0x0001
+COPY_SIZE = 1 << 16
+
+
+class StreamingUnsupported(Exception):
+    pass
+
+
+class ChunkReader():
+    """Read exact amounts of bytes from an iterator over chunks of data"""
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+
+    def _fill(self):
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer += chunk
+                return True
+        return False
+
+    def readSome(self, limit=COPY_SIZE):
+        """Return up to limit bytes, or b"" at the end of the stream"""
+        if not self.buffer and not self._fill():
+            return b""
+        data, self.buffer = self.buffer[:limit], self.buffer[limit:]
+        return data
+
+    def read(self, size):
+        while len(self.buffer) < size:
+            if not self._fill():
+                raise StreamingUnsupported("Archive is truncated")
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def unread(self, data):
+        self.buffer = data + self.buffer
+
+
+def safeMemberPath(dest_dir, name):
+    """Path where to extract member name, refusing to leave dest_dir"""
+    parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".")]
+    if not parts or ".." in parts or os.path.isabs(name) or ":" in parts[0]:
+        raise StreamingUnsupported("Unsafe member name: {}".format(name))
+    return os.path.join(dest_dir, *parts)
+
+
+def _zip64Sizes(extra, compressed_size, file_size):
+    """Read the real sizes from the zip64 extra field when needed"""
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, size = struct.unpack_from("<HH", extra, offset)
+        if header_id == ZIP64_EXTRA_ID:
+            values = extra[offset + 4:offset + 4 + size]
+            fields = list(struct.unpack_from("<{}Q".format(len(values) // 8), values))
+            if file_size == 0xFFFFFFFF and fields:
+                file_size = fields.pop(0)
+            if compressed_size == 0xFFFFFFFF and fields:
+                compressed_size = fields.pop(0)
+            return compressed_size, file_size, True
+        offset += 4 + size
+    return compressed_size, file_size, False
+
+
+def _copyStored(reader, size, out):
+    crc = 0
+    while size > 0:
+        data = reader.read(min(size, COPY_SIZE))
+        size -= len(data)
+        crc = zlib.crc32(data, crc)
+        if out is not None:
+            out.write(data)
+    return crc
+
+
+def _inflate(reader, size, out):
+    """Inflate a deflate stream, of known compressed size or not (None)"""
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    crc = 0
+    while not decompressor.eof:
+        if size is None:
+            data = reader.readSome()
+            if not data:
+                raise StreamingUnsupported("Archive is truncated")
+        else:
+            if size == 0:
+                break
+            data = reader.read(min(size, COPY_SIZE))
+            size -= len(data)
+        block = decompressor.decompress(data)
+        crc = zlib.crc32(block, crc)
+        if out is not None:
+            out.write(block)
+    if decompressor.unused_data:
+        reader.unread(decompressor.unused_data)
+    return crc
+
+
+def _readDataDescriptor(reader, zip64):
+    """Read the crc that follows an entry with the data descriptor flag"""
+    signature = reader.read(4)
+    if struct.unpack("<I", signature)[0] != DATA_DESCRIPTOR_SIGNATURE:
+        # The signature is optional
+        reader.unread(signature)
+    crc = struct.unpack("<I", reader.read(4))[0]
+    reader.read(16 if zip64 else 8)
+    return crc
+
+
+def extractEntry(reader, dest_dir, member_filter=None, sizes=None):
+    """Extract the entry whose local header is at the current position of
+    reader, if member_filter(name) is True or there is no filter. The
+    (compressed, uncompressed) sizes may be given when they are known from
+    the central directory. Return the entry name and whether it was written,
+    or (None, False) at the end of the entries."""
+    header = reader.read(4)
+    signature = struct.unpack("<I", header)[0]
+    if signature in (CENTRAL_HEADER_SIGNATURE, END_OF_CENTRAL_DIR_SIGNATURE):
+        return None, False
+    if signature != LOCAL_HEADER_SIGNATURE:
+        raise StreamingUnsupported("Unexpected data in archive")
+    reader.unread(header)
+
+    (_, _, flags, method, _, _, crc, compressed_size, file_size,
+     name_length, extra_length) = LOCAL_HEADER.unpack(reader.read(LOCAL_HEADER.size))
+    raw_name = reader.read(name_length)
+    name = raw_name.decode("utf-8" if flags & FLAG_UTF8 else "cp437")
+    extra = reader.read(extra_length)
+    compressed_size, file_size, zip64 = _zip64Sizes(extra, compressed_size, file_size)
+    has_descriptor = bool(flags & FLAG_DATA_DESCRIPTOR)
+    if sizes is not None:
+        compressed_size, file_size = sizes
+        zip64 = zip64 or max(sizes) >= 0xFFFFFFFF
+    known_size = not has_descriptor or sizes is not None
+
+    if flags & FLAG_ENCRYPTED:
+        raise StreamingUnsupported("Encrypted member: {}".format(name))
+    if method not in (STORED, DEFLATED):
+        raise StreamingUnsupported("Unsupported compression for {}".format(name))
+    if not known_size and method == STORED:
+        # The end of the data can only be found from the central directory
+        raise StreamingUnsupported("Stored member with data descriptor: {}".format(name))
+
+    path = safeMemberPath(dest_dir, name)
+    if name.endswith("/"):
+        os.makedirs(path, exist_ok=True)
+        _copyStored(reader, compressed_size, None)
+        return name, False
+
+    keep = member_filter is None or member_filter(name)
+    part_path = path + ".part"
+    out = None
+    if keep:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        out = open(part_path, "wb")
+    try:
+        if method == STORED:
+            actual_crc = _copyStored(reader, compressed_size, out)
+        else:
+            actual_crc = _inflate(reader, compressed_size if known_size else None, out)
+        if has_descriptor:
+            crc = _readDataDescriptor(reader, zip64)
+        if actual_crc != crc:
+            raise StreamingUnsupported("Bad CRC for member {}".format(name))
+    except BaseException:
+        if out is not None:
+            out.close()
+            os.remove(part_path)
+        raise
+    if out is not None:
+        out.close()
+        os.replace(part_path, path)
+    return name, keep
+
+
+def extractStream(chunks, dest_dir, member_filter=None):
+    """Extract the zip whose content is given as an iterator over chunks of
+    bytes into dest_dir. Only the members for which member_filter(name)
+    returns True are written, if a filter is given.
+    Return the list of the names of the members written."""
+    reader = ChunkReader(chunks)
+    namelist = []
+    while True:
+        name, kept = extractEntry(reader, dest_dir, member_filter)
+        if name is None:
+            break
+        if kept or member_filter is None:
+            namelist.append(name)
+    return namelist
@@ -0,0 +1,462 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Caching HTTP proxy shared by several Blender instances or render nodes, so
+that each file of a source crosses the internet only once. It only depends
+on the standard library and runs on its own:
+
+    python cachingProxy.py --port 8765 --dir /path/to/cache --max-size 20000
+
+Clients set the proxy address in the add-on preferences. They then request
+http://<proxy>/<scheme>/<host>/<path>?<query> instead of the original URL.
+Complete answers are stored on disk. Within the size limit (in MB), the
+least recently used files get evicted first. Answers older than --ttl hours
+are fetched again. GET /_stats returns the counters of the proxy as JSON.
+"""
+
+import argparse
+import hashlib
+import ipaddress
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+USER_AGENT = "Mozilla/5.0"
+CHUNK_SIZE = 1 << 16
+UPSTREAM_TIMEOUT = 60  # seconds
+# Headers of the original answer kept along with the stored file
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+# Headers forwarded as is when a request is not served from the store
+FORWARDED_HEADERS = KEPT_HEADERS + ("Content-Length", "Content-Range", "Accept-Ranges")
+STATS_PATH = "/_stats"
+# Hosts of the supported sources, proxied along with their subdomains
+DEFAULT_ALLOWED_HOSTS = ("polyhaven.com", "polyhaven.org", "ambientcg.com", "cgbookcase.com",
+                         "3dassets.one", "ieslibrary.com")
+
+
+def proxiedUrl(proxy_url, url):
+    """Address at which the proxy serves url"""
+    parts = urlsplit(url)
+    path = "/{}/{}{}".format(parts.scheme, parts.netloc, parts.path or "/")
+    if parts.query:
+        path += "?" + parts.query
+    return proxy_url.rstrip("/") + path
+
+
+def upstreamUrl(path):
+    """Original URL of a request made to the proxy, or None"""
+    scheme, _, rest = path.lstrip("/").partition("/")
+    if scheme not in ("http", "https") or not rest:
+        return None
+    return "{}://{}".format(scheme, rest)
+
+
+def parseRange(value, size):
+    """Return the (start, end) bytes asked by a Range header, end included,
+    None if there is no valid range, or False if it cannot be satisfied"""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (value or "").strip())
+    if match is None or not (match.group(1) or match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    else:
+        start, end = max(0, size - int(match.group(2))), size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+class Store():
+    """Files downloaded by the proxy, stored as <key>.body and <key>.json"""
+    def __init__(self, directory, max_bytes, ttl):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = {}  # key -> [size, last access]
+        self.total = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.endswith(".tmp"):
+                os.remove(os.path.join(directory, name))
+            elif name.endswith(".body"):
+                key = name[:-len(".body")]
+                meta_path, body_path = self.paths(key)
+                if not os.path.isfile(meta_path):
+                    os.remove(body_path)
+                    continue
+                size = os.path.getsize(body_path)
+                self.entries[key] = [size, os.path.getmtime(meta_path)]
+                self.total += size
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".json", base + ".body"
+
+    def lookup(self, url):
+        """Return the metadata and body path of url, or None if it is not
+        stored or too old"""
+        key = self.key(url)
+        meta_path, body_path = self.paths(key)
+        with self._lock:
+            if key not in self.entries:
+                return None
+            try:
+                with open(meta_path, "r") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                return None
+            if meta.get("url") != url or time.time() - meta.get("stored_at", 0) > self.ttl:
+                return None
+            now = time.time()
+            self.entries[key][1] = now
+            os.utime(meta_path, (now, now))
+        return meta, body_path
+
+    def tempPath(self, url):
+        return os.path.join(self.directory, "{}.{}.tmp".format(self.key(url), threading.get_ident()))
+
+    def commit(self, url, tmp_path, headers):
+        """Move a completely downloaded file into the store"""
+        key = self.key(url)
+        meta_path, body_path = self.paths(key)
+        size = os.path.getsize(tmp_path)
+        meta = {
+            "url": url,
+            "stored_at": time.time(),
+            "headers": {k: headers[k] for k in KEPT_HEADERS if headers.get(k) is not None},
+        }
+        with self._lock:
+            if key in self.entries:
+                self.total -= self.entries[key][0]
+            os.replace(tmp_path, body_path)
+            with open(meta_path, "w") as f:
+                json.dump(meta, f)
+            self.entries[key] = [size, time.time()]
+            self.total += size
+            self._evict(keep=key)
+
+    def _evict(self, keep):
+        """Remove the least recently used files until the store fits"""
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            key = min((k for k in self.entries if k != keep), key=lambda k: self.entries[k][1])
+            size, _ = self.entries.pop(key)
+            for path in self.paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.total -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self.entries),
+                "size": self.total,
+                "max_size": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+class ProxyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, store, allowed_hosts=DEFAULT_ALLOWED_HOSTS):
+        """allowed_hosts are the hosts proxied with their subdomains, None
+        for any host"""
+        super().__init__(address, ProxyHandler)
+        self.store = store
+        self.allowed_hosts = tuple(allowed_hosts) if allowed_hosts is not None else None
+        self.counters = {"hits": 0, "misses": 0, "passthrough": 0, "errors": 0,
+                         "bytes_served": 0, "bytes_fetched": 0}
+        self.in_flight = set()
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def isAllowed(self, url):
+        if self.allowed_hosts is None:
+            return True
+        host = urlsplit(url).hostname or ""
+        return any(host == h or host.endswith("." + h) for h in self.allowed_hosts)
+
+    def claim(self, url):
+        """Return True if the caller is the one to download url into the
+        store, False if another thread already does"""
+        with self._lock:
+            if url in self.in_flight:
+                return False
+            self.in_flight.add(url)
+            return True
+
+    def release(self, url):
+        with self._lock:
+            self.in_flight.discard(url)
+
+    def fill(self, url):
+        """Download url into the store in the background"""
+        if not self.claim(url):
+            return
+
+        def run():
+            try:
+                with openUpstream(url) as response:
+                    if response.status == 200:
+                        self.download(url, response)
+            except (OSError, urllib.error.URLError) as err:
+                print("Could not fetch {}: {}".format(url, err))
+                self.count("errors")
+            finally:
+                self.release(url)
+        threading.Thread(target=run, daemon=True).start()
+
+    def download(self, url, response, client=None):
+        """Store the body of an upstream response, also sending it to
+        client (a writable file) if given"""
+        tmp_path = self.store.tempPath(url)
+        try:
+            with open(tmp_path, "wb") as f:
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    self.count("bytes_fetched", len(chunk))
+                    if client is not None:
+                        try:
+                            client.write(chunk)
+                            self.count("bytes_served", len(chunk))
+                        except OSError:
+                            # Client went away, still complete the file
+                            client = None
+            self.store.commit(url, tmp_path, response.headers)
+        finally:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+
+    def statsDict(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["in_flight"] = len(self.in_flight)
+        stats.update(self.store.stats())
+        return stats
+
+
+def openUpstream(url, method="GET", headers=None):
+    """Open url, returning the response even for HTTP errors"""
+    request = urllib.request.Request(url, method=method, headers={"User-Agent": USER_AGENT,
+                                                                  "Accept-Encoding": "identity"})
+    for name, value in (headers or {}).items():
+        request.add_header(name, value)
+    try:
+        return urllib.request.urlopen(request, timeout=UPSTREAM_TIMEOUT)
+    except urllib.error.HTTPError as err:
+        return err
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handleRequest(head=False)
+
+    def do_HEAD(self):
+        self.handleRequest(head=True)
+
+    def handleRequest(self, head):
+        server = self.server
+        if self.path == STATS_PATH:
+            return self.sendBody(200, json.dumps(server.statsDict()).encode("utf-8"),
+                                 {"Content-Type": "application/json"}, head)
+        url = upstreamUrl(self.path)
+        if url is None:
+            return self.sendBody(400, b"Expected /<scheme>/<host>/<path>", head=head)
+        if not server.isAllowed(url):
+            return self.sendBody(403, b"Host not allowed", head=head)
+
+        entry = server.store.lookup(url)
+        if entry is not None:
+            server.count("hits")
+            return self.serveStored(entry, head)
+
+        server.count("misses")
+        try:
+            if head or self.headers.get("Range") or not server.claim(url):
+                # Answer this request directly while the whole file gets
+                # stored for the next ones
+                server.fill(url)
+                return self.passThrough(url, head)
+            try:
+                self.fetchAndStore(url)
+            finally:
+                server.release(url)
+        except (OSError, urllib.error.URLError) as err:
+            server.count("errors")
+            print("Could not fetch {}: {}".format(url, err))
+            self.sendBody(502, str(err).encode("utf-8"), head=head)
+
+    def sendBody(self, status, body=b"", headers=None, head=False):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def serveStored(self, entry, head):
+        meta, body_path = entry
+        size = os.path.getsize(body_path)
+        headers = dict(meta["headers"])
+        etag = headers.get("ETag")
+        if etag is not None and self.headers.get("If-None-Match") == etag:
+            return self.sendBody(304, headers={"ETag": etag}, head=True)
+
+        status, start, end = 200, 0, size - 1
+        byte_range = parseRange(self.headers.get("Range"), size)
+        if byte_range is False:
+            return self.sendBody(416, headers={"Content-Range": "bytes */{}".format(size)}, head=head)
+        if byte_range is not None:
+            status, (start, end) = 206, byte_range
+            headers["Content-Range"] = "bytes {}-{}/{}".format(start, end, size)
+        headers["Accept-Ranges"] = "bytes"
+        headers["Content-Length"] = str(end - start + 1)
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if head:
+            return
+        remaining = end - start + 1
+        with open(body_path, "rb") as f:
+            f.seek(start)
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+                self.server.count("bytes_served", len(chunk))
+
+    def sendUpstreamHeaders(self, response):
+        self.send_response(response.status)
+        for name in FORWARDED_HEADERS:
+            value = response.headers.get(name)
+            if value is not None:
+                self.send_header(name, value)
+        if response.headers.get("Content-Length") is None:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+
+    def passThrough(self, url, head):
+        self.server.count("passthrough")
+        headers = {}
+        if self.headers.get("Range"):
+            headers["Range"] = self.headers["Range"]
+        with openUpstream(url, "HEAD" if head else "GET", headers) as response:
+            self.sendUpstreamHeaders(response)
+            if head:
+                return
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                self.server.count("bytes_fetched", len(chunk))
+                self.server.count("bytes_served", len(chunk))
+
+    def fetchAndStore(self, url):
+        with openUpstream(url) as response:
+            self.sendUpstreamHeaders(response)
+            if response.status != 200:
+                # Errors are not stored
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                return
+            self.server.download(url, response, self.wfile)
+
+
+def isLoopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Caching proxy for LilySurfaceScraper")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on, 0.0.0.0 to serve the LAN")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dir", default=os.path.join(os.path.expanduser("~"), ".cache", "lily-proxy"),
+                        help="Directory where files are stored")
+    parser.add_argument("--max-size", type=int, default=20000, help="Size of the store, in MB")
+    parser.add_argument("--ttl", type=float, default=24.0, help="Hours after which files are fetched again")
+    parser.add_argument("--allow", nargs="*", default=[],
+                        help="Also proxy these hosts and their subdomains, besides those of the supported sources")
+    parser.add_argument("--allow-any", action="store_true",
+                        help="Proxy any host, only accepted when listening on the loopback interface")
+    args = parser.parse_args()
+    if args.allow_any and not isLoopback(args.host):
+        parser.error("--allow-any would let the network use the proxy as an open relay, "
+                     "list the hosts to proxy with --allow instead")
+
+    store = Store(args.dir, args.max_size * 1024 * 1024, args.ttl * 3600)
+    allowed_hosts = None if args.allow_any else DEFAULT_ALLOWED_HOSTS + tuple(args.allow)
+    server = ProxyServer((args.host, args.port), store, allowed_hosts)
+    print("Caching proxy listening on http://{}:{}, storing files in {}".format(args.host, args.port, args.dir))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Record and replay of HTTP exchanges, to run scrapers offline and
+deterministically. In record mode, every request sent through the wrapped
+transport is saved in a cassette directory along with its response (bodies
+may be truncated to save space). In replay mode, the cassette answers the
+requests instead of the network, with a simulated latency and bandwidth, and
+counts them so that changes in the number of requests can be spotted.
+
+Each exchange is stored as <key>.json (request, status and headers) and
+<key>.body, where the key is a hash of the method, URL and Range header.
+requests.log lists the exchanges in the order they happened.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from requests.structures import CaseInsensitiveDict
+
+from .transports import Transport, LocalResponse, serveFile, CHUNK_SIZE
+
+# Request headers that would let the server answer without a body
+CONDITIONAL_HEADERS = ("If-None-Match", "If-Modified-Since")
+
+
+def exchangeKey(method, url, byte_range=""):
+    return hashlib.sha1("{} {} {}".format(method, url, byte_range or "").encode("utf-8")).hexdigest()
+
+
+class RecordingResponse():
+    """Wraps a response to save its body as it gets read. Streamed bodies are
+    written to a temporary file chunk by chunk, rather than kept in memory."""
+    def __init__(self, cassette, response, meta):
+        self.response = response
+        self.cassette = cassette
+        self.meta = meta
+        self.body_size = 0
+        self.truncated = False
+        self.complete = False
+        self.saved = False
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = response.url
+        _, body_path = cassette._paths(exchangeKey(meta["method"], meta["url"], meta["range"]))
+        self._tmp_path = "{}.{}.{}.tmp".format(body_path, os.getpid(), id(self))
+        self._body_file = None
+
+    @property
+    def encoding(self):
+        return self.response.encoding
+
+    @property
+    def content(self):
+        content = self.response.content
+        if not self.saved:
+            self._write(content)
+            self.complete = True
+            self.save()
+        return content
+
+    @property
+    def text(self):
+        self.content
+        return self.response.text
+
+    def json(self):
+        self.content
+        return self.response.json()
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        for chunk in self.response.iter_content(chunk_size):
+            if not self.saved:
+                self._write(chunk)
+            yield chunk
+        self.complete = True
+        self.save()
+
+    def _write(self, data):
+        """Append data to the recorded body, up to the cassette's max_body"""
+        room = self.cassette.max_body - self.body_size
+        if len(data) > room:
+            data = data[:int(room)]
+            self.truncated = True
+        if self._body_file is None:
+            self._body_file = open(self._tmp_path, "wb")
+        self._body_file.write(data)
+        self.body_size += len(data)
+
+    def save(self):
+        if not self.saved:
+            self.saved = True
+            if self._body_file is None:
+                self._body_file = open(self._tmp_path, "wb")
+            self._body_file.close()
+            self.cassette.save(self.meta, self._tmp_path, self.body_size, self.complete and not self.truncated)
+
+    def close(self):
+        self.save()
+        self.response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ReplayResponse(LocalResponse):
+    """Recorded response, delivered at the simulated bandwidth"""
+    def __init__(self, *args, bandwidth=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bandwidth = bandwidth
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        for chunk in super().iter_content(chunk_size):
+            if self.bandwidth > 0:
+                time.sleep(len(chunk) / self.bandwidth)
+            yield chunk
+
+
+class Cassette(Transport):
+    """Transport that records the exchanges of another transport into
+    directory (mode 'RECORD') or replays them from it (mode 'REPLAY').
+    max_body limits the size of recorded bodies, in bytes (0 for no limit).
+    latency (seconds) and bandwidth (bytes per second, 0 for no limit) are
+    simulated when replaying."""
+    def __init__(self, mode, directory, transport=None, max_body=0, latency=0.0, bandwidth=0):
+        self.mode = mode
+        self.name = mode
+        self.directory = directory
+        self.transport = transport
+        self.max_body = max_body if max_body > 0 else float("inf")
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.counts = {}
+        self.missed = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".json", base + ".body"
+
+    def _count(self, method, url):
+        with self._lock:
+            self.counts[(method, url)] = self.counts.get((method, url), 0) + 1
+
+    def stats(self):
+        """Return the number of requests and of requests missing from the
+        cassette, and the number of distinct URLs requested"""
+        with self._lock:
+            return {
+                "requests": sum(self.counts.values()),
+                "missed": self.missed,
+                "urls": len({url for _, url in self.counts}),
+            }
+
+    def request(self, method, url, headers=None, stream=False, allow_redirects=True, timeout=None):
+        self._count(method, url)
+        if self.mode == 'RECORD':
+            return self._record(method, url, headers, stream, allow_redirects, timeout)
+        return self._replay(method, url, CaseInsensitiveDict(headers or {}))
+
+    # Recording
+
+    def _record(self, method, url, headers, stream, allow_redirects, timeout):
+        # Always ask for full answers, a 304 would be of no use when replaying
+        headers = {k: v for k, v in (headers or {}).items() if k not in CONDITIONAL_HEADERS}
+        response = self.transport.request(method, url, headers=headers, stream=True,
+                                          allow_redirects=allow_redirects, timeout=timeout)
+        meta = {
+            "method": method,
+            "url": url,
+            "range": headers.get("Range", ""),
+            "status_code": response.status_code,
+            # The body is stored decoded
+            "headers": {k: v for k, v in response.headers.items() if k.lower() != "content-encoding"},
+        }
+        recording = RecordingResponse(self, response, meta)
+        if method == "HEAD":
+            recording.complete = True
+            recording.save()
+        elif not stream:
+            recording.content
+        return recording
+
+    def save(self, meta, body_tmp_path, body_size, complete):
+        """Record an exchange, whose body of body_size bytes was written to
+        the temporary file body_tmp_path"""
+        meta["body_size"] = body_size
+        meta["truncated"] = not complete
+        key = exchangeKey(meta["method"], meta["url"], meta["range"])
+        meta_path, body_path = self._paths(key)
+        os.replace(body_tmp_path, body_path)
+        tmp_path = "{}.{}.tmp".format(meta_path, threading.get_ident())
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(tmp_path, meta_path)
+        with self._lock:
+            with open(os.path.join(self.directory, "requests.log"), "a") as f:
+                f.write("{method} {url} {range} -> {status_code} ({body_size} bytes)\n".format(**meta))
+
+    # Replaying
+
+    def load(self, method, url, byte_range=""):
+        meta_path, body_path = self._paths(exchangeKey(method, url, byte_range))
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url or not os.path.isfile(body_path):
+            return None
+        return meta, body_path
+
+    def _replay(self, method, url, headers):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        byte_range = headers.get("Range", "")
+        entry = self.load(method, url, byte_range)
+        if entry is None and method == "HEAD":
+            entry = self.load("GET", url)
+        if entry is None and byte_range:
+            # Cut the requested range out of a recorded full answer
+            full = self.load("GET", url)
+            if full is not None and full[0]["status_code"] == 200:
+                return self._slice(url, full, byte_range)
+        if entry is None:
+            print("No recorded answer for {} {}".format(method, url))
+            with self._lock:
+                self.missed += 1
+            return LocalResponse(url, 404, {"Content-Length": "0"})
+
+        meta, body_path = entry
+        response_headers = CaseInsensitiveDict(meta["headers"])
+        etag = response_headers.get("ETag")
+        if etag is not None and headers.get("If-None-Match") == etag:
+            return LocalResponse(url, 304, {"ETag": etag, "Content-Length": "0"})
+        if meta["method"] != "HEAD":
+            # The recorded body may be truncated or decoded
+            response_headers["Content-Length"] = str(meta["body_size"])
+        if method == "HEAD":
+            return LocalResponse(url, meta["status_code"], response_headers)
+        return ReplayResponse(url, meta["status_code"], response_headers, body_path, 0, meta["body_size"],
+                              bandwidth=self.bandwidth)
+
+    def _slice(self, url, entry, byte_range):
+        meta, body_path = entry
+        r = serveFile(url, body_path, "GET", {"Range": byte_range})
+        if r.status_code != 206:
+            return r
+        response_headers = CaseInsensitiveDict(meta["headers"])
+        for name in ("Content-Range", "Content-Length"):
+            response_headers[name] = r.headers[name]
+        return ReplayResponse(url, 206, response_headers, body_path, r.start, r.length,
+                              bandwidth=self.bandwidth)
+
+
+_cassettes = {}
+_lock = threading.Lock()
+
+
+def getCassette(mode, directory, transport, max_body=0, latency=0.0, bandwidth=0):
+    """Return the cassette recording or replaying in directory, so that its
+    counters span a whole import"""
+    key = (mode, os.path.realpath(directory), id(transport))
+    with _lock:
+        cassette = _cassettes.get(key)
+        if cassette is None:
+            cassette = Cassette(mode, directory, transport, max_body, latency, bandwidth)
+            _cassettes[key] = cassette
+        else:
+            # Preferences may have changed since
+            cassette.max_body = max_body if max_body > 0 else float("inf")
+            cassette.latency = latency
+            cassette.bandwidth = bandwidth
+        return cassette
+
+
+def missedRequests():
+    """Number of requests that replaying cassettes could not answer"""
+    with _lock:
+        return sum(c.stats()["missed"] for c in _cassettes.values())
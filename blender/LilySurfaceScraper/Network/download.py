@@ -0,0 +1,265 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Download of large files to disk. Data is first written to a '.part' file
+next to the destination, which is only renamed to its final name once the
+number of bytes received matches what the server announced. An interrupted
+download is resumed with a Range request when the server supports it, so
+that neither a retry nor the next import starts over from zero, and a
+truncated file never looks like a cached one.
+
+Very large files can also be split into several Range requests fetched in
+parallel, each one writing at its own offset of a preallocated file.
+"""
+
+import os
+import re
+
+import requests
+
+from . import scheduler
+
+PART_SUFFIX = ".part"
+# Segmented downloads leave holes until they complete, so they must not be
+# mistaken for a partial file that can be resumed by appending to it
+SEGMENTED_SUFFIX = ".segmented.part"
+CHUNK_SIZE = 1 << 16
+RESUME_ATTEMPTS = 3
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DownloadResult():
+    """Outcome of the download of one map"""
+    DOWNLOADED = 'DOWNLOADED'
+    CACHED = 'CACHED'  # already on disk or in the storage backend
+    FAILED = 'FAILED'
+
+    def __init__(self, name, url, path=None, status=FAILED, nbytes=0, duration=0.0, retries=0, error=None):
+        self.name = name
+        self.url = url
+        self.path = path  # destination, only written if ok
+        self.status = status
+        self.nbytes = nbytes  # received from the network
+        self.duration = duration  # seconds
+        self.retries = retries
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.status != DownloadResult.FAILED
+
+    def toDict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def fromDict(cls, values):
+        return cls(**values)
+
+    def __repr__(self):
+        if not self.ok:
+            return "{}: failed after {} retries ({})".format(self.name, self.retries, self.error)
+        return "{}: {} ({} bytes in {:.1f}s, {} retries)".format(
+            self.name, self.status.lower(), self.nbytes, self.duration, self.retries)
+
+
+def partPath(path):
+    return path + PART_SUFFIX
+
+
+def _totalFromContentRange(content_range):
+    """Parse the total size from a 'bytes start-end/total' header, or None"""
+    match = re.match(r"bytes (?:(\d+)-\d+|\*)/(\d+)", content_range or "")
+    if match is None:
+        return None, None
+    start = int(match.group(1)) if match.group(1) is not None else None
+    return start, int(match.group(2))
+
+
+def _isEncoded(r):
+    return r.headers.get("Content-Encoding", "identity") != "identity"
+
+
+def _downloadOnce(session, url, part_path, on_chunk, on_headers=None):
+    """Try to fill part_path with the content of url, resuming from what it
+    already contains. Return the total expected size, or None if unknown."""
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    # Ask for raw bytes, otherwise sizes and offsets refer to the encoded stream
+    headers = {"Accept-Encoding": "identity"}
+    if offset > 0:
+        headers["Range"] = "bytes={}-".format(offset)
+
+    with session.get(url, stream=True, headers=headers) as r:
+        if r.status_code == 416:
+            # Nothing left to download, or the remote file got smaller
+            _, total = _totalFromContentRange(r.headers.get("Content-Range"))
+            if total is not None and total == offset:
+                return total
+            os.remove(part_path)
+            raise DownloadError("Stale partial download of {}, discarded".format(url))
+
+        if r.status_code == 206:
+            start, total = _totalFromContentRange(r.headers.get("Content-Range"))
+            if start != offset:
+                os.remove(part_path)
+                raise DownloadError("Unexpected range returned for {}".format(url))
+            mode = 'ab'
+        elif r.status_code == 200:
+            # Server ignored the Range header, start over
+            length = r.headers.get("Content-Length")
+            total = int(length) if length is not None and not _isEncoded(r) else None
+            mode = 'wb'
+        else:
+            raise DownloadError("URL not found: {}".format(url))
+        if on_headers is not None:
+            on_headers(r.headers)
+
+        with open(part_path, mode) as f:
+            for chunk in r.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                if on_chunk is not None:
+                    on_chunk(chunk)
+    return total
+
+
+def downloadFile(session, url, path, resume=True, on_chunk=None, on_headers=None):
+    """Download url into path, going through a '.part' staging file.
+    If resume is False, any previous partial download is discarded first.
+    on_chunk is called with each block of data received, and on_headers with
+    the headers of the responses.
+    Raise DownloadError on failure, leaving the partial file for later."""
+    part_path = partPath(path)
+    if not resume and os.path.isfile(part_path):
+        os.remove(part_path)
+
+    attempt = 0
+    while True:
+        size_before = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        try:
+            total = _downloadOnce(session, url, part_path, on_chunk, on_headers)
+        except requests.RequestException as err:
+            size = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+            attempt = attempt + 1 if size <= size_before else 0
+            if attempt >= RESUME_ATTEMPTS:
+                raise DownloadError("Download of {} interrupted: {}".format(url, err))
+            print("Download of {} interrupted at {} bytes, resuming...".format(url, size))
+            continue
+
+        size = os.path.getsize(part_path)
+        if total is not None and size != total:
+            raise DownloadError("Incomplete download of {} ({} / {} bytes)".format(url, size, total))
+        os.replace(part_path, path)
+        return size
+
+
+def _supportsRanges(r):
+    return r.headers.get("Accept-Ranges", "").lower() == "bytes"
+
+
+def _downloadSegment(session, url, part_path, start, end, on_chunk):
+    """Write bytes start to end (inclusive) of url at the same offset in
+    part_path, resuming the segment if the connection drops."""
+    position = start
+    attempt = 0
+    while position <= end:
+        headers = {"Accept-Encoding": "identity", "Range": "bytes={}-{}".format(position, end)}
+        try:
+            with session.get(url, stream=True, headers=headers) as r:
+                if r.status_code != 206:
+                    raise DownloadError("Range request refused for {}".format(url))
+                with open(part_path, "r+b") as f:
+                    f.seek(position)
+                    for chunk in r.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        position += len(chunk)
+                        if on_chunk is not None:
+                            on_chunk(chunk)
+        except requests.RequestException as err:
+            attempt += 1
+            if attempt >= RESUME_ATTEMPTS:
+                raise DownloadError("Download of {} interrupted: {}".format(url, err))
+            continue
+        if position <= end:
+            raise DownloadError("Incomplete segment of {} ({} / {} bytes)".format(url, position, end + 1))
+
+
+def downloadSegmented(session, url, path, connections, threshold, resume=True, on_chunk=None, on_headers=None,
+                      priority=scheduler.INTERACTIVE):
+    """Download url into path using several parallel Range requests if the
+    file is larger than threshold bytes. Fall back to downloadFile when the
+    file is small or the server does not support ranges.
+    Segments are fetched in parallel only as far as the scheduler has free
+    slots for the given priority, the others by the calling thread."""
+    r = session.head(url, allow_redirects=True, headers={"Accept-Encoding": "identity"})
+    length = r.headers.get("Content-Length")
+    if r.status_code != 200 or length is None or not _supportsRanges(r) or connections < 2:
+        return downloadFile(session, url, path, resume=resume, on_chunk=on_chunk, on_headers=on_headers)
+    size = int(length)
+    if size < threshold:
+        return downloadFile(session, url, path, resume=resume, on_chunk=on_chunk, on_headers=on_headers)
+    if on_headers is not None:
+        on_headers(r.headers)
+
+    # Skip redirections for every segment
+    url = r.url
+    part_path = path + SEGMENTED_SUFFIX
+    with open(part_path, "wb") as f:
+        f.truncate(size)
+
+    segment_size = -(-size // connections)
+    bounds = [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+    print("Downloading {} in {} segments...".format(url, len(bounds)))
+    try:
+        scheduler.getScheduler().runEach(
+            lambda bound: _downloadSegment(session, url, part_path, bound[0], bound[1], on_chunk),
+            bounds, connections, url=url, priority=priority)
+    except Exception:
+        os.remove(part_path)
+        raise
+
+    os.replace(part_path, path)
+    return size
+
+
+def streamUrl(session, url, consumer, on_chunk=None, on_headers=None):
+    """Call consumer with an iterator over the content of url as it arrives,
+    for processing data without storing it first, and return its result."""
+    try:
+        with session.get(url, stream=True, headers={"Accept-Encoding": "identity"}) as r:
+            if r.status_code != 200:
+                raise DownloadError("URL not found: {}".format(url))
+            if on_headers is not None:
+                on_headers(r.headers)
+
+            def chunks():
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    if on_chunk is not None:
+                        on_chunk(chunk)
+                    yield chunk
+
+            return consumer(chunks())
+    except requests.RequestException as err:
+        raise DownloadError("Download of {} interrupted: {}".format(url, err))
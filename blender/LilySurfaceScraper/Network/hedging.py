@@ -0,0 +1,212 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Hedged requests. The latency of every request is recorded per host, and
+when the answer of a host takes longer than what it usually takes (a high
+percentile of its latency), a second request is raced against the first
+one, either to a mirror of the host or to the host itself, and the first
+response wins. When a host has mirrors, the fastest one is tried first.
+"""
+
+import concurrent.futures
+import threading
+import time
+from urllib.parse import urlparse, urlunparse
+
+from . import scheduler
+from .resilience import NetworkError, getBreaker
+from ..settings import MAX_DOWNLOAD_WORKERS
+
+# Upper bounds of the latency buckets, from 1ms to about a minute
+BUCKET_BOUNDS = [0.001 * 2 ** i for i in range(17)]
+# Samples needed before trusting the latency of a host
+MIN_SAMPLES = 8
+# Never hedge earlier than this, whatever the histogram says
+MIN_HEDGE_DELAY = 0.05  # seconds
+# Only requests without side effects can be sent twice
+HEDGED_METHODS = {"GET", "HEAD"}
+
+
+class LatencyHistogram():
+    """Time to response headers of the requests sent to a host"""
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        index = len(BUCKET_BOUNDS)
+        for i, bound in enumerate(BUCKET_BOUNDS):
+            if seconds <= bound:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.total += 1
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile, or None if
+        there are not enough samples yet"""
+        with self._lock:
+            if self.total < MIN_SAMPLES:
+                return None
+            rank = self.total * p / 100
+            seen = 0
+            for i, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    break
+        return BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else float("inf")
+
+
+# Attempts standing for requests of callers holding a slot of the scheduler
+_attempts = concurrent.futures.ThreadPoolExecutor(max_workers=2 * MAX_DOWNLOAD_WORKERS,
+                                                  thread_name_prefix="LilyHedging")
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def getHistogram(host):
+    with _histograms_lock:
+        if host not in _histograms:
+            _histograms[host] = LatencyHistogram()
+        return _histograms[host]
+
+
+def latencyReport():
+    """Return a dict mapping each host to (requests, median, 95th percentile)"""
+    with _histograms_lock:
+        hosts = dict(_histograms)
+    return {host: (h.total, h.percentile(50), h.percentile(95)) for host, h in hosts.items()}
+
+
+def replaceHost(url, host):
+    return urlunparse(urlparse(url)._replace(netloc=host))
+
+
+class HedgedSession():
+    """Wraps a ResilientSession to record latencies, pick the fastest mirror
+    and race a hedged request against slow ones. mirrors maps a host to a
+    list of hosts serving the very same paths. With a percentile of None,
+    requests are never hedged but still fail over to mirrors."""
+    def __init__(self, session, mirrors=None, percentile=95):
+        self.session = session
+        self.mirrors = mirrors or {}
+        self.percentile = percentile
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def candidates(self, url):
+        """Alternative URLs for the same resource, the most promising first"""
+        host = urlparse(url).netloc
+        hosts = [host] + [m for m in self.mirrors.get(host, []) if m != host]
+        if len(hosts) == 1:
+            return [url]
+
+        def score(h):
+            # Hosts that recently failed come last, and among the others,
+            # hosts we know nothing about yet come first to get measured
+            median = getHistogram(h).percentile(50)
+            return getBreaker(h).failures, median if median is not None else 0.0
+        hosts.sort(key=score)
+        available = [h for h in hosts if not getBreaker(h).isOpen()] or hosts
+        return [replaceHost(url, h) for h in available]
+
+    def hedgeDelay(self, url):
+        if self.percentile is None:
+            return None
+        delay = getHistogram(urlparse(url).netloc).percentile(self.percentile)
+        if delay is None or delay == float("inf"):
+            return None
+        return max(MIN_HEDGE_DELAY, delay)
+
+    def _attempt(self, method, url, kwargs):
+        start = time.monotonic()
+        r = self.session.request(method, url, **kwargs)
+        getHistogram(urlparse(url).netloc).record(time.monotonic() - start)
+        return r
+
+    def _launch(self, method, url, kwargs, hedge):
+        """Start an attempt and return its future. The first attempt, and the
+        fail overs following a failure, stand for the request of the caller,
+        which already holds a slot of the scheduler. A hedge needs a slot of
+        its own and is not sent if none is free, returning None."""
+        if hedge:
+            return scheduler.getScheduler().trySubmit(self._attempt, method, url, kwargs,
+                                                      url=url, priority=scheduler.PREFETCH)
+        return _attempts.submit(self._attempt, method, url, kwargs)
+
+    def request(self, method, url, **kwargs):
+        urls = self.candidates(url)
+        delay = self.hedgeDelay(urls[0]) if method in HEDGED_METHODS else None
+        launched = [urls[0]]
+        pending = {self._launch(method, urls[0], kwargs, hedge=False)}
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=delay,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                # Slower than usual, race another request against this one
+                hedge_url = urls[len(launched)] if len(launched) < len(urls) else urls[0]
+                future = self._launch(method, hedge_url, kwargs, hedge=True)
+                if future is not None:
+                    print("{} is slow to answer, also trying {}...".format(urls[0], hedge_url))
+                    launched.append(hedge_url)
+                    pending.add(future)
+                delay = None
+                continue
+            responses = []
+            for future in done:
+                err = future.exception()
+                if err is None:
+                    responses.append(future.result())
+                elif isinstance(err, NetworkError):
+                    error = err
+                else:
+                    for loser in pending:
+                        loser.add_done_callback(_closeResponse)
+                    raise err
+            if responses:
+                # Close the responses of the requests that lost the race
+                for r in responses[1:]:
+                    r.close()
+                for loser in pending:
+                    loser.add_done_callback(_closeResponse)
+                return responses[0]
+            remaining = [u for u in urls if u not in launched]
+            if not pending and remaining:
+                print("{}, trying {}...".format(error, remaining[0]))
+                launched.append(remaining[0])
+                pending.add(self._launch(method, remaining[0], kwargs, hedge=False))
+        raise error
+
+
+def _closeResponse(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
@@ -0,0 +1,155 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+On-disk cache for the small API and HTML responses scrapers parse to list
+variants. Entries remember their ETag and Last-Modified headers so that,
+once their time to live is over, they are revalidated with a conditional
+request and a '304 Not Modified' costs a single empty round-trip.
+"""
+
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .resilience import NetworkError
+
+
+class CachedResponse():
+    """Mimics the part of requests.Response that scrapers use"""
+    def __init__(self, url, status_code, headers, content, encoding=None):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class HttpCache():
+    # Headers worth keeping along with the body
+    kept_headers = ("Content-Type", "ETag", "Last-Modified")
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + ".json", base + ".body"
+
+    def load(self, url):
+        """Return the cache entry for url as a (meta, response) pair, or None"""
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                content = f.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url:
+            return None
+        response = CachedResponse(url, 200, meta["headers"], content, meta.get("encoding"))
+        return meta, response
+
+    def store(self, url, r):
+        meta_path, body_path = self._paths(url)
+        meta = {
+            "url": url,
+            "stored_at": time.time(),
+            "encoding": r.encoding,
+            "headers": {k: r.headers[k] for k in self.kept_headers if k in r.headers},
+        }
+        self._write(body_path, "wb", r.content)
+        self._write(meta_path, "w", meta)
+
+    def _write(self, path, mode, data):
+        """Write to a temporary file first so that concurrent readers never
+        see a half written entry"""
+        tmp_path = "{}.{}.{}.{}.tmp".format(path, socket.gethostname(), os.getpid(), threading.get_ident())
+        try:
+            with open(tmp_path, mode) as f:
+                if mode == "wb":
+                    f.write(data)
+                else:
+                    json.dump(data, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def touch(self, url, meta):
+        """Mark an entry as fresh again after a successful revalidation"""
+        meta_path, _ = self._paths(url)
+        meta["stored_at"] = time.time()
+        self._write(meta_path, "w", meta)
+
+    def get(self, session, url, ttl):
+        """Fetch url through the cache. Entries younger than ttl seconds are
+        returned without any network access, older ones are revalidated, and
+        still returned if the server cannot answer (network or 5xx error).
+        Return None if the resource could not be fetched."""
+        entry = self.load(url)
+        headers = {}
+        if entry is not None:
+            meta, cached = entry
+            if time.time() - meta["stored_at"] < ttl:
+                return cached
+            if "ETag" in cached.headers:
+                headers["If-None-Match"] = cached.headers["ETag"]
+            if "Last-Modified" in cached.headers:
+                headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+
+        try:
+            r = session.get(url, headers=headers)
+        except (requests.RequestException, NetworkError) as err:
+            if entry is None:
+                raise
+            print("Could not revalidate {} ({}), using cached copy.".format(url, err))
+            return entry[1]
+
+        if r.status_code == 304 and entry is not None:
+            self.touch(url, entry[0])
+            return entry[1]
+        if r.status_code >= 500 and entry is not None:
+            print("Could not revalidate {} (HTTP {}), using cached copy.".format(url, r.status_code))
+            return entry[1]
+        if r.status_code != 200:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        self.store(url, r)
+        return r
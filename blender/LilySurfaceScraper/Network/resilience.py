@@ -0,0 +1,238 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Fault tolerance for HTTP requests: every request gets a connect and read
+timeout, transient failures are retried with jittered exponential backoff
+(honouring Retry-After), an import can be bounded by an overall deadline,
+and a per-host circuit breaker fails fast while a provider is down instead
+of letting every request wait for its own timeout.
+"""
+
+import email.utils
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from . import stats
+
+# Responses worth retrying, the server is likely to recover
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_MAX = 30.0  # seconds
+# Consecutive failures after which a host is considered down
+BREAKER_THRESHOLD = 5
+# How long a host is considered down before letting a request probe it
+BREAKER_COOLDOWN = 30.0  # seconds
+
+
+class NetworkError(Exception):
+    pass
+
+
+class RequestFailed(NetworkError):
+    pass
+
+
+class CircuitOpenError(NetworkError):
+    pass
+
+
+class DeadlineExceeded(NetworkError):
+    pass
+
+
+class Deadline():
+    """Point in time after which an import gives up. A duration of 0 or
+    None means no deadline."""
+    def __init__(self, seconds=None):
+        self.end = time.monotonic() + seconds if seconds else None
+
+    def remaining(self):
+        if self.end is None:
+            return None
+        return self.end - time.monotonic()
+
+    def expired(self):
+        return self.end is not None and time.monotonic() >= self.end
+
+    def check(self, what=""):
+        if self.expired():
+            raise DeadlineExceeded("Import deadline exceeded {}".format(what).strip())
+
+
+class CircuitBreaker():
+    def __init__(self, host):
+        self.host = host
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return False while the host is considered down. Once the cooldown
+        is over, a single request is let through to probe it, and the others
+        keep failing fast until it succeeds. A probe that never reports back
+        is replaced after another cooldown."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at < BREAKER_COOLDOWN:
+                return False
+            if self.probe_started_at is not None and now - self.probe_started_at < BREAKER_COOLDOWN:
+                return False
+            self.probe_started_at = now
+            return True
+
+    def isOpen(self):
+        """Tell whether requests to the host currently fail fast, without
+        taking the probe like allow() does"""
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            now = time.monotonic()
+            return (now - self.opened_at < BREAKER_COOLDOWN
+                    or self.probe_started_at is not None and now - self.probe_started_at < BREAKER_COOLDOWN)
+
+    def recordSuccess(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started_at = None
+
+    def recordFailure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_started_at = None
+            if self.failures >= BREAKER_THRESHOLD:
+                if self.opened_at is None:
+                    print("Host {} looks down, failing fast for {}s".format(self.host, BREAKER_COOLDOWN))
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def getBreaker(host):
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+        return _breakers[host]
+
+
+def retryAfter(r):
+    """Delay in seconds requested by a Retry-After header, or None"""
+    value = r.headers.get("Retry-After")
+    if value is None:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+def backoffDelay(attempt):
+    """Full jitter exponential backoff"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class ResilientSession():
+    """Wraps a transport (or a requests.Session) to add timeouts, retries,
+    a deadline and circuit breaking to get() and head(). Any failure is raised
+    as a NetworkError, while a final HTTP error response is returned as is."""
+    def __init__(self, session, timeout, retries, deadline=None, request_stats=None):
+        self.session = session
+        self.timeout = timeout  # (connect, read) in seconds
+        self.retries = retries
+        self.deadline = deadline or Deadline()
+        # Counters that requests and received bytes are added to
+        self.request_stats = [stats.getStats()] + ([request_stats] if request_stats is not None else [])
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def _timeout(self):
+        connect, read = self.timeout
+        remaining = self.deadline.remaining()
+        if remaining is not None:
+            connect, read = min(connect, remaining), min(read, remaining)
+        return connect, read
+
+    def request(self, method, url, **kwargs):
+        host = urlparse(url).netloc
+        breaker = getBreaker(host)
+        self.deadline.check("while fetching {}".format(url))
+        if not breaker.allow():
+            raise CircuitOpenError("{} is not responding, try again later".format(breaker.host))
+        attempt = 0
+        while True:
+            if attempt > 0:
+                self.deadline.check("while fetching {}".format(url))
+
+            delay = None
+            for request_stats in self.request_stats:
+                request_stats.recordRequest(host)
+            try:
+                r = self.session.request(method, url, timeout=self._timeout(), **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                error = err
+            else:
+                if r.status_code not in RETRY_STATUSES:
+                    breaker.recordSuccess()
+                    return stats.CountedResponse(r, host, self.request_stats)
+                error = "HTTP {}".format(r.status_code)
+                delay = retryAfter(r)
+                too_late = delay is not None and delay > BACKOFF_MAX
+                if too_late:
+                    # Not worth waiting for, nor retrying before the server asks to
+                    print("{} asks to retry {} in {:.0f}s, giving up".format(host, url, delay))
+                if attempt >= self.retries or too_late:
+                    # A single failure per request, once retries are exhausted
+                    breaker.recordFailure()
+                    return stats.CountedResponse(r, host, self.request_stats)
+                r.close()
+
+            if attempt >= self.retries:
+                breaker.recordFailure()
+                raise RequestFailed("Could not fetch {}: {}".format(url, error))
+            if delay is None:
+                delay = backoffDelay(attempt)
+            remaining = self.deadline.remaining()
+            if remaining is not None and delay >= remaining:
+                raise DeadlineExceeded("Import deadline exceeded while fetching {}".format(url))
+            print("Fetching {} failed ({}), retrying in {:.1f}s...".format(url, error, delay))
+            for request_stats in self.request_stats:
+                request_stats.recordRetry()
+            time.sleep(delay)
+            attempt += 1
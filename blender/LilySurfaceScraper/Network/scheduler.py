@@ -0,0 +1,213 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Process-wide scheduler through which all downloads go. It enforces a global
+limit on concurrent transfers, a limit per host, and serves queued jobs by
+priority class so that background work (thumbnails, metadata prefetch)
+never delays the import an artist is waiting on. An optional bandwidth
+ceiling is shared by all transfers.
+"""
+
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+from ..settings import MAX_DOWNLOAD_WORKERS
+
+# Priority classes, lower is served first
+INTERACTIVE = 0
+THUMBNAIL = 1
+PREFETCH = 2
+
+# How much idle bandwidth budget can be spent at once, in seconds
+BANDWIDTH_BURST = 0.25
+
+
+def hostOf(url):
+    return urlparse(url if "://" in url else "https://" + url).netloc
+
+
+class DownloadScheduler():
+    def __init__(self, max_workers=MAX_DOWNLOAD_WORKERS, max_per_host=MAX_DOWNLOAD_WORKERS, bandwidth=0):
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.bandwidth = bandwidth  # bytes per second, 0 for unlimited
+        self._cond = threading.Condition()
+        self._queue = []
+        self._counter = itertools.count()
+        self._running = 0
+        self._running_per_host = Counter()
+        self._local = threading.local()
+        self._bandwidth_lock = threading.Lock()
+        self._bandwidth_clock = 0.0
+
+    def configure(self, max_workers, max_per_host, bandwidth):
+        with self._cond:
+            self.max_workers = max(1, max_workers)
+            self.max_per_host = max(1, max_per_host)
+            self.bandwidth = bandwidth
+            self._dispatch()
+
+    def submit(self, fn, *args, url="", priority=INTERACTIVE):
+        """Queue fn(*args) as a transfer to the host of url.
+        Return a concurrent.futures.Future."""
+        future = concurrent.futures.Future()
+        if self._isInsideJob():
+            # Already holding a slot, e.g. a map download fetching its
+            # redirection, so do not compete with ourselves for a new one
+            self._runJob(future, fn, args, None)
+            return future
+        with self._cond:
+            entry = (priority, next(self._counter), hostOf(url), future, fn, args)
+            heapq.heappush(self._queue, entry)
+            self._dispatch()
+        return future
+
+    def trySubmit(self, fn, *args, url="", priority=INTERACTIVE):
+        """Start fn(*args) as a transfer to the host of url right away if the
+        limits leave a slot for it and no job is waiting, without queuing it.
+        Return a concurrent.futures.Future, or None if it was not started."""
+        host = hostOf(url)
+        future = concurrent.futures.Future()
+        with self._cond:
+            if self._queue or not self._hasSlot(priority, host):
+                return None
+            future.set_running_or_notify_cancel()
+            self._running += 1
+            self._running_per_host[host] += 1
+        threading.Thread(target=self._runJob, args=(future, fn, args, host), daemon=True).start()
+        return future
+
+    def runEach(self, fn, items, max_workers, url="", priority=INTERACTIVE):
+        """Call fn(item) for each item, in the calling thread and in as many
+        other threads as there are free slots (see trySubmit), up to
+        max_workers threads in total. Items left once one call fails are
+        skipped, and its exception is raised when all threads are done."""
+        items = iter(items)
+        lock = threading.Lock()
+        failed = threading.Event()
+
+        def work():
+            while not failed.is_set():
+                with lock:
+                    item = next(items, None)
+                if item is None:
+                    return
+                try:
+                    fn(item)
+                except BaseException:
+                    failed.set()
+                    raise
+
+        helpers = []
+        for _ in range(max_workers - 1):
+            future = self.trySubmit(work, url=url, priority=priority)
+            if future is None:
+                break
+            helpers.append(future)
+        try:
+            work()
+        finally:
+            concurrent.futures.wait(helpers)
+        for future in helpers:
+            future.result()
+
+    def run(self, fn, *args, url="", priority=INTERACTIVE):
+        """Same as submit but block until the job is done and return its result"""
+        return self.submit(fn, *args, url=url, priority=priority).result()
+
+    def pending(self):
+        with self._cond:
+            return len(self._queue)
+
+    def _isInsideJob(self):
+        return getattr(self._local, "inside", False)
+
+    def _hasSlot(self, priority, host):
+        if self._running_per_host[host] >= self.max_per_host:
+            return False
+        # Keep one slot free for interactive imports
+        limit = self.max_workers
+        if priority > INTERACTIVE and limit > 1:
+            limit -= 1
+        return self._running < limit
+
+    def _dispatch(self):
+        """Start as many queued jobs as limits allow. Must hold self._cond."""
+        skipped = []
+        while self._queue and self._running < self.max_workers:
+            entry = heapq.heappop(self._queue)
+            priority, _, host, future, fn, args = entry
+            if not self._hasSlot(priority, host):
+                skipped.append(entry)
+                continue
+            if not future.set_running_or_notify_cancel():
+                continue
+            self._running += 1
+            self._running_per_host[host] += 1
+            threading.Thread(target=self._runJob, args=(future, fn, args, host), daemon=True).start()
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+
+    def _runJob(self, future, fn, args, host):
+        if host is None and not future.set_running_or_notify_cancel():
+            return
+        was_inside = self._isInsideJob()
+        self._local.inside = True
+        try:
+            result = fn(*args)
+        except BaseException as err:
+            future.set_exception(err)
+        else:
+            future.set_result(result)
+        finally:
+            self._local.inside = was_inside
+            if host is not None:
+                with self._cond:
+                    self._running -= 1
+                    self._running_per_host[host] -= 1
+                    self._dispatch()
+
+    def throttle(self, nbytes):
+        """Called by transfers for each chunk received, sleep as much as
+        needed to respect the bandwidth ceiling."""
+        if self.bandwidth <= 0:
+            return
+        with self._bandwidth_lock:
+            now = time.monotonic()
+            self._bandwidth_clock = max(self._bandwidth_clock, now - BANDWIDTH_BURST) + nbytes / self.bandwidth
+            delay = self._bandwidth_clock - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+_scheduler = DownloadScheduler()
+
+
+def getScheduler():
+    return _scheduler
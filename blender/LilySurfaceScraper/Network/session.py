@@ -0,0 +1,99 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Process-wide HTTP session shared by all scrapers. A single requests.Session
+keeps one connection pool per host so that consecutive calls to the same
+provider (API, thumbnails, maps) reuse their TCP/TLS connection instead of
+paying a fresh handshake every time.
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..settings import USER_AGENT, MAX_DOWNLOAD_WORKERS, MAX_POOLED_HOSTS
+
+_session = None
+_pool_size = MAX_DOWNLOAD_WORKERS
+_lock = threading.Lock()
+
+
+def _makeSession(pool_size):
+    session = requests.Session()
+    session.headers.update({"User-Agent": USER_AGENT})
+    adapter = HTTPAdapter(pool_connections=MAX_POOLED_HOSTS, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def getSession():
+    """Return the shared session, creating it on first use"""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = _makeSession(_pool_size)
+        return _session
+
+
+def newSession():
+    """Return a session configured like the shared one but with its own
+    connections, e.g. to measure without the connections kept alive"""
+    with _lock:
+        pool_size = _pool_size
+    return _makeSession(pool_size)
+
+
+def configure(pool_size):
+    """Resize per-host connection pools, typically to match the number of
+    concurrent downloads. The session is only rebuilt if the size changes.
+    The previous session is not closed, as downloads may still be streaming
+    through it: its connections go away once they are done with it."""
+    global _session, _pool_size
+    with _lock:
+        if pool_size == _pool_size:
+            return
+        _pool_size = pool_size
+        _session = None
+
+
+def connectionStats():
+    """Return a dict with the number of requests sent, connections opened,
+    and hence connections reused, summed over all the pooled hosts."""
+    stats = {"requests": 0, "connections": 0, "reused": 0}
+    with _lock:
+        if _session is None:
+            return stats
+        adapters = {id(a): a for a in _session.adapters.values()}.values()
+    for adapter in adapters:
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats["requests"] += pool.num_requests
+            stats["connections"] += pool.num_connections
+    stats["reused"] = max(0, stats["requests"] - stats["connections"])
+    return stats
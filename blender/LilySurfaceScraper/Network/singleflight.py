@@ -0,0 +1,91 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Registry of the downloads in flight in this process, indexed by their
+destination. When several imports need the same file at the same time,
+only the first one transfers it and the others wait for its result, rather
+than downloading it again into the very same staging file.
+"""
+
+import concurrent.futures
+import threading
+
+
+class Flight():
+    def __init__(self, key, fresh):
+        self.key = key
+        # Whether this call ignores what is already on disk (reinstall)
+        self.fresh = fresh
+        self.future = concurrent.futures.Future()
+
+
+class SingleFlight():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn, fresh=False):
+        """Call fn() and return its result, unless a call for the same key is
+        already running, in which case wait for it and return its result.
+        A fresh call (e.g. reinstalling a texture) only joins a call that was
+        itself fresh: otherwise it waits for it to finish then runs fn anew."""
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                if flight is None:
+                    flight = Flight(key, fresh)
+                    self._flights[key] = flight
+                    break
+            print("Waiting for the ongoing download of {}...".format(key))
+            try:
+                result = flight.future.result()
+            except Exception:
+                if fresh and not flight.fresh:
+                    continue
+                raise
+            if flight.fresh or not fresh:
+                return result
+
+        try:
+            result = fn()
+        except BaseException as err:
+            flight.future.set_exception(err)
+            raise
+        else:
+            flight.future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    def inFlight(self):
+        with self._lock:
+            return list(self._flights.keys())
+
+
+_downloads = SingleFlight()
+
+
+def getSingleFlight():
+    return _downloads
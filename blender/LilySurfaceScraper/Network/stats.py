@@ -0,0 +1,138 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Number of requests sent and bytes received per host. Counters are kept for
+the whole process and for each import, to spot redundant round-trips.
+"""
+
+import threading
+
+
+class RequestStats():
+    """Counters of requests, retries and bytes. Counts are also added to the
+    parent counters if any, e.g. those of the whole import for a single map."""
+    def __init__(self, parent=None):
+        self.hosts = {}  # host -> [requests, bytes]
+        self.retries = 0
+        self.parent = parent
+        self._lock = threading.Lock()
+
+    def recordRequest(self, host):
+        with self._lock:
+            self.hosts.setdefault(host, [0, 0])[0] += 1
+        if self.parent is not None:
+            self.parent.recordRequest(host)
+
+    def recordRetry(self):
+        with self._lock:
+            self.retries += 1
+        if self.parent is not None:
+            self.parent.recordRetry()
+
+    def recordBytes(self, host, nbytes):
+        with self._lock:
+            self.hosts.setdefault(host, [0, 0])[1] += nbytes
+        if self.parent is not None:
+            self.parent.recordBytes(host, nbytes)
+
+    def snapshot(self):
+        """Return a dict mapping hosts to (requests, bytes)"""
+        with self._lock:
+            return {host: tuple(counts) for host, counts in self.hosts.items()}
+
+    def total(self):
+        """Return the total number of requests and bytes"""
+        counts = self.snapshot().values()
+        return sum(c[0] for c in counts), sum(c[1] for c in counts)
+
+    def report(self):
+        hosts = self.snapshot()
+        requests, nbytes = self.total()
+        lines = ["{} requests, {} bytes received".format(requests, nbytes)]
+        for host, (host_requests, host_bytes) in sorted(hosts.items()):
+            lines.append("  {}: {} requests, {} bytes".format(host, host_requests, host_bytes))
+        return "\n".join(lines)
+
+
+def difference(before, after):
+    """Per-host counts between two snapshots, as a dict host -> (requests, bytes)"""
+    diff = {}
+    for host, (requests, nbytes) in after.items():
+        prev_requests, prev_bytes = before.get(host, (0, 0))
+        if requests != prev_requests or nbytes != prev_bytes:
+            diff[host] = (requests - prev_requests, nbytes - prev_bytes)
+    return diff
+
+
+class CountedResponse():
+    """Wraps a response to count the bytes of its body as it gets read"""
+    def __init__(self, response, host, stats):
+        self._response = response
+        self._host = host
+        self._stats = stats
+        self._counted = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def _record(self, nbytes):
+        for stats in self._stats:
+            stats.recordBytes(self._host, nbytes)
+
+    @property
+    def content(self):
+        content = self._response.content
+        if not self._counted:
+            self._counted = True
+            self._record(len(content))
+        return content
+
+    @property
+    def text(self):
+        self.content
+        return self._response.text
+
+    def json(self):
+        self.content
+        return self._response.json()
+
+    def iter_content(self, chunk_size=1):
+        self._counted = True
+        for chunk in self._response.iter_content(chunk_size):
+            self._record(len(chunk))
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._response.close()
+
+
+_stats = RequestStats()
+
+
+def getStats():
+    """Counters of the whole process"""
+    return _stats
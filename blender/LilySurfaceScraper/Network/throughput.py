@@ -0,0 +1,86 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Download throughput measured on recent imports, used to tell how long
+fetching a variant would take. Every import that actually transferred
+something updates an exponentially weighted moving average, so that the
+estimate follows changes of network conditions without jumping around.
+"""
+
+import threading
+
+# Weight of the latest import in the average
+SMOOTHING = 0.3
+# Smaller imports are dominated by latency and say little about bandwidth
+MIN_SAMPLE_BYTES = 1 << 20
+
+
+class ThroughputMeter():
+    def __init__(self):
+        self.rate = None  # bytes per second
+        self._lock = threading.Lock()
+
+    def record(self, nbytes, seconds):
+        if nbytes < MIN_SAMPLE_BYTES or seconds <= 0:
+            return
+        with self._lock:
+            sample = nbytes / seconds
+            if self.rate is None:
+                self.rate = sample
+            else:
+                self.rate = SMOOTHING * sample + (1 - SMOOTHING) * self.rate
+
+    def estimate(self, nbytes):
+        """Seconds needed to download nbytes, or None if unknown"""
+        with self._lock:
+            if self.rate is None or nbytes is None:
+                return None
+            return nbytes / self.rate
+
+
+_meter = ThroughputMeter()
+
+
+def getMeter():
+    return _meter
+
+
+def formatSize(nbytes):
+    if nbytes is None:
+        return "?"
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1024 or unit == "GB":
+            break
+        nbytes /= 1024
+    return "{:.0f} {}".format(nbytes, unit) if unit == "B" else "{:.1f} {}".format(nbytes, unit)
+
+
+def formatDuration(seconds):
+    if seconds is None:
+        return "?"
+    if seconds < 60:
+        return "{:.0f}s".format(max(1, seconds))
+    if seconds < 3600:
+        return "{:.0f}min".format(seconds / 60)
+    return "{:.1f}h".format(seconds / 3600)
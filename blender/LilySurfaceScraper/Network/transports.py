@@ -0,0 +1,426 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Transport backends, i.e. what actually sends the requests. All of them
+return objects that behave like requests.Response for the part that the
+scrapers use (status_code, headers, url, content, text, json(),
+iter_content(), close()) so that they are interchangeable:
+ - 'REQUESTS' uses the shared requests session (HTTP/1.1, keep-alive);
+ - 'HTTP2' uses httpx, when available, to multiplex all the requests to a
+   host over a single connection;
+ - 'LOCAL' serves file:// URLs and maps http(s) URLs to a local directory,
+   for offline mirrors and tests.
+"""
+
+import concurrent.futures
+import email.utils
+import importlib.util
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse, quote
+from urllib.request import url2pathname
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from . import session, cachingProxy
+from ..settings import USER_AGENT, MAX_DOWNLOAD_WORKERS
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+CHUNK_SIZE = 1 << 16
+
+
+# These derive from requests' exceptions so that errors raised by any
+# backend are handled like the ones of the default backend.
+class TransportError(requests.ConnectionError):
+    pass
+
+
+class TransportTimeout(TransportError, requests.Timeout):
+    pass
+
+
+class Transport():
+    name = None
+
+    def request(self, method, url, headers=None, stream=False, allow_redirects=True, timeout=None):
+        raise NotImplementedError
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def stream(self, url, **kwargs):
+        return self.request("GET", url, stream=True, **kwargs)
+
+    def range(self, url, start, end, **kwargs):
+        """Get bytes start to end (included) of url"""
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers["Range"] = "bytes={}-{}".format(start, end)
+        return self.request("GET", url, headers=headers, **kwargs)
+
+    def close(self):
+        pass
+
+
+# -----------------------------------------------------------------------------
+
+class RequestsTransport(Transport):
+    name = 'REQUESTS'
+
+    def __init__(self, http=None):
+        """Send requests through http, a requests.Session, or through the
+        shared session if None"""
+        self.http = http
+
+    def request(self, method, url, **kwargs):
+        http = self.http if self.http is not None else session.getSession()
+        return http.request(method, url, **kwargs)
+
+    def close(self):
+        if self.http is not None:
+            self.http.close()
+
+
+# -----------------------------------------------------------------------------
+
+class HttpxResponse():
+    """Wraps a httpx.Response to look like a requests.Response"""
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+
+    @property
+    def content(self):
+        with _httpxErrors():
+            return self.response.read()
+
+    @property
+    def encoding(self):
+        return self.response.encoding
+
+    @property
+    def text(self):
+        self.content
+        return self.response.text
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        with _httpxErrors():
+            yield from self.response.iter_bytes(chunk_size)
+
+    def close(self):
+        self.response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _httpxErrors():
+    """Context manager translating httpx exceptions into transport errors"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            return False
+        if issubclass(exc_type, httpx.TimeoutException):
+            raise TransportTimeout(str(exc)) from exc
+        if issubclass(exc_type, httpx.TransportError):
+            raise TransportError(str(exc)) from exc
+        return False
+
+
+class Http2Transport(Transport):
+    name = 'HTTP2'
+
+    def __init__(self):
+        if httpx is None:
+            raise ImportError("The HTTP/2 transport requires the httpx module")
+        self.client = httpx.Client(
+            http2=importlib.util.find_spec("h2") is not None,
+            headers={"User-Agent": USER_AGENT},
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=MAX_DOWNLOAD_WORKERS),
+        )
+
+    def request(self, method, url, headers=None, stream=False, allow_redirects=True, timeout=None):
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            timeout = httpx.Timeout(read, connect=connect)
+        with _httpxErrors():
+            request = self.client.build_request(method, url, headers=headers, timeout=timeout)
+            response = self.client.send(request, stream=True, follow_redirects=allow_redirects)
+            if not stream:
+                try:
+                    response.read()
+                finally:
+                    response.close()
+        return HttpxResponse(response)
+
+    def close(self):
+        self.client.close()
+
+
+# -----------------------------------------------------------------------------
+
+class LocalResponse():
+    def __init__(self, url, status_code, headers=None, path=None, start=0, length=0):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.encoding = "utf-8"
+        self.path = path
+        self.start = start
+        self.length = length
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        if self.path is None:
+            return
+        remaining = self.length
+        with open(self.path, 'rb') as f:
+            f.seek(self.start)
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    @property
+    def content(self):
+        return b"".join(self.iter_content())
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class LocalTransport(Transport):
+    """Serves file:// URLs, and http(s)://host/path?query from
+    <root>/host/path@query (the query being percent-encoded)."""
+    name = 'LOCAL'
+
+    def __init__(self, root=""):
+        self.root = root
+
+    def localPath(self, url):
+        parsed = urlparse(url)
+        if parsed.scheme == "file":
+            return url2pathname(parsed.path)
+        if not self.root:
+            return None
+        path = parsed.path.lstrip("/") or "index.html"
+        if parsed.query:
+            path += "@" + quote(parsed.query, safe="")
+        return os.path.join(self.root, parsed.netloc, *path.split("/"))
+
+    def request(self, method, url, headers=None, stream=False, allow_redirects=True, timeout=None):
+        path = self.localPath(url)
+        if path is None or not os.path.isfile(path):
+            return LocalResponse(url, 404, {"Content-Length": "0"})
+        return serveFile(url, path, method, headers)
+
+
+class ProxyTransport(Transport):
+    """Sends requests through a caching proxy (see cachingProxy.py) shared by
+    several instances, falling back to direct requests while it is down."""
+    name = 'PROXY'
+    RETRY_DELAY = 30.0  # seconds before trying an unreachable proxy again
+
+    def __init__(self, proxy_url, transport):
+        self.proxy_url = proxy_url.rstrip("/")
+        self.transport = transport
+        self.unreachable_since = None
+
+    def request(self, method, url, allow_redirects=True, **kwargs):
+        proxied = url.startswith(self.proxy_url + "/")
+        down = self.unreachable_since is not None and time.time() - self.unreachable_since < self.RETRY_DELAY
+        if proxied or down or not allow_redirects:
+            # The proxy follows redirections, so requests that must see
+            # them go straight to the source
+            return self.transport.request(method, url, allow_redirects=allow_redirects, **kwargs)
+        try:
+            response = self.transport.request(method, cachingProxy.proxiedUrl(self.proxy_url, url),
+                                              allow_redirects=allow_redirects, **kwargs)
+        except requests.ConnectionError as err:
+            if isinstance(err, requests.Timeout):
+                raise
+            print("Caching proxy {} unreachable, fetching directly: {}".format(self.proxy_url, err))
+            self.unreachable_since = time.time()
+            return self.transport.request(method, url, allow_redirects=allow_redirects, **kwargs)
+        self.unreachable_since = None
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+def serveFile(url, path, method="GET", headers=None):
+    """Answer a request for url with the content of the local file at path,
+    honouring Range and If-None-Match headers"""
+    try:
+        stat = os.stat(path)
+    except OSError as err:
+        raise TransportError(str(err)) from err
+
+    size = stat.st_size
+    headers = CaseInsensitiveDict(headers or {})
+    response_headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Type": (mimetypes.guess_type(urlparse(url).path)[0] or mimetypes.guess_type(path)[0]
+                         or "application/octet-stream"),
+        "Last-Modified": email.utils.formatdate(stat.st_mtime, usegmt=True),
+        "ETag": '"{:x}-{:x}"'.format(int(stat.st_mtime), size),
+    }
+    status, start, end = 200, 0, size - 1
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", headers.get("Range", "").strip())
+    if match is not None and (match.group(1) or match.group(2)):
+        if match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        else:
+            start = max(0, size - int(match.group(2)))
+        if start >= size or start > end:
+            response_headers["Content-Range"] = "bytes */{}".format(size)
+            response_headers["Content-Length"] = "0"
+            return LocalResponse(url, 416, response_headers)
+        status = 206
+        response_headers["Content-Range"] = "bytes {}-{}/{}".format(start, end, size)
+    elif headers.get("If-None-Match") == response_headers["ETag"]:
+        return LocalResponse(url, 304, response_headers)
+
+    length = end - start + 1
+    response_headers["Content-Length"] = str(length)
+    if method == "HEAD":
+        return LocalResponse(url, status, response_headers)
+    return LocalResponse(url, status, response_headers, path, start, length)
+
+
+# -----------------------------------------------------------------------------
+
+BACKENDS = {
+    'REQUESTS': RequestsTransport,
+    'HTTP2': Http2Transport,
+    'LOCAL': LocalTransport,
+}
+
+_transports = {}
+_lock = threading.Lock()
+
+
+def makeTransport(name, local_root=""):
+    """Create a new transport of the given backend name"""
+    if name == 'LOCAL':
+        return LocalTransport(local_root)
+    return BACKENDS[name]()
+
+
+def getTransport(name='REQUESTS', local_root=""):
+    """Return the shared transport of the given backend, falling back to the
+    default one if it is not available"""
+    key = (name, local_root if name == 'LOCAL' else "")
+    with _lock:
+        if key not in _transports:
+            try:
+                _transports[key] = makeTransport(name, local_root)
+            except ImportError as err:
+                print("{}, falling back to the default transport.".format(err))
+                _transports[key] = RequestsTransport()
+        return _transports[key]
+
+
+def getProxyTransport(proxy_url, transport):
+    """Return the shared transport sending requests through proxy_url"""
+    key = ('PROXY', proxy_url, id(transport))
+    with _lock:
+        if key not in _transports:
+            _transports[key] = ProxyTransport(proxy_url, transport)
+        return _transports[key]
+
+
+def availableBackends():
+    names = ['REQUESTS', 'LOCAL']
+    if httpx is not None:
+        names.insert(1, 'HTTP2')
+    return names
+
+
+def benchmark(urls, names=None, local_root="", timeout=(10.0, 60.0)):
+    """Fetch all urls concurrently, as the maps of a material would be, with
+    a fresh transport of each backend. Return a dict mapping backend names to
+    (seconds, bytes received, number of failed requests)."""
+    results = {}
+    for name in names or availableBackends():
+        if name == 'REQUESTS':
+            # Not the shared session, whose connections are already open
+            transport = RequestsTransport(session.newSession())
+        else:
+            transport = makeTransport(name, local_root)
+
+        def fetch(url):
+            try:
+                with transport.get(url, stream=True, timeout=timeout) as r:
+                    if r.status_code != 200:
+                        return 0, 1
+                    return sum(len(chunk) for chunk in r.iter_content(CHUNK_SIZE)), 0
+            except requests.RequestException:
+                return 0, 1
+
+        start = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(urls))) as executor:
+            outcomes = list(executor.map(fetch, urls))
+        results[name] = (time.monotonic() - start,
+                         sum(o[0] for o in outcomes),
+                         sum(o[1] for o in outcomes))
+        transport.close()
+    return results
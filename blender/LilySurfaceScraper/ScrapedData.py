@@ -21,8 +21,16 @@
 # This file is part of LilySurfaceScraper, a Blender add-on to import materials
 # from a single URL
 
-from .settings import UNSUPPORTED_PROVIDER_ERR
+import concurrent.futures
+import threading
+import time
+
+from .settings import UNSUPPORTED_PROVIDER_ERR, VARIANT_SIZES_TTL
 from .ScrapersManager import ScrapersManager
+from .Network import throughput
+from .Network.download import DownloadResult
+from .Storage import usage
+from . import worker
 
 
 class ScrapedData():
@@ -54,6 +62,10 @@ class ScrapedData():
         self.metadata = None
         self._scraper = type(self).makeScraper(self.url)
         self.reinstall = False
+        self._sizes_future = None
+        self._worker_preferences = None
+        # DownloadResult of each map fetched by selectVariant, by map name
+        self.download_results = {}
 
         if self._scraper is None:
             self.error = scraping_type.capitalize() + " " + UNSUPPORTED_PROVIDER_ERR
@@ -70,6 +82,7 @@ class ScrapedData():
             return None
         if self.metadata is not None:
             return self.metadata.variants
+        self._scraper.startDeadline()
         if self.asset_name is not None:
             self._scraper.getVariantData(self.asset_name)
         else:
@@ -79,13 +92,81 @@ class ScrapedData():
             self.error = self._scraper.error
         return self.metadata.variants
 
+    def useWorker(self, preferences):
+        """Run selectVariant in the download worker process (see worker.py),
+        with preferences a dict of the values of the add-on preferences"""
+        self._worker_preferences = preferences
+
     def selectVariant(self, variant_index):
         if self.error is not None:
             return False
+        if self._worker_preferences is not None:
+            try:
+                return self._selectVariantInWorker(variant_index)
+            except worker.WorkerError as err:
+                print("{}, importing in Blender instead.".format(err))
         if self.metadata is None:
             self.getVariantList()
-        if not self._scraper.fetchVariant(variant_index, self):
+        self._scraper.startDeadline()
+        start, received = time.monotonic(), self._scraper.received
+        self._scraper.download_results = {}
+        ok = self._scraper.fetchVariant(variant_index, self)
+        self.download_results = self._scraper.download_results
+        if not ok:
             return False
+        throughput.getMeter().record(self._scraper.received - received, time.monotonic() - start)
+        print("Imported {}: {}".format(self.name, self._scraper.request_stats.report()))
+        for result in self.failedDownloads():
+            print("Missing map {}".format(result))
+        usage.recordAccess(self._scraper.getTextureRoot(), [p for p in self.maps.values() if isinstance(p, str)])
+        return True
+
+    def failedDownloads(self):
+        """Return the DownloadResult of maps that could not be fetched"""
+        return [r for r in self.download_results.values() if not r.ok]
+
+    def retryFailedMaps(self):
+        """Download again only the maps that failed, filling self.maps with
+        those that succeed this time. Return the results still failing."""
+        failed = self.failedDownloads()
+        if not failed:
+            return []
+        self._scraper.startDeadline()
+        self._scraper.download_results = self.download_results
+        for result in self._scraper.retryMaps(failed):
+            if result.ok:
+                self.maps[result.name] = result.path
+            print("Retried map {}".format(result))
+        return self.failedDownloads()
+
+    def _selectVariantInWorker(self, variant_index):
+        last_report = [time.monotonic()]
+
+        def onProgress(received):
+            if time.monotonic() - last_report[0] >= 1.0:
+                print("Received {}...".format(throughput.formatSize(received)))
+                last_report[0] = time.monotonic()
+
+        result = worker.getWorker().run({
+            "op": "import",
+            "kind": self._scraper.metadata.scrape_type,
+            "url": self.url,
+            "asset_name": self.asset_name,
+            "texture_root": self.texture_root,
+            "variant": variant_index,
+            "reinstall": self.reinstall,
+            "deep_check": self._scraper.metadata.deep_check,
+            "preferences": self._worker_preferences,
+        }, onProgress)
+        self.download_results = {r["name"]: DownloadResult.fromDict(r) for r in result.get("results", [])}
+        if not result["ok"]:
+            self._scraper.error = result.get("error")
+            if self._scraper.error:
+                print(self._scraper.error)
+            return False
+        self.name = result["name"]
+        self.maps.update(result["maps"])
+        throughput.getMeter().record(result["received"], result["seconds"])
         return True
 
     def setReinstall(self, value):
@@ -93,4 +174,45 @@ class ScrapedData():
         self._scraper.reinstall = value
 
     def isDownloaded(self, variant):
-        return self._scraper.isDownloaded(variant)
+        """Only asks remote storage in getVariantSizes, as it is called while drawing"""
+        return self._scraper.isDownloaded(variant, remote=False)
+
+    def variantSizesPending(self):
+        """Tell whether variant sizes are being measured in the background"""
+        return self._sizes_future is not None and not self._sizes_future.done()
+
+    def getVariantSizes(self, timeout=0):
+        """Return a dict mapping variant names to the number of bytes they
+        need to download and take on disk (either may be None if unknown).
+        Sizes are cached in the asset metadata and measured again in the
+        background when outdated, waiting at most timeout seconds for them.
+        The background thread also checks which variants a remote storage
+        backend holds, for isDownloaded."""
+        if self.error is not None or self.metadata is None:
+            return {}
+        sizes = self.metadata.custom.get("variant_sizes", {})
+        age = time.time() - self.metadata.custom.get("variant_sizes_time", 0)
+        outdated = not sizes or age > VARIANT_SIZES_TTL
+        if self._sizes_future is None and (outdated or self._scraper.getStorage().remote):
+            future = concurrent.futures.Future()
+            cached_sizes = sizes
+
+            def refresh():
+                try:
+                    result = self._scraper.fetchVariantSizes() if outdated else cached_sizes
+                    for variant in self.metadata.variants:
+                        self._scraper.isDownloaded(variant)
+                    future.set_result(result)
+                except Exception as err:
+                    future.set_exception(err)
+            threading.Thread(target=refresh, daemon=True).start()
+            self._sizes_future = future
+
+        if self._sizes_future is not None:
+            try:
+                sizes = self._sizes_future.result(timeout=timeout)
+            except concurrent.futures.TimeoutError:
+                pass
+            except Exception as err:
+                print("Could not measure the size of variants: {}".format(err))
+        return sizes
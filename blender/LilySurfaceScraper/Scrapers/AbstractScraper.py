@@ -21,8 +21,13 @@
 # This file is part of LilySurfaceScraper, a Blender add-on to import materials
 # from a single URL
 import concurrent.futures
+import functools
 import os
+import socket
 import string
+import threading
+import time
+import zipfile
 
 import sys
 import platform
@@ -30,13 +35,18 @@ arch = "arm" if platform.machine().startswith("arm") else "x86"
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "site-packages", arch))
 from lxml import etree
 
-import requests
-import shutil
 import re
 
 from ..metadataHandler import Metadata
-from ..settings import TEXTURE_DIR
-from ..preferences import getPreferences
+from ..settings import TEXTURE_DIR, HTTP_CACHE_DIR, BLOB_STORE_DIR, MANIFEST_FILE, MAX_EXTRACT_WORKERS
+from ..Network import session, download, scheduler, resilience, hedging, transports, cassette, stats
+from ..Network.singleflight import getSingleFlight
+from ..Network.httpCache import HttpCache
+from ..Archives import zipStream, zipExtract
+from ..Archives.remoteZip import RemoteZip, RangesUnsupported
+from ..Archives.manifest import Manifest
+from ..Storage import backends, blobStore, locks
+from ..preferenceAccess import getPreferences
 
 
 class AbstractScraper():
@@ -55,6 +65,15 @@ class AbstractScraper():
 
     metadata_filename = ".meta"
 
+    # Hosts serving the same files as another host, e.g.
+    # {"dl.example.com": ["cdn1.example.com", "cdn2.example.com"]}
+    mirror_hosts = {}
+
+    # Translate the map names of the source into our internal map names
+    maps_tr = {}
+    # Internal names of the maps packed in an ARM map
+    arm_maps = ("ambientOcclusion", "roughness", "metallic")
+
     @staticmethod
     def sortTextWithNumbers(text):
         return [int(i) if i.isdigit() else i for i in re.split(r'(\d+)', text)]
@@ -69,27 +88,101 @@ class AbstractScraper():
         self.error = None
         self.texture_root = texture_root
         self.reinstall = False
+        # Priority class of the downloads issued by this scraper
+        self.priority = scheduler.INTERACTIVE
+        self.deadline = resilience.Deadline()
+        # Decoded JSON documents already fetched in bulk, by URL
+        self.prefetched = {}
+        # Requests sent and bytes received per host by this scraper
+        self.request_stats = stats.RequestStats()
+        # Bytes received so far by this scraper
+        self.received = 0
+        self._received_lock = threading.Lock()
+        # DownloadResult of each map fetched by the last fetchVariant
+        self.download_results = {}
+
+    @classmethod
+    def getSession(cls, deadline=None, request_stats=None):
+        """HTTP session used for all requests of this scraper. The transport
+        selected in preferences is shared so that connections to a given host
+        are kept alive, optionally sent through the caching proxy, and wrapped
+        to add timeouts, retries, circuit breaking and hedging of slow
+        requests."""
+        pref = getPreferences()
+        session.configure(pref.max_downloads)
+        transport = transports.getTransport(pref.transport, pref.local_mirror_dir)
+        if pref.proxy_url and pref.transport != 'LOCAL':
+            transport = transports.getProxyTransport(pref.proxy_url, transport)
+        if pref.cassette_mode != 'OFF' and pref.cassette_dir:
+            transport = cassette.getCassette(pref.cassette_mode, pref.cassette_dir, transport,
+                                             pref.cassette_max_body * 1024, pref.replay_latency / 1000,
+                                             pref.replay_bandwidth * 1024)
+        resilient = resilience.ResilientSession(transport,
+                                                timeout=(pref.connect_timeout, pref.read_timeout),
+                                                retries=pref.max_retries,
+                                                deadline=deadline,
+                                                request_stats=request_stats)
+        percentile = pref.hedge_percentile if pref.hedge_requests else None
+        if pref.cassette_mode == 'REPLAY':
+            # Keep the number of requests deterministic
+            percentile = None
+        return hedging.HedgedSession(resilient, cls.mirror_hosts, percentile)
+
+    def startDeadline(self):
+        """Start counting the time allowed to the current import step"""
+        self.deadline = resilience.Deadline(getPreferences().import_deadline)
+
+    @classmethod
+    def getScheduler(cls):
+        """Process-wide scheduler that all transfers go through"""
+        pref = getPreferences()
+        sched = scheduler.getScheduler()
+        sched.configure(pref.max_downloads, pref.max_downloads_per_host, pref.bandwidth_limit * 1024)
+        return sched
 
     @classmethod
-    def _fetch(cls, url):
-        headers = {"User-Agent":"Mozilla/5.0"}  # fake user agent
-        r = requests.get(url if "https://" in url else "https://" + url, headers=headers)
+    def _fetch(cls, url, priority=scheduler.INTERACTIVE, request_stats=None):
+        url = url if "://" in url else "https://" + url
+        try:
+            r = cls.getScheduler().run(cls.getSession(request_stats=request_stats).get, url,
+                                       url=url, priority=priority)
+        except resilience.NetworkError as err:
+            print(err)
+            return None
         if r.status_code != 200:
             return None
         else:
             return r
 
+    def _fetchCached(self, url):
+        """Same as _fetch, but going through the on-disk HTTP cache. Use it for
+        API and page requests whose content rarely changes."""
+        pref = getPreferences()
+        if not pref.use_http_cache:
+            return self._fetch(url, self.priority, self.request_stats)
+        cache = HttpCache(self.getTextureDirectory(HTTP_CACHE_DIR))
+        url = url if "://" in url else "https://" + url
+        http = self.getSession(self.deadline, self.request_stats)
+        try:
+            return self.getScheduler().run(cache.get, http, url,
+                                           pref.http_cache_ttl * 3600, url=url, priority=self.priority)
+        except resilience.NetworkError as err:
+            print(err)
+            return None
+
     def fetchHtml(self, url):
         """Get a lxml.etree object representing the scraped page.
         Use xpath queries to browse it."""
-        r = self._fetch(url)
+        r = self._fetchCached(url)
         if r is not None:
             return etree.HTML(r.text)
         else:
             self.error = "URL not found: {}".format(url)
 
     def fetchJson(self, url):
-        r = self._fetch(url)
+        if url in self.prefetched:
+            return self.prefetched[url]
+        r = self._fetchCached(url)
         if r is not None:
             return r.json()
         else:
@@ -98,23 +191,27 @@ class AbstractScraper():
     def fetchXml(self, url):
         """Get a lxml.etree object representing the scraped page.
         Use xpath queries to browse it."""
-        r = self._fetch(url)
+        r = self._fetchCached(url)
         if r is not None:
             return etree.fromstring(r.text)
         else:
             self.error = "URL not found: {}".format(url)
 
     def getRedirection(self, url):
-        headers = {"User-Agent":"Mozilla/5.0"}  # fake user agent
-        url = url if "https://" in url else "https://" + url
-        r = requests.get(url, headers=headers, allow_redirects=False)
+        url = url if "://" in url else "https://" + url
+        get = functools.partial(AbstractScraper.getSession().get, allow_redirects=False)
+        try:
+            r = AbstractScraper.getScheduler().run(get, url, url=url)
+        except resilience.NetworkError as err:
+            print(err)
+            return None
         if r.status_code == 302:
             return r.headers.get("Location")
         else:
             return None
 
-    def getTextureDirectory(self, material_name):
-        """Return the texture dir, relative to the blend file, dependent on material's name"""
+    def getTextureRoot(self):
+        """Return the absolute path of the texture dir set in preferences"""
         texture_dir = getPreferences().texture_dir
         if texture_dir == "":
             texture_dir = TEXTURE_DIR
@@ -122,44 +219,183 @@ class AbstractScraper():
             texture_dir = texture_dir[2:]
         if not os.path.isabs(texture_dir):
             texture_dir = os.path.realpath(os.path.join(self.texture_root, texture_dir))
+        return texture_dir
+
+    def getTextureDirectory(self, material_name):
+        """Return the texture dir, relative to the blend file, dependent on material's name"""
         name_path = material_name.replace('/', os.path.sep)
-        dirpath = os.path.join(texture_dir, name_path)
+        dirpath = os.path.join(self.getTextureRoot(), name_path)
         os.makedirs(dirpath, exist_ok=True)
         return dirpath
 
-    def _downloadFunc(self, url):
+    def getStorage(self):
+        """Storage backend sharing downloaded files with other machines"""
+        pref = getPreferences()
+        if pref.storage_backend == 'S3':
+            return backends.getStorage('S3', bucket=pref.s3_bucket, prefix=pref.s3_prefix,
+                                       endpoint_url=pref.s3_endpoint, cache_root=self.getTextureRoot(),
+                                       cache_size=pref.storage_cache_size * 1024 * 1024)
+        if pref.storage_backend == 'SHARED':
+            return backends.getStorage('SHARED', directory=os.path.expanduser(pref.shared_cache_dir))
+        return backends.getStorage()
+
+    def storageKey(self, path):
+        """Key of a file of the texture dir in the storage backend"""
+        return os.path.relpath(path, self.getTextureRoot()).replace(os.path.sep, "/")
+
+    def getBlobStore(self):
+        """Content-addressed store that downloaded files are linked to, or
+        None if deduplication is disabled"""
+        if not getPreferences().deduplicate_textures:
+            return None
+        return blobStore.getBlobStore(os.path.join(self.getTextureRoot(), BLOB_STORE_DIR))
+
+    def deduplicate(self, path, digest=None):
+        """Replace the file at path by a link to an identical one if any"""
+        store = self.getBlobStore()
+        if store is None:
+            return
+        try:
+            saved = store.ingest(path, digest)
+        except OSError as err:
+            print("Could not deduplicate {}: {}".format(path, err))
+            return
+        if saved:
+            print("Deduplicated {} ({} bytes saved).".format(path, saved))
+
+    def deduplicateTree(self, directory, names, digests=None):
+        """Deduplicate the given files of directory, e.g. extracted maps"""
+        store = self.getBlobStore()
+        if store is not None:
+            saved = store.ingestTree(directory, names, digests)
+            if saved:
+                print("Deduplicated maps of {} ({} bytes saved).".format(directory, saved))
+
+    def fetchStoredFiles(self, directory, names):
+        """Copy the given files of directory from the storage backend, when
+        it has them"""
+        storage = self.getStorage()
+        for name in names:
+            path = os.path.join(directory, name)
+            storage.fetch(self.storageKey(path), path)
+
+    def isStored(self, path, remote=True):
+        """Tell whether the file or directory at path is available, either
+        locally or in the storage backend. Unless remote is True, a remote
+        backend is not asked, only what it already told is used."""
+        if os.path.exists(path):
+            return True
+        storage = self.getStorage()
+        return storage.exists(self.storageKey(path)) if remote else storage.isKnown(self.storageKey(path))
+
+    def _chunkCallback(self, url):
+        """Function called for each block of data received from url"""
+        sched = self.getScheduler()
+
+        def onChunk(chunk):
+            self.deadline.check("while downloading {}".format(url))
+            with self._received_lock:
+                self.received += len(chunk)
+            sched.throttle(len(chunk))
+        return onChunk
+
+    def _download(self, url, path, request_stats, on_headers=None):
+        """Download url into path, raising DownloadError or NetworkError.
+        Return the SHA-256 of the file if it could be computed on the fly."""
+        pref = getPreferences()
+        sched = self.getScheduler()
+        onChunk = self._chunkCallback(url)
+        http = self.getSession(self.deadline, request_stats)
+        if pref.use_segmented_download:
+            sched.run(download.downloadSegmented, http, url, path,
+                      pref.segment_connections, pref.segment_threshold * 1024 * 1024,
+                      not self.reinstall, onChunk, on_headers, self.priority,
+                      url=url, priority=self.priority)
+            return None
+        hashing = blobStore.HashingCallback(onChunk)
+        sched.run(download.downloadFile, http, url, path,
+                  not self.reinstall, hashing, on_headers,
+                  url=url, priority=self.priority)
+        return hashing.digestFor(path)
+
+    def _downloadFunc(self, url, on_headers=None):
         def func(path):
-            headers = {"User-Agent": "Mozilla/5.0"}  # fake user agent
-            r = requests.get(url, stream=True, headers=headers)
-            if r.status_code == 200:
-                with open(path, 'wb') as f:
-                    r.raw.decode_content = True
-                    shutil.copyfileobj(r.raw, f)
-            else:
-                self.error = "URL not found: {}".format(url)
+            try:
+                return self._download(url, path, self.request_stats, on_headers)
+            except (download.DownloadError, resilience.NetworkError) as err:
+                self.error = str(err)
                 return -1
         return func
 
+    def fetchMap(self, url, material_name, map_name, force_ext=False):
+        """Download a map like fetchImage, and return a DownloadResult.
+        It does not touch self.error, so that maps can be fetched from
+        several threads."""
+        root = self.getTextureDirectory(material_name)
+        filename = map_name if force_ext else map_name + os.path.splitext(url)[1]
+        return self._fetchMapTo(url, os.path.join(root, filename), map_name)
+
+    def _fetchMapTo(self, url, path, map_name):
+        map_stats = stats.RequestStats(parent=self.request_stats)
+        errors = []
+
+        def func(path):
+            try:
+                return self._download(url, path, map_stats)
+            except (download.DownloadError, resilience.NetworkError) as err:
+                errors.append(str(err))
+                return -1
+
+        start = time.monotonic()
+        saved_path = self.saveFile(path, func)
+        requests, nbytes = map_stats.total()
+        if saved_path is None:
+            status = download.DownloadResult.FAILED
+        elif requests == 0:
+            status = download.DownloadResult.CACHED
+        else:
+            status = download.DownloadResult.DOWNLOADED
+        error = errors[0] if errors else None
+        if saved_path is None and error is None:
+            # Another thread was downloading the same path and failed
+            error = "Could not download {}".format(url)
+        return download.DownloadResult(map_name, url, path, status, nbytes,
+                                       time.monotonic() - start, map_stats.retries, error)
+
     def fetchImage(self, url, material_name, map_name, force_ext=False):
         """Utility helper for download textures"""
-        root = self.getTextureDirectory(material_name)
-        if not force_ext:
-            ext = os.path.splitext(url)[1]
-            map_name = map_name + ext
-        path = os.path.join(root, map_name)
-        return self.saveFile(path, self._downloadFunc(url))
+        result = self.fetchMap(url, material_name, map_name, force_ext)
+        self.download_results[map_name] = result
+        if not result.ok:
+            self.error = result.error
+            return None
+        return result.path
 
     def fetchImages(self, arg_tuples):
-        futures = dict()
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            for args in arg_tuples:
-                future = executor.submit(self.fetchImage, *args)
-                futures[future] = args[2]
-
-            for future in concurrent.futures.as_completed(futures):
-                name = futures[future]
-                path = future.result()
-                yield name, path
+        """Download maps concurrently, arg_tuples holding the arguments of
+        fetchImage for each of them. Yield a DownloadResult per map as they
+        complete, also recorded in self.download_results."""
+        sched = self.getScheduler()
+        futures = [sched.submit(self.fetchMap, *args, url=args[0], priority=self.priority)
+                   for args in arg_tuples]
+        yield from self._collectResults(futures)
+
+        connections = session.connectionStats()
+        print("{requests} requests sent, {reused} reused a kept-alive connection.".format(**connections))
+
+    def retryMaps(self, results):
+        """Download again the maps of failed results, concurrently.
+        Yield a new DownloadResult per map as they complete."""
+        sched = self.getScheduler()
+        futures = [sched.submit(self._fetchMapTo, r.url, r.path, r.name, url=r.url, priority=self.priority)
+                   for r in results]
+        yield from self._collectResults(futures)
+
+    def _collectResults(self, futures):
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            self.download_results[result.name] = result
+            yield result
 
     def fetchFile(self, url, material_name, filename):
         root = self.getTextureDirectory(material_name)
@@ -167,23 +403,203 @@ class AbstractScraper():
 
         return self.saveFile(path, self._downloadFunc(url))
 
-    def fetchZip(self, url, material_name, zip_name):
+    def fetchZip(self, url, material_name, zip_name, on_headers=None):
         """Utility helper for download textures"""
         root = self.getTextureDirectory(material_name)
         path = os.path.join(root, zip_name)
-        return self.saveFile(path, self._downloadFunc(url))
+        # Archives are shared once extracted, see fetchZipMembers
+        return self.saveFile(path, self._downloadFunc(url, on_headers), shared=False)
+
+    def fetchZipMembers(self, url, material_name, zip_name="textures.zip", member_filter=None):
+        """Download the zip file at url and extract it in the texture directory
+        of material_name. Once extracted, the zip is removed and a manifest
+        lists the extracted files, which are then found from it.
+        If member_filter is given, members for which member_filter(name) is
+        False may be skipped, and even not downloaded at all.
+        Return the directory and the list of extracted files, or (None, None)."""
+        root = self.getTextureDirectory(material_name)
+        return getSingleFlight().do(
+            os.path.realpath(root),
+            functools.partial(self._fetchZipMembersLocked, url, root, material_name, zip_name, member_filter),
+            fresh=self.reinstall)
+
+    def _fetchZipMembersLocked(self, url, root, material_name, zip_name, member_filter):
+        # Other processes sharing the texture directory wait, then find the manifest
+        try:
+            with locks.locked(root, self.deadline):
+                return self._fetchZipMembers(url, root, material_name, zip_name, member_filter)
+        except resilience.DeadlineExceeded as err:
+            self.error = str(err)
+            return None, None
+
+    def _fetchZipMembers(self, url, root, material_name, zip_name, member_filter):
+        pref = getPreferences()
+        zip_path = os.path.join(root, zip_name)
+        storage = self.getStorage()
+        if not self.reinstall:
+            manifest = self.loadManifest(root, url, zip_name, member_filter)
+            if manifest is not None and not manifest.missing(root):
+                print("Using cached {}.".format(root))
+                return root, manifest.names
+            if storage.remote:
+                # Copy what another machine extracted, or what was evicted from
+                # the local cache
+                names = storage.fetchTree(self.storageKey(root), root)
+                manifest = self.loadManifest(root, url, zip_name, member_filter) if names is not None else None
+                if manifest is not None and not manifest.missing(root):
+                    print("Using {} from the storage.".format(root))
+                    self.deduplicateTree(root, manifest.names, manifest.digests())
+                    return root, manifest.names
+            if manifest is not None:
+                print("Extraction of {} is incomplete, extracting it again.".format(root))
+
+        headers = {}
+
+        def onHeaders(h):
+            headers.setdefault("etag", h.get("ETag"))
+
+        if not os.path.isfile(zip_path) or self.reinstall:
+            namelist = None
+            if pref.sparse_zip_fetch and member_filter is not None:
+                namelist = self._extractRemoteZip(url, root, member_filter, onHeaders)
+            if namelist is None and pref.stream_zip_extraction:
+                namelist = self._extractZipStream(url, root, member_filter, onHeaders)
+            if namelist is not None:
+                return root, self._saveManifest(root, namelist, url, headers.get("etag"))
+
+        zip_path = self.fetchZip(url, material_name, zip_name, onHeaders)
+        if zip_path is None:
+            return None, None
+
+        def progress(name, done, total):
+            if done == total:
+                print("Extracted {} ({} bytes)".format(name, total))
+
+        try:
+            namelist = zipExtract.extractMembers(zip_path, root, member_filter,
+                                                 max_workers=MAX_EXTRACT_WORKERS, progress=progress)
+        except zipfile.BadZipFile as err:
+            self.error = "Invalid archive {}: {}".format(url, err)
+            os.remove(zip_path)
+            return None, None
+        os.remove(zip_path)
+        return root, self._saveManifest(root, namelist, url, headers.get("etag"))
+
+    def loadManifest(self, directory, url="", zip_name="textures.zip", member_filter=None):
+        """Return the manifest of the archive extracted in directory, or None.
+        Older versions left an empty zip file instead, which gets replaced by
+        a manifest of the matching files of directory."""
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        manifest = Manifest.load(manifest_path)
+        zip_path = os.path.join(directory, zip_name)
+        if manifest is None and os.path.isfile(zip_path) and os.path.getsize(zip_path) == 0:
+            names = [name for name in os.listdir(directory)
+                     if name != zip_name and not name.startswith(".")
+                     and os.path.isfile(os.path.join(directory, name))
+                     and (member_filter is None or member_filter(name))]
+            manifest = Manifest.build(directory, names, url)
+            manifest.save(manifest_path)
+            os.remove(zip_path)
+            self.getStorage().store(self.storageKey(manifest_path), manifest_path)
+            print("Listed the maps of {} in a manifest.".format(directory))
+        return manifest
+
+    def _saveManifest(self, root, namelist, url, etag):
+        """Record the files just extracted in root, share and deduplicate
+        them. Return their names."""
+        manifest = Manifest.build(root, namelist, url, etag)
+        manifest.save(os.path.join(root, MANIFEST_FILE))
+        # The manifest goes last, so that other machines only see complete variants
+        self.getStorage().storeTree(self.storageKey(root), root, namelist + [MANIFEST_FILE])
+        self.deduplicateTree(root, namelist, manifest.digests())
+        return manifest.names
+
+    def isExtracted(self, directory, zip_name="textures.zip", remote=True):
+        """Tell whether fetchZipMembers completely extracted an archive into
+        directory, either locally or in the storage backend (see isStored
+        for remote)"""
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        manifest = Manifest.load(manifest_path)
+        if manifest is not None and not manifest.missing(directory):
+            return True
+        zip_path = os.path.join(directory, zip_name)
+        if manifest is None and os.path.isfile(zip_path) and os.path.getsize(zip_path) == 0:
+            # Extracted by an older version
+            return True
+        storage = self.getStorage()
+        exists = storage.exists if remote else storage.isKnown
+        return exists(self.storageKey(manifest_path)) or exists(self.storageKey(zip_path))
+
+    def _extractRemoteZip(self, url, root, member_filter, on_headers=None):
+        """Extract the members of the remote zip at url selected by
+        member_filter into root, downloading only their bytes.
+        Return the list of extracted members, or None if the server does not
+        allow reading only parts of the archive."""
+        print("Reading the content of {}...".format(url))
+        http = self.getSession(self.deadline, self.request_stats)
+        remote_zip = RemoteZip(http, url, self._chunkCallback(url), on_headers)
+        try:
+            return self.getScheduler().run(remote_zip.extract, root, member_filter, self.priority,
+                                           url=url, priority=self.priority)
+        except (RangesUnsupported, zipStream.StreamingUnsupported, resilience.NetworkError) as err:
+            print("Could not fetch parts of {} ({}).".format(url, err))
+            return None
+
+    def _extractZipStream(self, url, root, member_filter=None, on_headers=None):
+        """Extract the zip at url into root while downloading it.
+        Return the list of members, or None if the archive must be downloaded
+        entirely to be extracted."""
+        print("Downloading and extracting {}...".format(url))
+        consumer = functools.partial(zipStream.extractStream, dest_dir=root, member_filter=member_filter)
+        http = self.getSession(self.deadline, self.request_stats)
+        try:
+            return self.getScheduler().run(download.streamUrl, http, url, consumer, self._chunkCallback(url),
+                                           on_headers, url=url, priority=self.priority)
+        except (zipStream.StreamingUnsupported, download.DownloadError, resilience.NetworkError) as err:
+            print("Could not extract {} while downloading ({}), downloading it first.".format(url, err))
+            return None
 
-    def saveFile(self, path, data_callback_function):
+    def saveFile(self, path, data_callback_function, shared=True):
         """function for saving data, path is the location
-        dataCallbackFunction is a function that is used if file is not already present, return -1 if error occurred"""
-        if os.path.isfile(path) and not self.reinstall:
-            print("Using cached {}.".format(path))
-        else:
-            print("Downloading {}...".format(path))
-            r = data_callback_function(path)
-            if r == -1:
+        dataCallbackFunction is a function that is used if file is not already present, return -1 if error occurred,
+        or else optionally the SHA-256 of the file
+        If the same path is already being downloaded, by this process or by
+        another one sharing the texture directory, wait for it instead.
+        If shared, the file is copied from the storage backend when it has
+        it, and uploaded to it once downloaded, then deduplicated."""
+        def save():
+            storage = self.getStorage() if shared else backends.getStorage()
+            key = self.storageKey(path)
+            if os.path.isfile(path) and not self.reinstall:
+                print("Using cached {}.".format(path))
+            elif not self.reinstall and storage.fetch(key, path):
+                print("Copied {} from the storage.".format(path))
+                self.deduplicate(path)
+            else:
+                print("Downloading {}...".format(path))
+                r = data_callback_function(path)
+                if r == -1:
+                    return None
+                storage.store(key, path)
+                if shared:
+                    self.deduplicate(path, r if isinstance(r, str) else None)
+            return path
+
+        def saveLocked():
+            try:
+                with locks.locked(path, self.deadline):
+                    return save()
+            except resilience.DeadlineExceeded as err:
+                print(err)
                 return None
-        return path
+        return getSingleFlight().do(os.path.realpath(path), saveLocked, fresh=self.reinstall)
+
+    def isMapUsed(self, map_name):
+        """Tell whether the internal map map_name is used, following the
+        use_arm preference for sources that provide an ARM map"""
+        if getPreferences().use_arm and "ARM" in self.maps_tr.values():
+            return map_name not in self.arm_maps
+        return map_name != "ARM"
 
     def clearString(self, s):
         """Remove non printable characters"""
@@ -193,7 +609,12 @@ class AbstractScraper():
     def getVariantData(self, asset_name):
         root = self.getTextureDirectory(os.path.join(self.home_dir, asset_name))
         metadata_file = os.path.join(root, self.metadata_filename)
+        if not os.path.isfile(metadata_file):
+            # Another project or machine may already have listed this asset
+            self.fetchStoredFiles(root, [self.metadata_filename])
         self.metadata.load(metadata_file)
+        if self.metadata.thumbnail and not os.path.isfile(os.path.join(root, self.metadata.thumbnail)):
+            self.fetchStoredFiles(root, [self.metadata.thumbnail])
 
         if self.metadata.name == "":
             url = self.getUrlFromName(asset_name)
@@ -201,6 +622,40 @@ class AbstractScraper():
 
         return self.metadata.variants
 
+    def prefetchMetadata(self, asset_names):
+        """Fetch what getVariantList needs for each of asset_names with as few
+        requests as possible, for sources that have bulk endpoints.
+        Return a dict mapping the URLs that getVariantList would pass to
+        fetchJson to their decoded content."""
+        return {}
+
+    def fetchMetadataBatch(self, asset_names):
+        """Resolve the metadata of many assets in one pass, using the bulk
+        endpoints of the source and sending the remaining requests
+        concurrently. Metadata files are saved as by getVariantData.
+        Return a dict mapping asset names to their Metadata, left blank when
+        it could not be resolved."""
+        prefetched = self.prefetchMetadata(asset_names)
+        sched = self.getScheduler()
+        futures = {}
+        for asset_name in asset_names:
+            scraper = type(self)(texture_root=self.texture_root)
+            scraper.priority = self.priority
+            scraper.prefetched = prefetched
+            future = sched.submit(scraper.getVariantData, asset_name,
+                                  url=scraper.getUrlFromName(asset_name), priority=self.priority)
+            futures[future] = (asset_name, scraper)
+
+        results = {}
+        for future in concurrent.futures.as_completed(futures):
+            asset_name, scraper = futures[future]
+            try:
+                future.result()
+            except resilience.NetworkError as err:
+                print(err)
+            results[asset_name] = scraper.metadata
+        return results
+
     def fetchVariantList(self, url):
         # **must have self.metadata.name filled**
         self.metadata.fetchUrl = url
@@ -221,6 +676,9 @@ class AbstractScraper():
         self._downloadThumbnail(root)
 
         self.metadata.save(metadata_file)
+        storage = self.getStorage()
+        storage.storeTree(self.storageKey(root), root, list(filter(None, [self.metadata_filename,
+                                                                          self.metadata.thumbnail])))
 
         return variants
 
@@ -230,7 +688,7 @@ class AbstractScraper():
         if thumbnail_url is None:
             print("no thumbnail found, not downloading")
         else:
-            thumbnail_req = self._fetch(thumbnail_url)
+            thumbnail_req = self._fetch(thumbnail_url, scheduler.THUMBNAIL, self.request_stats)
             if thumbnail_req is None:
                 return
             thumbnail_type = thumbnail_req.headers["Content-Type"]
@@ -244,8 +702,18 @@ class AbstractScraper():
         if ext is None:
             return
         thumbnail_name = f"thumb.{ext}"
-        with open(os.path.join(asset_path, thumbnail_name), "wb") as f:
-            f.write(thumbnail_req.content)
+        thumbnail_path = os.path.join(asset_path, thumbnail_name)
+        # replace rather than write into it, it may be linked to shared or blob storage
+        tmp_path = "{}.{}.{}.{}.tmp".format(thumbnail_path, socket.gethostname(),
+                                            os.getpid(), threading.get_ident())
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(thumbnail_req.content)
+            os.replace(tmp_path, thumbnail_path)
+        except BaseException:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            raise
         self.metadata.thumbnail = thumbnail_name
 
     def getVariantList(self, url):
@@ -260,6 +728,78 @@ class AbstractScraper():
         Return a boolean status, and fill self.error to add error messages."""
         raise NotImplementedError
 
+    def getVariantDownloads(self, variant_index):
+        """List what importing a variant would download, as (url, member_filter)
+        pairs where member_filter is None for plain files, and tells which
+        members get extracted from zip files.
+        Sizes given by the provider's API may be stored in the "file_sizes"
+        custom metadata (url -> bytes) to save requests.
+        Return None if it cannot be known without importing the variant."""
+        return None
+
+    def _contentLength(self, session, url):
+        r = session.head(url, allow_redirects=True, headers={"Accept-Encoding": "identity"})
+        length = r.headers.get("Content-Length")
+        if r.status_code != 200 or length is None:
+            return None
+        return int(length)
+
+    def _downloadSize(self, url, member_filter):
+        """Return the number of bytes that fetching url would transfer and
+        write on disk, either of them being None if unknown"""
+        session = self.getSession(request_stats=self.request_stats)
+        known = self.metadata.custom.get("file_sizes", {}).get(url)
+        if member_filter is None:
+            size = known if known is not None else self._contentLength(session, url)
+            return size, size
+        remote_zip = RemoteZip(session, url)
+        try:
+            transfer, disk = remote_zip.footprint(member_filter)
+        except (RangesUnsupported, zipStream.StreamingUnsupported) as err:
+            print("Could not read the content of {} ({}).".format(url, err))
+            size = known if known is not None else self._contentLength(session, url)
+            return size, None
+        if not getPreferences().sparse_zip_fetch:
+            transfer = remote_zip.size
+        return transfer, disk
+
+    def fetchVariantSizes(self):
+        """Measure how much downloading each variant would transfer and take
+        on disk, with concurrent requests. The result is saved in the asset
+        metadata and returned as a dict mapping variant names to a
+        [transfer, disk] pair of byte counts, either of them being None if
+        unknown."""
+        sched = self.getScheduler()
+        jobs = {}
+        for i, variant in enumerate(self.metadata.variants):
+            downloads = self.getVariantDownloads(i)
+            if downloads is None:
+                continue
+            jobs[variant] = [sched.submit(self._downloadSize, url, member_filter,
+                                          url=url, priority=scheduler.PREFETCH)
+                             for url, member_filter in downloads]
+
+        sizes = {}
+        for variant, futures in jobs.items():
+            parts = []
+            for future in futures:
+                try:
+                    parts.append(future.result())
+                except resilience.NetworkError as err:
+                    print(err)
+                    parts.append((None, None))
+            sizes[variant] = [
+                sum(p[0] for p in parts) if all(p[0] is not None for p in parts) else None,
+                sum(p[1] for p in parts) if all(p[1] is not None for p in parts) else None,
+            ]
+
+        self.metadata.setCustom("variant_sizes", sizes)
+        self.metadata.setCustom("variant_sizes_time", time.time())
+        if self.metadata.name:
+            root = self.getTextureDirectory(os.path.join(self.home_dir, self.metadata.name))
+            self.metadata.save(os.path.join(root, self.metadata_filename))
+        return sizes
+
     def getThumbnail(self):
         """Function for getting a url for a thumbnail for the texture, preferably using only self.assetName
          but you can pass more arguments with self.metadata.custom as its called after getVariantList.
@@ -268,10 +808,11 @@ class AbstractScraper():
          """
         return None
 
-    def isDownloaded(self, target_variation):
-        """takes the asset and a variation name and checks if its installed, returns a boolean"""
+    def isDownloaded(self, target_variation, remote=True):
+        """takes the asset and a variation name and checks if its installed, returns a boolean.
+        If remote is False, a remote storage backend is not asked (see isStored)"""
         root = self.getTextureDirectory(os.path.join(self.home_dir, self.metadata.name))
-        return os.path.exists(os.path.join(root, target_variation))
+        return self.isStored(os.path.join(root, target_variation), remote)
 
     def getUrlFromName(self, asset_name):
         """get a url for an asset from a name"""
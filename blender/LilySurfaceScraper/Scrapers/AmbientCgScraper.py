@@ -21,18 +21,40 @@
 # This file is part of LilySurfaceScraper, a Blender add-on to import materials
 # from a single URL
 
-import zipfile
 import os
 import re
 from urllib.parse import urlparse, parse_qs
 from .AbstractScraper import AbstractScraper
 
+# Number of assets requested at once from the API
+BULK_SIZE = 50
+
 
 class AmbientCgScraper(AbstractScraper):
     source_name = "ambientCG"
     home_url = "https://ambientcg.com/list"
     home_dir = "ambientCG"
 
+    # Translate cc0textures map names into our internal map names
+    maps_tr = {
+        # Names of the old website
+        'col': 'baseColor',
+        'nrm': 'normalInvertedY',
+        'mask': 'opacity',
+        'rgh': 'roughness',
+        'met': 'metallic',
+        'AO': 'ambientOcclusion',
+        'disp': 'height',
+        # New names
+        'Color': 'baseColor',
+        'Normal': 'normalInvertedY',
+        'Opacity': 'opacity',
+        'Roughness': 'roughness',
+        'Metalness': 'metallic',
+        'AmbientOcclusion': 'ambientOcclusion',
+        'Displacement': 'height'
+    }
+
     @classmethod
     def canHandleUrl(cls, url):
         """Return true if the URL can be scraped by this scraper."""
@@ -56,8 +78,11 @@ class AmbientCgScraper(AbstractScraper):
         variants = sorted(list(variants_data.keys()),
                           key=lambda x: self.sortTextWithNumbers(" ".join(x.split("-")[::-1])))
         variants_urls = [ variants_data[v]["RawDownloadLink"] for v in variants ]
+        file_sizes = { variants_data[v]["RawDownloadLink"]: variants_data[v]["Size"]
+                       for v in variants if "Size" in variants_data[v] }
 
         self.metadata.setCustom("variants_urls", variants_urls)
+        self.metadata.setCustom("file_sizes", file_sizes)
         self.metadata.name = asset_id
         self.metadata.setCustom("thumbnail_url", asset_data["PreviewSphere"]["512-PNG"])
         return variants
@@ -81,44 +106,51 @@ class AmbientCgScraper(AbstractScraper):
         zip_url = variants_urls[variant_index]
 
         material_data.name = f"{self.home_dir}/{self.metadata.name}/{variant}"
-        zip_path = self.fetchZip(zip_url, material_data.name, "textures.zip")
-        zip_dir = os.path.dirname(zip_path)
-        if os.path.getsize(zip_path) == 0:
-            # maps already exist
-            namelist = os.listdir(zip_dir)
-        else:
-            with zipfile.ZipFile(zip_path,"r") as zip_ref:
-                namelist = zip_ref.namelist()
-                zip_ref.extractall(zip_dir)
-            # wipe zip to leave only a 0-sized file:
-            open(zip_path, 'wb').close()
-        
-        # Translate cc0textures map names into our internal map names
-        maps_tr = {
-            # Names of the old website
-            'col': 'baseColor',
-            'nrm': 'normalInvertedY',
-            'mask': 'opacity',
-            'rgh': 'roughness',
-            'met': 'metallic',
-            'AO': 'ambientOcclusion',
-            'disp': 'height',
-            # New names
-            'Color': 'baseColor',
-            'Normal': 'normalInvertedY',
-            'Opacity': 'opacity',
-            'Roughness': 'roughness',
-            'Metalness': 'metallic',
-            'AmbientOcclusion': 'ambientOcclusion',
-            'Displacement': 'height'
-        }
+        zip_dir, namelist = self.fetchZipMembers(zip_url, material_data.name, member_filter=self.isMapFile)
+        if zip_dir is None:
+            return False
+
         for name in namelist:
-            base = os.path.splitext(name)[0]
-            map_type = base.split('_')[-1]
-            if map_type in maps_tr:
-                map_name = maps_tr[map_type]
+            if self.isMapFile(name):
+                map_name = self.maps_tr[self.mapType(name)]
                 material_data.maps[map_name] = os.path.join(zip_dir, name)
         return True
 
+    def getVariantDownloads(self, variant_index):
+        return [(self.metadata.getCustom("variants_urls")[variant_index], self.isMapFile)]
+
+    @staticmethod
+    def mapType(filename):
+        base = os.path.splitext(filename)[0]
+        return base.split('_')[-1]
+
+    def isMapFile(self, filename):
+        """Tell whether a file from the zip is a map that we use"""
+        map_type = self.mapType(filename)
+        return map_type in self.maps_tr and self.isMapUsed(self.maps_tr[map_type])
+
+    def prefetchMetadata(self, asset_names):
+        if len(asset_names) < 2:
+            return {}
+        prefetched = dict()
+        for start in range(0, len(asset_names), BULK_SIZE):
+            ids = asset_names[start:start + BULK_SIZE]
+            data = self.fetchJson(f"https://ambientcg.com/api/v1/full_json?id={','.join(ids)}")
+            if data is None:
+                self.error = None
+                continue
+            # Returned ids may differ in case from the requested ones
+            assets = { k.lower(): (k, v) for k, v in data.get("Assets", {}).items() }
+            for asset_id in ids:
+                if asset_id.lower() in assets:
+                    found_id, asset_data = assets[asset_id.lower()]
+                    api_url = f"https://ambientcg.com/api/v1/full_json?id={asset_id}"
+                    prefetched[api_url] = {"Assets": {found_id: asset_data}}
+        return prefetched
+
     def getUrlFromName(self, asset_name):
         return f"https://ambientcg.com/view?id={asset_name}"
+
+    def isDownloaded(self, target_variation, remote=True):
+        root = self.getTextureDirectory(os.path.join(self.home_dir, self.metadata.name))
+        return self.isExtracted(os.path.join(root, target_variation), remote=remote)
@@ -23,7 +23,6 @@
 
 from .AbstractScraper import AbstractScraper
 
-import zipfile
 import os
 from urllib.parse import urlparse
 
@@ -33,6 +32,17 @@ class CgbookcaseScraper(AbstractScraper):
     home_url = "https://www.cgbookcase.com/textures/"
     home_dir = "cgbookcase"
 
+    # Translate cgbookcase map names into our internal map names
+    maps_tr = {
+        'BaseColor': 'baseColor',
+        'Normal': 'normal',
+        'Opacity': 'opacity',
+        'Roughness': 'roughness',
+        'Metallic': 'metallic',
+        'Height': 'height',
+        'AO': 'ambientOcclusion',
+    }
+
     @classmethod
     def canHandleUrl(cls, url):
         """Return true if the URL can be scraped by this scraper."""
@@ -41,15 +51,13 @@ class CgbookcaseScraper(AbstractScraper):
     def getVariantList(self, url):
         """Get a list of available variants.
         The list may be empty, and must be None in case of error."""
-        html = self.fetchHtml(url)
-        if html is None:
-            return None
-
         parsed_url = urlparse(url)
         identifier = parsed_url.path.strip('/').split('/')[-1]
         api_url = f"https://www.cgbookcase.com/textures/{identifier}/LilySurfaceScraper.json"
 
         data = self.fetchJson(api_url)
+        if data is None:
+            return None
 
         resolutions = sorted(data['files'].keys(), key=lambda x: x.zfill(3))
 
@@ -103,37 +111,19 @@ class CgbookcaseScraper(AbstractScraper):
         sideness = variant_index // len(resolutions)
         zip_url = files[res]
 
-        zip_path = self.fetchZip(zip_url, material_data.name, "textures.zip")
-        zip_dir = os.path.dirname(zip_path)
-        if os.path.getsize(zip_path) == 0:
-            # maps already exist
-            namelist = os.listdir(zip_dir)
-        else:
-            with zipfile.ZipFile(zip_path,"r") as zip_ref:
-                namelist = zip_ref.namelist()
-                zip_ref.extractall(zip_dir)
-            # wipe zip to leave only a 0-sized file:
-            open(zip_path, 'wb').close()
-
-        # Translate cgbookcase map names into our internal map names
-        maps_tr = {
-            'BaseColor': 'baseColor',
-            'Normal': 'normal',
-            'Opacity': 'opacity',
-            'Roughness': 'roughness',
-            'Metallic': 'metallic',
-            'Height': 'height',
-            'AO': 'ambientOcclusion',
-        }
+        zip_dir, namelist = self.fetchZipMembers(zip_url, material_data.name, member_filter=self.isMapFile)
+        if zip_dir is None:
+            return False
+
         for name in namelist:
             base = os.path.splitext(name)[0]
             tokens = base.split('_')
             map_type = tokens[-1]
 
-            if map_type not in maps_tr:
+            if not self.isMapFile(name):
                 continue
 
-            map_name = maps_tr[map_type]
+            map_name = self.maps_tr[map_type]
 
             if doublesided:
                 map_side = tokens[-2]
@@ -150,7 +140,22 @@ class CgbookcaseScraper(AbstractScraper):
         
         return True
 
+    def getVariantDownloads(self, variant_index):
+        resolutions = self.metadata.getCustom("resolutions")
+        res = resolutions[variant_index % len(resolutions)]
+        return [(self.metadata.getCustom("files")[res], self.isMapFile)]
+
+    def isMapFile(self, filename):
+        """Tell whether a file from the zip is a map that we use"""
+        base = os.path.splitext(filename)[0]
+        map_type = base.split('_')[-1]
+        return map_type in self.maps_tr and self.isMapUsed(self.maps_tr[map_type])
+
     def getUrlFromName(self, asset_name):
         # should be enough
         name = asset_name.lower().replace(' ', '-')
         return f"https://www.cgbookcase.com/textures/{name}"
+
+    def isDownloaded(self, target_variation, remote=True):
+        root = self.getTextureDirectory(os.path.join(self.home_dir, self.metadata.name))
+        return self.isExtracted(os.path.join(root, target_variation), remote=remote)
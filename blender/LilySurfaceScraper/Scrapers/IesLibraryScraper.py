@@ -69,9 +69,9 @@ class IesLibraryScraper(AbstractScraper):
         material_data.maps["energy"] = blender_energy
         return True
 
-    def isDownloaded(self, target_variation):
+    def isDownloaded(self, target_variation, remote=True):
         root = self.getTextureDirectory(os.path.join(self.home_dir, self.metadata.name))
-        return os.path.isfile(os.path.join(root, f"{target_variation}.ies"))
+        return self.isStored(os.path.join(root, f"{target_variation}.ies"), remote)
 
     def getUrlFromName(self, asset_name):
         return f"https://ieslibrary.com/en/browse#ies-{asset_name}"
@@ -137,5 +137,5 @@ class LocalDirectoryScraper(AbstractScraper):
             material_data.maps["energy"] = 1
             return True
 
-    def isDownloaded(self, variation):
+    def isDownloaded(self, variation, remote=True):
         return True
@@ -73,9 +73,12 @@ class PolyHavenHdriScraper(AbstractScraper):
             return None
 
         variant_data = defaultdict(dict)
+        file_sizes = dict()
         for res, maps in data["hdri"].items():
             for fmt, dat in maps.items():
                 variant_data[(res, fmt)] = dat['url']
+                if 'size' in dat:
+                    file_sizes[dat['url']] = dat['size']
 
         variant_data = [(*k, v) for k, v in variant_data.items()]
         variant_data.sort(key=lambda x: self.sortTextWithNumbers(f"{x[1]} {x[0]}"))
@@ -84,6 +87,7 @@ class PolyHavenHdriScraper(AbstractScraper):
         self.metadata.name = name
         self.metadata.id = identifier
         self.metadata.setCustom("variant_data", variant_data)
+        self.metadata.setCustom("file_sizes", file_sizes)
         return variants
 
     def getThumbnail(self):
@@ -111,10 +115,29 @@ class PolyHavenHdriScraper(AbstractScraper):
         
         return True
 
-    def isDownloaded(self, target_variation):
+    def getVariantDownloads(self, variant_index):
+        return [(self.metadata.getCustom("variant_data")[variant_index][2], None)]
+
+    def isDownloaded(self, target_variation, remote=True):
         root = self.getTextureDirectory(os.path.join(self.home_dir, self.metadata.name))
         name, ext = target_variation.split(" (")
-        return os.path.isfile(os.path.join(root, f"{name}.{ext[:-1]}"))
+        return self.isStored(os.path.join(root, f"{name}.{ext[:-1]}"), remote)
+
+    def prefetchMetadata(self, asset_names):
+        if len(asset_names) < 2:
+            return {}
+        # A single listing of all hdris replaces an /info request per asset
+        assets = self.fetchJson("https://api.polyhaven.com/assets?t=hdris")
+        if assets is None:
+            self.error = None
+            return {}
+        prefetched = dict()
+        for asset_name in asset_names:
+            identifier = self.getUid(self.getUrlFromName(asset_name))
+            info = assets.get(identifier)
+            if info is not None and "type" in info and "name" in info:
+                prefetched[f"https://api.polyhaven.com/info/{identifier}"] = info
+        return prefetched
 
     def getUrlFromName(self, asset_name):
         # data = self.fetchJson(f"https://api.polyhaven.com/assets?s={asset_name.replace()}")
@@ -22,7 +22,6 @@
 # from a single URL
 
 from .AbstractScraper import AbstractScraper
-from ..preferences import getPreferences
 
 import re
 from collections import defaultdict
@@ -111,6 +110,7 @@ class PolyHavenTextureScraper(AbstractScraper):
             return None
 
         variant_data = defaultdict(dict)
+        file_sizes = dict()
         for map_type, maps in data.items():
             map_type = map_type.lower()
             if map_type not in self.maps_tr.keys():
@@ -118,6 +118,8 @@ class PolyHavenTextureScraper(AbstractScraper):
             for res, formats in maps.items():
                 for fmt, map_data in formats.items():
                     variant_data[(res, fmt)][map_type] = map_data['url']
+                    if 'size' in map_data:
+                        file_sizes[map_data['url']] = map_data['size']
 
         variant_data = [(*k, v) for k, v in variant_data.items()]
         variant_data.sort(key=lambda x: self.sortTextWithNumbers(f"{x[1]} {x[0]}"))
@@ -126,6 +128,7 @@ class PolyHavenTextureScraper(AbstractScraper):
         self.metadata.name = name
         self.metadata.id = identifier
         self.metadata.setCustom("variant_data", variant_data)
+        self.metadata.setCustom("file_sizes", file_sizes)
         return variants
 
     def getThumbnail(self):
@@ -137,39 +140,58 @@ class PolyHavenTextureScraper(AbstractScraper):
         Return a boolean status, and fill self.error to add error messages."""
         # Get data saved in fetchVariantList
         name = self.metadata.name
-        variant_data = self.metadata.getCustom("variant_data")
         variants = self.metadata.variants
-        pref = getPreferences()
-        
+
         if variant_index < 0 or variant_index >= len(variants):
             self.error = "Invalid variant index: {}".format(variant_index)
             return False
         
         var_name = variants[variant_index]
         material_data.name = f"{self.home_dir}/{name}/{var_name}"
-        
-        maps = variant_data[variant_index][2]
+
+        fetchImage_args = [(map_url, material_data.name, map_name)
+                           for map_name, map_url in self.selectMaps(variant_index)]
+
+        for result in self.fetchImages(fetchImage_args):
+            material_data.maps[result.name] = result.path if result.ok else None
+
+        return True
+
+    def selectMaps(self, variant_index):
+        """Return the (map name, url) pairs of the maps used from a variant"""
+        maps = dict(self.metadata.getCustom("variant_data")[variant_index][2])
         if "displacement" in maps and "bump" in maps:
             del maps["bump"]
 
-        fetchImage_args = list()
+        selected = list()
         for map_name, map_url in maps.items():
             map_name = map_name.lower()
             if map_name in self.maps_tr:
                 map_name = self.maps_tr[map_name]
-
-                skip = ("ARM",)
-                if pref.use_arm:
-                    skip = ("ambientOcclusion", "roughness", "metallic")
-                if map_name in skip:
+                if not self.isMapUsed(map_name):
                     continue
 
-                fetchImage_args.append((map_url, material_data.name, map_name))
-
-        for name, path in self.fetchImages(fetchImage_args):
-            material_data.maps[name] = path
-
-        return True
+                selected.append((map_name, map_url))
+        return selected
+
+    def getVariantDownloads(self, variant_index):
+        return [(map_url, None) for _, map_url in self.selectMaps(variant_index)]
+
+    def prefetchMetadata(self, asset_names):
+        if len(asset_names) < 2:
+            return {}
+        # A single listing of all textures replaces an /info request per asset
+        assets = self.fetchJson("https://api.polyhaven.com/assets?t=textures")
+        if assets is None:
+            self.error = None
+            return {}
+        prefetched = dict()
+        for asset_name in asset_names:
+            identifier = self.getUid(self.getUrlFromName(asset_name))
+            info = assets.get(identifier)
+            if info is not None and "type" in info and "name" in info:
+                prefetched[f"https://api.polyhaven.com/info/{identifier}"] = info
+        return prefetched
 
     def getUrlFromName(self, asset_name):
         # same as hdri one, works well enough
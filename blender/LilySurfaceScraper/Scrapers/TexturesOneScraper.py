@@ -29,11 +29,21 @@ class TexturesOneMaterialScraper(AbstractScraper):
     show_preview = False
 
     url_cache = {}
+    # Source pages found for each URL, shared by the material and world
+    # scrapers so that the redirection is only requested once
+    source_cache = {}
+    # URLs whose source page no scraper of this type can handle
+    unhandled_urls = set()
 
     @classmethod
     def findSource(cls, url: str) -> str:
         """Find the original page from where the texture is being distributed via scraping."""
-        return cls.getRedirection(None, url)
+        source_url = TexturesOneMaterialScraper.source_cache.get(url)
+        if source_url is None:
+            source_url = cls.getRedirection(None, url)
+            if source_url is not None:
+                TexturesOneMaterialScraper.source_cache[url] = source_url
+        return source_url
 
     @classmethod
     def cacheSourceUrl(cls, url) -> bool:
@@ -50,12 +60,17 @@ class TexturesOneMaterialScraper(AbstractScraper):
                 cls.url_cache[url] = (source_url, scraper_class, scraped_type)
                 return True
         print("no scraper could handle {}".format(source_url))
+        cls.unhandled_urls.add(url)
         return False
 
     @classmethod
     def canHandleUrl(cls, url :str) -> bool:
         """Return true if the URL can be scraped by this scraper."""
         if ("textures.one/go" in url or "3dassets.one/go" in url) and "?id=" in url:
+            if url in cls.url_cache:
+                return True
+            if url in cls.unhandled_urls:
+                return False
             return cls.cacheSourceUrl(url)
         return False
 
@@ -66,11 +81,17 @@ class TexturesOneMaterialScraper(AbstractScraper):
         source_url, scraper_class, scraped_type = cls.url_cache[url]
         self.scraped_type = scraped_type
         self.source_scraper = scraper_class(self.texture_root)
+        self.source_scraper.priority = self.priority
+        self.source_scraper.deadline = self.deadline
+        self.source_scraper.request_stats = self.request_stats
         return self.source_scraper.fetchVariantList(source_url)
 
     def fetchVariant(self, variant_index, material_data):
+        self.source_scraper.deadline = self.deadline
         return self.source_scraper.fetchVariant(variant_index, material_data)
 
 
 class TexturesOneWorldScraper(TexturesOneMaterialScraper):
     scraped_type = "WORLD"
+    url_cache = {}
+    unhandled_urls = set()
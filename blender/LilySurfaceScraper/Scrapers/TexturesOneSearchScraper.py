@@ -20,8 +20,9 @@
 # SOFTWARE.
 
 from .TexturesOneScraper import TexturesOneMaterialScraper
+from lxml import etree
 from random import choice
-import requests
+from functools import partial
 
 
 class TexturesOneSearchScraper(TexturesOneMaterialScraper):
@@ -29,15 +30,18 @@ class TexturesOneSearchScraper(TexturesOneMaterialScraper):
     home_url = None  # Prevent double with TexturesOneMaterialScraper in UI
     scraped_type_name = ""
     supported_creators = []
+    url_cache = {}
+    unhandled_urls = set()
 
     @classmethod
     def findSource(cls, search_term: str) -> str:
         """Search and pick a random result from the results site"""
         creator_filter = "&".join(["creator[]=" + x for x in cls.supported_creators])
         url = "https://3dassets.one/search/?query=" + search_term + "&" + cls.scraped_type_name + "&" + creator_filter
-        html = self.fetchHtml(url)
+        r = cls._fetch(url)
         print("url: {}".format(url))
-        if html is None: raise ConnectionError
+        if r is None: raise ConnectionError
+        html = etree.HTML(r.text)
         print("html: {}".format(html))
         links = html.xpath("//div[@class='asset-container']/a/@href")
         print("links: {}".format(links))
@@ -50,7 +54,8 @@ class TexturesOneSearchScraper(TexturesOneMaterialScraper):
         if not url.startswith("http"):
             url = "https://www.3dassets.one" + url
 
-        r = requests.get(url, headers={"User-Agent":"Mozilla/5.0"}, allow_redirects=False)
+        get = partial(cls.getSession().get, allow_redirects=False)
+        r = cls.getScheduler().run(get, url, url=url)
         if r.status_code == 200:
             return url
         elif 'Location' in r.headers:
@@ -70,9 +75,13 @@ class TexturesOneSearchMaterialScraper(TexturesOneSearchScraper):
     scraped_type = "MATERIAL"
     scraped_type_name = "tex-pbr"
     supported_creators = ['cc0textures', 'cgbookcase', 'texturehaven'] # IDs of the websites on Textures.one that we support
+    url_cache = {}
+    unhandled_urls = set()
 
 
 class TexturesOneSearchWorldScraper(TexturesOneSearchScraper):
     scraped_type = "WORLD"
     scraped_type_name = "hdri-sphere"
     supported_creators = ['hdrihaven']
+    url_cache = {}
+    unhandled_urls = set()
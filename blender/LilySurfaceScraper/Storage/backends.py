@@ -0,0 +1,350 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Storage backends hold a shared copy of the downloaded textures. The texture
+directory always keeps the files that Blender loads. A remote backend is an
+extra tier: files downloaded on one machine are uploaded once, and other
+machines copy them from the backend instead of downloading them from the
+source. The texture directory then acts as a bounded local cache. A shared
+directory plays the same role for all the projects of a machine, whose
+texture directories get links to its files.
+
+Files are identified by keys, which are their paths relative to the texture
+directory with '/' separators.
+"""
+
+import os
+import shutil
+import threading
+import time
+
+from . import usage
+from .blobStore import getBlobStore, linkFile
+from ..settings import BLOB_STORE_DIR
+
+try:
+    import boto3
+    from botocore.exceptions import BotoCoreError, ClientError
+except ImportError:
+    boto3 = None
+
+TRIM_INTERVAL = 64 * 1024 * 1024  # bytes added to the local cache between trims
+MISSING_TTL = 60  # seconds during which a key found missing is not checked again
+
+
+class StorageError(Exception):
+    pass
+
+
+def isMissing(err):
+    """Tell whether an error of the S3 client means that an object does not
+    exist"""
+    if not isinstance(err, ClientError):
+        return False
+    return err.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+
+class Storage():
+    """The local texture directory only, with nothing shared"""
+    name = 'LOCAL'
+    remote = False
+
+    def exists(self, key):
+        """Tell whether the backend holds the file key, or any file under
+        key/ if it is a directory"""
+        return False
+
+    def isKnown(self, key):
+        """Like exists, but only from what the backend already told when it
+        is remote, so that it may be called while drawing"""
+        return self.exists(key)
+
+    def fetch(self, key, path):
+        """Copy the file key to the local path, return False if the backend
+        does not have it"""
+        return False
+
+    def fetchTree(self, prefix, directory):
+        """Copy the files under prefix/ that are missing from directory.
+        Return the list of their names relative to directory, or None if the
+        backend has none."""
+        return None
+
+    def store(self, key, path):
+        """Save the local file at path as key"""
+        pass
+
+    def storeTree(self, prefix, directory, names):
+        """Save the given files of directory under prefix/"""
+        for name in names:
+            path = os.path.join(directory, *name.split("/"))
+            if os.path.isfile(path):
+                self.store(prefix + "/" + name, path)
+
+
+class S3Storage(Storage):
+    """Files kept in an S3 compatible bucket (AWS, MinIO...). Credentials
+    come from the usual AWS environment variables or configuration files."""
+    name = 'S3'
+    remote = True
+
+    def __init__(self, bucket, prefix="", endpoint_url="", cache_root="", cache_size=0):
+        if boto3 is None:
+            raise ImportError("The S3 storage requires the boto3 module")
+        if not bucket:
+            raise StorageError("No S3 bucket set")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.cache = HotCache(cache_root, cache_size) if cache_root and cache_size > 0 else None
+        # Keys known to be in the bucket or missing from it (with the time
+        # of the check), to avoid asking again
+        self.known = set()
+        self.missing = {}
+        self._lock = threading.Lock()
+
+    def objectKey(self, key):
+        return self.prefix + "/" + key if self.prefix else key
+
+    def exists(self, key):
+        with self._lock:
+            if key in self.known:
+                return True
+            if time.time() - self.missing.get(key, 0) < MISSING_TTL:
+                return False
+        try:
+            try:
+                self.client.head_object(Bucket=self.bucket, Key=self.objectKey(key))
+                found = True
+            except ClientError as err:
+                if not isMissing(err):
+                    raise
+                # Maybe a directory
+                response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=self.objectKey(key) + "/",
+                                                       MaxKeys=1)
+                found = response.get("KeyCount", 0) > 0
+        except (ClientError, BotoCoreError) as err:
+            print("Could not check {} in S3 bucket {}: {}".format(key, self.bucket, err))
+            return False
+        with self._lock:
+            if found:
+                self.known.add(key)
+            else:
+                self.missing[key] = time.time()
+        return found
+
+    def isKnown(self, key):
+        with self._lock:
+            return key in self.known
+
+    def fetch(self, key, path):
+        with self._lock:
+            if time.time() - self.missing.get(key, 0) < MISSING_TTL:
+                return False
+        tmp_path = path + ".part"
+        try:
+            self.client.download_file(self.bucket, self.objectKey(key), tmp_path)
+            os.replace(tmp_path, path)
+        except (ClientError, BotoCoreError, OSError) as err:
+            if isMissing(err):
+                with self._lock:
+                    self.missing[key] = time.time()
+            else:
+                print("Could not fetch {} from S3 bucket {}: {}".format(key, self.bucket, err))
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            return False
+        with self._lock:
+            self.known.add(key)
+            self.missing.pop(key, None)
+        self._cached(path)
+        return True
+
+    def _cached(self, path):
+        """Account for a file now present both locally and in the bucket"""
+        if self.cache is not None and self.cache.added(os.path.getsize(path)):
+            with self._lock:
+                stored_keys = set(self.known)
+            self.cache.trim(stored_keys)
+
+    def fetchTree(self, prefix, directory):
+        names = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        object_prefix = self.objectKey(prefix) + "/"
+        try:
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=object_prefix):
+                for obj in page.get("Contents", []):
+                    name = obj["Key"][len(object_prefix):]
+                    path = os.path.join(directory, *name.split("/"))
+                    if not os.path.isfile(path):
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        if not self.fetch(prefix + "/" + name, path):
+                            return None
+                    names.append(name)
+        except (ClientError, BotoCoreError) as err:
+            print("Could not list {} in S3 bucket {}: {}".format(prefix, self.bucket, err))
+            return None
+        return names or None
+
+    def store(self, key, path):
+        with self._lock:
+            if key in self.known:
+                return
+        try:
+            self.client.upload_file(path, self.bucket, self.objectKey(key))
+        except (ClientError, BotoCoreError) as err:
+            print("Could not upload {} to S3 bucket {}: {}".format(key, self.bucket, err))
+            return
+        with self._lock:
+            self.known.add(key)
+            self.missing.pop(key, None)
+        self._cached(path)
+
+
+class SharedDirectoryStorage(Storage):
+    """Files kept in a directory shared by all projects of the machine, or of
+    the network if it is on a NAS. Project directories get clones or hard
+    links of its files when it is on the same filesystem, copies otherwise."""
+    name = 'SHARED'
+    remote = True
+
+    def __init__(self, directory=""):
+        if not directory:
+            raise StorageError("No shared cache directory set")
+        self.directory = directory
+
+    def sharedPath(self, key):
+        return os.path.join(self.directory, *key.split("/"))
+
+    @staticmethod
+    def _place(src, dst):
+        """Make dst a link or copy of src, atomically"""
+        tmp_path = dst + ".part"
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        if linkFile(src, tmp_path) is None:
+            shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+
+    def exists(self, key):
+        return os.path.exists(self.sharedPath(key))
+
+    def fetch(self, key, path):
+        src = self.sharedPath(key)
+        if not os.path.isfile(src):
+            return False
+        try:
+            self._place(src, path)
+        except OSError as err:
+            print("Could not copy {} from the shared cache: {}".format(key, err))
+            return False
+        return True
+
+    def fetchTree(self, prefix, directory):
+        root = self.sharedPath(prefix)
+        names = []
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                name = os.path.relpath(os.path.join(dirpath, filename), root).replace(os.path.sep, "/")
+                path = os.path.join(directory, *name.split("/"))
+                if not os.path.isfile(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    if not self.fetch(prefix + "/" + name, path):
+                        return None
+                names.append(name)
+        return names or None
+
+    def store(self, key, path):
+        dst = self.sharedPath(key)
+        try:
+            if os.path.isfile(dst) and os.path.samefile(dst, path):
+                return
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            self._place(path, dst)
+        except OSError as err:
+            print("Could not add {} to the shared cache: {}".format(key, err))
+
+
+class HotCache():
+    """Keep the local copies of remotely stored files under a size limit,
+    removing the least recently used variants first"""
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    def added(self, size):
+        """Count size new bytes in the cache, return True when it is time to
+        trim it"""
+        with self._lock:
+            self.pending += size
+            if self.pending < min(TRIM_INTERVAL, self.max_bytes // 4):
+                return False
+            self.pending = 0
+            return True
+
+    def trim(self, stored_keys):
+        """Remove whole variants until the cache fits, only considering those
+        whose files all have their key in stored_keys, and keeping those that
+        the open blend file uses"""
+        def isStored(path):
+            key = os.path.relpath(path, self.root).replace(os.path.sep, "/")
+            if key in stored_keys:
+                return True
+            for dirpath, _, filenames in os.walk(path):
+                for filename in filenames:
+                    file_key = os.path.relpath(os.path.join(dirpath, filename), self.root)
+                    if file_key.replace(os.path.sep, "/") not in stored_keys:
+                        return False
+            return True
+
+        blob_dir = os.path.join(self.root, BLOB_STORE_DIR)
+        blob_store = getBlobStore(blob_dir) if os.path.isdir(blob_dir) else None
+        usage.evict(self.root, self.max_bytes, usage.referencedPaths(), 'LRU', blob_store, removable=isStored)
+
+
+BACKENDS = {
+    'LOCAL': Storage,
+    'S3': S3Storage,
+    'SHARED': SharedDirectoryStorage,
+}
+
+_storages = {}
+_lock = threading.Lock()
+
+
+def getStorage(name='LOCAL', **settings):
+    """Return the shared storage backend with these settings, given as
+    keyword arguments of its class, falling back to the local texture
+    directory only if it cannot be used"""
+    key = (name,) + tuple(sorted(settings.items()))
+    with _lock:
+        if key not in _storages:
+            try:
+                _storages[key] = BACKENDS[name](**settings)
+            except (ImportError, StorageError) as err:
+                print("{}, keeping textures in the local directory only.".format(err))
+                _storages[key] = Storage()
+        return _storages[key]
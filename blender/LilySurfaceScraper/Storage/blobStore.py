@@ -0,0 +1,286 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Content-addressed store of texture files. Each distinct content is kept once
+as a blob named after its SHA-256, and the files of the texture directory are
+clones (reflinks) or hard links of the blobs. Identical maps reached through
+different sources, variants or projects then take space only once.
+
+Reflinks are preferred because the files stay independent copies on write.
+Hard links are used on filesystems without reflinks, and files are left as
+they are when neither is possible.
+
+A clone is a separate inode, so the files using a blob are listed in a
+'<digest>.refs' file next to it, with their inode at the time they were
+linked. A blob is unused once none of them is still that inode. Losing a
+blob never loses data, the files keep their content, only later files are
+no longer deduplicated against it.
+"""
+
+import ctypes
+import hashlib
+import json
+import os
+import socket
+import sys
+import threading
+
+HASH_CHUNK_SIZE = 1 << 20
+MIN_BLOB_SIZE = 4096  # smaller files are not worth deduplicating
+FICLONE = 0x40049409  # Linux ioctl cloning a file
+REFS_SUFFIX = ".refs"
+
+
+def hashFile(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def reflink(src, dst):
+    """Create dst sharing the data of src until either is modified.
+    Return False if the filesystem does not support it."""
+    if sys.platform.startswith("linux"):
+        import fcntl
+        try:
+            with open(src, "rb") as s, open(dst, "wb") as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return True
+        except OSError:
+            if os.path.isfile(dst):
+                os.remove(dst)
+            return False
+    if sys.platform == "darwin":
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            return libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0
+        except (OSError, AttributeError):
+            return False
+    return False
+
+
+def linkFile(src, dst):
+    """Make dst a reflink or else a hard link of src.
+    Return the method used, or None if none is supported."""
+    if reflink(src, dst):
+        return "reflink"
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        return None
+
+
+class HashingCallback():
+    """Chunk callback computing the hash of a file while it downloads. The
+    digest is only valid if the chunks are the whole file, in order."""
+    def __init__(self, on_chunk=None):
+        self.on_chunk = on_chunk
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def __call__(self, chunk):
+        self.hash.update(chunk)
+        self.size += len(chunk)
+        if self.on_chunk is not None:
+            self.on_chunk(chunk)
+
+    def digestFor(self, path):
+        """Return the digest if all of the file at path went through this
+        callback, otherwise None"""
+        if os.path.getsize(path) != self.size:
+            return None
+        return self.hash.hexdigest()
+
+
+class BlobStore():
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def blobPath(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def ingest(self, path, digest=None):
+        """Make the file at path a link to the blob of its content, adding
+        the blob if it is new. digest is the SHA-256 of the file if already
+        known. Return the number of bytes saved."""
+        size = os.path.getsize(path)
+        if size < MIN_BLOB_SIZE:
+            return 0
+        if digest is None:
+            digest = hashFile(path)
+        blob = self.blobPath(digest)
+        with self._lock:
+            if os.path.isfile(blob) and os.path.getsize(blob) != size:
+                # Modified in place through one of its links
+                self._remove(blob)
+            if not os.path.isfile(blob):
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                try:
+                    method = linkFile(path, blob)
+                except FileExistsError:
+                    # Added by another process in the meantime
+                    method = None
+                if method is not None:
+                    self._addRef(blob, path)
+                    return 0
+                if not os.path.isfile(blob):
+                    return 0
+            if os.path.samefile(blob, path):
+                self._addRef(blob, path)
+                return 0
+            tmp_path = path + ".blob"
+            if linkFile(blob, tmp_path) is None:
+                return 0
+            os.replace(tmp_path, path)
+            self._addRef(blob, path)
+        return size
+
+    @staticmethod
+    def _loadRefs(blob):
+        """Return the files using blob, as a dict mapping their paths to
+        their (device, inode), or None for blobs added by older versions"""
+        try:
+            with open(blob + REFS_SUFFIX, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _saveRefs(blob, refs):
+        refs_path = blob + REFS_SUFFIX
+        tmp_path = "{}.{}.{}.{}.tmp".format(refs_path, socket.gethostname(), os.getpid(), threading.get_ident())
+        with open(tmp_path, "w") as f:
+            json.dump(refs, f)
+        os.replace(tmp_path, refs_path)
+
+    def _addRef(self, blob, path):
+        st = os.stat(path)
+        refs = self._loadRefs(blob) or {}
+        refs[os.path.realpath(path)] = [st.st_dev, st.st_ino]
+        self._saveRefs(blob, refs)
+
+    @staticmethod
+    def _liveRefs(refs):
+        """Keep the references whose path is still the inode that was linked"""
+        live = {}
+        for path, inode in refs.items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if [st.st_dev, st.st_ino] == inode:
+                live[path] = inode
+        return live
+
+    def _users(self, blob, st):
+        """Number of files using blob, pruning its stale references"""
+        refs = self._loadRefs(blob)
+        if refs is None:
+            # Only hard links can be counted for blobs without references
+            return st.st_nlink - 1
+        live = self._liveRefs(refs)
+        if live != refs:
+            self._saveRefs(blob, live)
+        return len(live)
+
+    @staticmethod
+    def _remove(blob):
+        os.remove(blob)
+        if os.path.isfile(blob + REFS_SUFFIX):
+            os.remove(blob + REFS_SUFFIX)
+
+    def _blobs(self):
+        """Yield the path and stat of each blob"""
+        if not os.path.isdir(self.directory):
+            return
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            for blob in os.scandir(entry.path):
+                if "." not in blob.name:
+                    yield blob.path, blob.stat()
+
+    def ingestTree(self, directory, names, digests=None):
+        """Ingest the given files of directory, return the bytes saved.
+        digests optionally maps names to the already known SHA-256."""
+        digests = digests or {}
+        saved = 0
+        for name in names:
+            path = os.path.join(directory, *name.split("/"))
+            if os.path.isfile(path):
+                try:
+                    saved += self.ingest(path, digests.get(name))
+                except OSError as err:
+                    print("Could not deduplicate {}: {}".format(path, err))
+        return saved
+
+    def collectGarbage(self):
+        """Remove the blobs that no file of the texture directory uses
+        anymore. Return the number of bytes freed."""
+        freed = 0
+        with self._lock:
+            for blob, st in self._blobs():
+                if self._users(blob, st) > 0:
+                    continue
+                try:
+                    self._remove(blob)
+                except OSError:
+                    continue
+                freed += st.st_size
+        return freed
+
+    def report(self):
+        """Return a dict with the number and size of blobs, and the number of
+        files and bytes that deduplication currently saves. Of the n files
+        using a blob, all but one would otherwise be copies."""
+        blobs, blob_bytes, files, saved = 0, 0, 0, 0
+        with self._lock:
+            for blob, st in self._blobs():
+                blobs += 1
+                blob_bytes += st.st_size
+                copies = max(self._users(blob, st) - 1, 0)
+                files += copies
+                saved += copies * st.st_size
+        return {
+            "blobs": blobs,
+            "blob_bytes": blob_bytes,
+            "deduplicated_files": files,
+            "saved_bytes": saved,
+        }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def getBlobStore(directory):
+    """Return the blob store kept in directory"""
+    with _stores_lock:
+        if directory not in _stores:
+            _stores[directory] = BlobStore(directory)
+        return _stores[directory]
@@ -0,0 +1,196 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Advisory locks between processes sharing a texture directory, possibly
+over NFS, so that two imports of the same asset do not write the same
+files at the same time. A lock is a file created with a hard link, which is
+atomic even on NFS, holding the host, pid and time of its owner. Its owner
+touches it regularly, so that a lock left by a crashed process or machine is
+recognized as stale and broken.
+"""
+
+import contextlib
+import json
+import os
+import socket
+import threading
+import time
+
+STALE_AFTER = 120  # seconds after which a lock that is not refreshed is stale
+REFRESH_INTERVAL = 20  # seconds between two refreshes of a held lock
+POLL_INTERVAL = 0.5  # seconds between two attempts to take a held lock
+
+
+def lockPath(path):
+    """Hidden lock file guarding path, a file or a directory"""
+    return os.path.join(os.path.dirname(path), "." + os.path.basename(path) + ".lock")
+
+
+def _readOwner(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _isAlive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to another user
+        return True
+    return True
+
+
+class FileLock():
+    def __init__(self, path):
+        """Lock guarding path"""
+        self.path = lockPath(path)
+        self.owner = {
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "thread": threading.get_ident(),
+        }
+        self._stop = threading.Event()
+        self._refresher = None
+
+    def _tryAcquire(self):
+        self.owner["time"] = time.time()
+        tmp_path = "{}.{host}.{pid}.{thread}".format(self.path, **self.owner)
+        with open(tmp_path, "w") as f:
+            json.dump(self.owner, f)
+        try:
+            os.link(tmp_path, self.path)
+            return True
+        except FileExistsError:
+            return False
+        except OSError:
+            # The reply to a link may get lost on NFS although it succeeded
+            if os.stat(tmp_path).st_nlink == 2:
+                return True
+            raise
+        finally:
+            os.remove(tmp_path)
+
+    def isStale(self, owner):
+        """Tell whether the lock held by owner was abandoned"""
+        if owner is None:
+            # Unreadable: either being written or broken, judge by its age
+            owner = {}
+        if owner.get("host") == self.owner["host"] and "pid" in owner and not _isAlive(owner["pid"]):
+            return True
+        try:
+            refreshed = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        return time.time() - refreshed > STALE_AFTER
+
+    def isHeld(self):
+        """Tell whether someone, maybe this lock, holds it now"""
+        if not os.path.exists(self.path):
+            return False
+        return not self.isStale(_readOwner(self.path))
+
+    def _breakStale(self, owner):
+        """Remove the lock file if it is still the stale one"""
+        broken_path = "{}.broken.{host}.{pid}.{thread}".format(self.path, **self.owner)
+        try:
+            os.rename(self.path, broken_path)
+        except OSError:
+            return
+        if _readOwner(broken_path) != owner:
+            # Taken again since it was read: put it back
+            try:
+                os.link(broken_path, self.path)
+            except OSError:
+                pass
+        os.remove(broken_path)
+
+    def acquire(self, deadline=None, blocking=True):
+        """Wait until the lock is taken. deadline.check() is called while
+        waiting, to give up on imports that take too long. If not blocking,
+        return False at once when the lock is held, and True otherwise.
+        Raise OSError if the filesystem does not support lock files."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        waiting = False
+        while not self._tryAcquire():
+            owner = _readOwner(self.path)
+            if self.isStale(owner):
+                print("Breaking stale lock {} of {}".format(self.path, owner))
+                self._breakStale(owner)
+                continue
+            if not blocking:
+                return False
+            if not waiting and owner is not None:
+                print("Waiting for {host} (pid {pid}) to finish with {path}...".format(path=self.path, **owner))
+                waiting = True
+            if deadline is not None:
+                deadline.check("while waiting for {}".format(self.path))
+            time.sleep(POLL_INTERVAL)
+        self._stop.clear()
+        self._refresher = threading.Thread(target=self._refresh, daemon=True)
+        self._refresher.start()
+        return True
+
+    def _refresh(self):
+        while not self._stop.wait(REFRESH_INTERVAL):
+            try:
+                os.utime(self.path)
+            except OSError as err:
+                print("Could not refresh lock {}: {}".format(self.path, err))
+
+    def release(self):
+        self._stop.set()
+        self._refresher.join()
+        if _readOwner(self.path) == self.owner:
+            os.remove(self.path)
+        else:
+            print("Lock {} was taken over while held".format(self.path))
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+@contextlib.contextmanager
+def locked(path, deadline=None):
+    """Hold the lock of path in a with statement, or go on without it if
+    lock files cannot be created there"""
+    lock = FileLock(path)
+    try:
+        lock.acquire(deadline)
+    except OSError as err:
+        print("Could not lock {}, going on without a lock: {}".format(path, err))
+        yield
+        return
+    try:
+        yield
+    finally:
+        lock.release()
@@ -0,0 +1,321 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Disk usage accounting and eviction for the texture directory, laid out as
+<provider>/<asset>/<variant>. A variant is either a directory of maps or a
+single file of the asset directory (HDRIs, IES profiles). The last access
+and the number of imports of each variant are kept in an '.access.json' file
+of its asset directory.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+
+from . import locks
+
+ACCESS_FILE = ".access.json"
+EVICTION_PROTECTION = 600  # seconds during which a variant used cannot be evicted
+REPORT_MAX_AGE = 300  # seconds before a usage report gets measured again
+
+_access_lock = threading.Lock()
+_reports = {}  # root -> (time, report)
+_reports_lock = threading.Lock()
+_referenced = frozenset()  # files used by the open blend file
+
+
+def isVariantEntry(name):
+    """Tell whether an entry of an asset directory is a variant, as opposed
+    to metadata or thumbnails"""
+    return not name.startswith(".") and not name.startswith("thumb.")
+
+
+def variantOf(root, path):
+    """Return the asset directory and the variant entry holding path, or
+    (None, None) if path is not within a variant of root"""
+    rel = os.path.relpath(os.path.realpath(path), os.path.realpath(root))
+    parts = rel.split(os.path.sep)
+    if rel.startswith("..") or len(parts) < 3 or parts[0].startswith(".") or not isVariantEntry(parts[2]):
+        return None, None
+    return os.path.join(root, parts[0], parts[1]), parts[2]
+
+
+def _loadAccess(asset_dir):
+    try:
+        with open(os.path.join(asset_dir, ACCESS_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def recordAccess(root, paths):
+    """Record that the variants holding paths have just been used"""
+    now = time.time()
+    by_asset = {}
+    for path in paths:
+        asset_dir, entry = variantOf(root, path)
+        if asset_dir is not None:
+            by_asset.setdefault(asset_dir, set()).add(entry)
+    with _access_lock:
+        for asset_dir, entries in by_asset.items():
+            access = _loadAccess(asset_dir)
+            for entry in entries:
+                count = access.get(entry, [0, 0])[1]
+                access[entry] = [now, count + 1]
+            try:
+                _saveAccess(asset_dir, access)
+            except OSError as err:
+                print("Could not record the use of {}: {}".format(asset_dir, err))
+
+
+def _saveAccess(asset_dir, access):
+    """Replace the access file of asset_dir, which other processes may be
+    reading or writing as well"""
+    tmp_path = os.path.join(asset_dir, "{}.{}.{}.tmp".format(ACCESS_FILE, os.getpid(), threading.get_ident()))
+    with open(tmp_path, "w") as f:
+        json.dump(access, f)
+    os.replace(tmp_path, os.path.join(asset_dir, ACCESS_FILE))
+
+
+def _entrySize(path, seen):
+    """Size of the files under path that are not in seen, the set of
+    (device, inode) already counted, so that links are counted once"""
+    try:
+        st = os.stat(path, follow_symlinks=False)
+    except OSError:
+        return 0
+    if not os.path.isdir(path):
+        key = (st.st_dev, st.st_ino)
+        if key in seen:
+            return 0
+        seen.add(key)
+        return st.st_size
+    total = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                total += _entrySize(entry.path, seen)
+            else:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                key = (st.st_dev, st.st_ino)
+                if key not in seen:
+                    seen.add(key)
+                    total += st.st_size
+    return total
+
+
+def _fileInodes(path):
+    """Yield the (device, inode), size and number of links of the files
+    under path"""
+    if not os.path.isdir(path):
+        try:
+            st = os.stat(path, follow_symlinks=False)
+        except OSError:
+            return
+        yield (st.st_dev, st.st_ino), st.st_size, st.st_nlink
+        return
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                st = os.stat(os.path.join(dirpath, filename), follow_symlinks=False)
+            except OSError:
+                continue
+            yield (st.st_dev, st.st_ino), st.st_size, st.st_nlink
+
+
+class Variant():
+    def __init__(self, path, size, last_access, count):
+        self.path = path
+        self.size = size
+        self.last_access = last_access
+        self.count = count
+
+
+def scanVariants(root, seen):
+    """Yield the variants of the texture directory, measured with scandir"""
+    for provider in os.scandir(root):
+        if not provider.is_dir() or provider.name.startswith("."):
+            continue
+        for asset in os.scandir(provider.path):
+            if not asset.is_dir():
+                continue
+            access = _loadAccess(asset.path)
+            for entry in os.scandir(asset.path):
+                if not isVariantEntry(entry.name):
+                    continue
+                size = _entrySize(entry.path, seen)
+                # Never imported since access is tracked: use the time of download
+                last_access, count = access.get(entry.name, [entry.stat().st_mtime, 0])
+                yield provider.name, Variant(entry.path, size, last_access, count)
+
+
+def measureUsage(root):
+    """Return a dict mapping providers, and hidden caches such as '.blobs',
+    to the bytes they take in the texture directory"""
+    usage = {}
+    seen = set()
+    if not os.path.isdir(root):
+        return usage
+    for provider, variant in scanVariants(root, seen):
+        usage[provider] = usage.get(provider, 0) + variant.size
+    # Metadata, thumbnails and caches
+    for entry in os.scandir(root):
+        if entry.is_dir() or entry.is_file():
+            usage[entry.name] = usage.get(entry.name, 0) + _entrySize(entry.path, seen)
+    with _reports_lock:
+        _reports[root] = (time.time(), usage)
+    return usage
+
+
+def cachedUsage(root, max_age=REPORT_MAX_AGE):
+    """Return the last usage measured for root if recent enough, else None"""
+    with _reports_lock:
+        measured, usage = _reports.get(root, (0, None))
+    if time.time() - measured > max_age:
+        return None
+    return usage
+
+
+def invalidateUsage(root):
+    with _reports_lock:
+        _reports.pop(root, None)
+
+
+def setReferencedPaths(paths):
+    """Remember the files that the open blend file uses, for evictions run
+    from threads that cannot look at it"""
+    global _referenced
+    _referenced = frozenset(os.path.realpath(p) for p in paths)
+
+
+def referencedPaths():
+    return _referenced
+
+
+def _isProtected(path, protected):
+    prefix = path + os.path.sep
+    return any(p == path or p.startswith(prefix) for p in protected)
+
+
+def _forgetAccess(path):
+    asset_dir, entry = os.path.dirname(path), os.path.basename(path)
+    with _access_lock:
+        access = _loadAccess(asset_dir)
+        if access.pop(entry, None) is not None:
+            _saveAccess(asset_dir, access)
+
+
+def _hasHeldLocks(path):
+    """Tell whether a file of the variant directory path is locked"""
+    if not os.path.isdir(path):
+        return False
+    for entry in os.scandir(path):
+        if entry.name.startswith(".") and entry.name.endswith(".lock"):
+            guarded = os.path.join(path, entry.name[1:-len(".lock")])
+            if locks.FileLock(guarded).isHeld():
+                return True
+    return False
+
+
+def evict(root, quota, protected=(), policy='LRU', blob_store=None, removable=None):
+    """Remove the least recently (LRU) or least frequently (LFU) used
+    variants until the texture directory takes at most quota bytes.
+    Variants holding any of the protected paths, or used recently, are kept,
+    as well as those for which removable(path) is False if given.
+    Blobs of blob_store that no longer back any file are removed as well.
+    Only files whose last link is removed, directly or as an unused blob,
+    free space. Return the number of variants removed and the bytes freed."""
+    if not os.path.isdir(root):
+        return 0, 0
+    freed = blob_store.collectGarbage() if blob_store is not None else 0
+    blob_inodes = set()
+    if blob_store is not None:
+        blob_inodes = {inode for inode, _, _ in _fileInodes(blob_store.directory)}
+    protected = {os.path.realpath(p) for p in protected}
+    seen = set()
+    variants = [v for _, v in scanVariants(root, seen)]
+    total = sum(v.size for v in variants)
+    for entry in os.scandir(root):
+        if entry.name.startswith("."):
+            total += _entrySize(entry.path, seen)
+
+    if policy == 'LFU':
+        variants.sort(key=lambda v: (v.count, v.last_access))
+    else:
+        variants.sort(key=lambda v: v.last_access)
+
+    recent = time.time() - EVICTION_PROTECTION
+    removed = 0
+    for variant in variants:
+        if total <= quota:
+            break
+        if variant.last_access > recent or _isProtected(os.path.realpath(variant.path), protected):
+            continue
+        if removable is not None and not removable(variant.path):
+            continue
+        # Skip variants being downloaded or extracted, by this or another process
+        lock = locks.FileLock(variant.path)
+        try:
+            if not lock.acquire(blocking=False):
+                continue
+        except OSError:
+            lock = None
+        try:
+            if _hasHeldLocks(variant.path):
+                continue
+            files = list(_fileInodes(variant.path))
+            try:
+                if os.path.isdir(variant.path):
+                    shutil.rmtree(variant.path)
+                else:
+                    os.remove(variant.path)
+            except OSError as err:
+                print("Could not evict {}: {}".format(variant.path, err))
+                continue
+            _forgetAccess(variant.path)
+        finally:
+            if lock is not None:
+                lock.release()
+        # Links counted just before removal, the variant may hold several
+        links = {}
+        for inode, size, nlink in files:
+            links[inode] = links.get(inode, 0) + 1
+        variant_freed = 0
+        for inode, size, nlink in files:
+            # The blob of a file goes away with its last other link
+            if links.pop(inode, None) == nlink - (1 if inode in blob_inodes else 0):
+                variant_freed += size
+        print("Evicted {} ({} bytes freed)".format(variant.path, variant_freed))
+        total -= variant_freed
+        removed += 1
+        freed += variant_freed
+    if removed and blob_store is not None:
+        blob_store.collectGarbage()
+    invalidateUsage(root)
+    return removed, freed
@@ -29,6 +29,7 @@ def isImportedInBlender():
 if isImportedInBlender():
     from . import preferences
     from . import frontend
+    from . import worker
     from .callback import register_callback
 
     def register():
@@ -38,6 +39,7 @@ if isImportedInBlender():
     def unregister():
         frontend.unregister()
         preferences.unregister()
+        worker.shutdownWorker()
 
     if __name__ == "__main__":
         register()
@@ -13,7 +13,9 @@ from .CyclesWorldData import CyclesWorldData
 from .ScrapersManager import ScrapersManager
 from .callback import get_callback
 from .metadataHandler import Metadata
-from .preferences import getPreferences
+from .Network import scheduler, throughput
+from .preferences import getPreferences, snapshotPreferences, enforceQuota
+from .settings import SIZES_POLL_INTERVAL
 import bpy.utils.previews
 from bpy.props import EnumProperty
 
@@ -40,6 +42,16 @@ class PopupOperator(bpy.types.Operator):
         wm = context.window_manager
         return wm.invoke_props_dialog(self)
 
+    def reportMissingMaps(self, data):
+        """Download again the maps that failed, once, and warn about those
+        still missing"""
+        failed = data.failedDownloads()
+        if failed:
+            failed = data.retryFailedMaps()
+        if failed:
+            self.report({'WARNING'}, "Missing maps: " + "; ".join(
+                "{} ({})".format(r.name, r.error) for r in failed))
+
 class ObjectPopupOperator(PopupOperator):
     @classmethod
     def poll(cls, context):
@@ -104,6 +116,8 @@ class OBJECT_OT_LilySurfaceScraper(ObjectPopupOperator, CallbackProps):
         texdir = os.path.dirname(bpy.data.filepath)
         name = None if not self.name else self.name
         data = CyclesMaterialData(self.url, texture_root=texdir, asset_name=name)
+        if pref.use_worker:
+            data.useWorker(snapshotPreferences(context))
         if data.error is None:
             variants = data.getVariantList()
         if data.error is not None:
@@ -128,11 +142,14 @@ class OBJECT_OT_LilySurfaceScraper(ObjectPopupOperator, CallbackProps):
                 callback_handle=self.callback_handle)
         else:
             if data.selectVariant(selected_variant):
+                self.reportMissingMaps(data)
                 if self.create_material:
                     mat = data.createMaterial()
                     context.object.active_material = mat
                 else:
                     data.loadImages()
+                # Once the maps are used by the file, so that they are kept
+                enforceQuota(context)
             else:
                 print("scraping failed :/")
             cb = get_callback(self.callback_handle)
@@ -165,9 +182,14 @@ def list_variant_enum(self, context):
     global internal_states
     data = internal_states[self.internal_state]
     items = []
-    for i, v in enumerate(data.getVariantList()):
-        icon = "CHECKMARK" if data.isDownloaded(v) else "IMPORT"
-        items.append((str(i), v, v, icon, i))
+    variants = data.getVariantList()
+    sizes = data.getVariantSizes() if variants else {}
+    redrawWhenSizesReady(data)
+    for i, v in enumerate(variants or []):
+        downloaded = data.isDownloaded(v)
+        icon = "CHECKMARK" if downloaded else "IMPORT"
+        label, description = variantSizeLabel(v, sizes.get(v), downloaded)
+        items.append((str(i), label, description, icon, i))
     internal_states['kbjfknvglvhn'] = items  # keep a reference to avoid a known crash of blander, says the doc
     return items
 
@@ -211,11 +233,13 @@ class OBJECT_OT_LilySurfacePromptVariant(ObjectPopupOperator, CallbackProps):
         data = internal_states[self.internal_state]
         data.setReinstall(bool(self.reisntall))
         if data.selectVariant(int(self.variant)):
+            self.reportMissingMaps(data)
             if self.create_material:
                 mat = data.createMaterial()
                 context.object.active_material = mat
             else:
                 data.loadImages()
+            enforceQuota(context)
         else:
             print("scraping failed :/")
         cb = get_callback(self.callback_handle)
@@ -270,6 +294,8 @@ class OBJECT_OT_LilyWorldScraper(PopupOperator, CallbackProps):
         texdir = os.path.dirname(bpy.data.filepath)
         name = None if not self.name else self.name
         data = CyclesWorldData(self.url, texture_root=texdir, asset_name=name)
+        if pref.use_worker:
+            data.useWorker(snapshotPreferences(context))
         if data.error is None:
             variants = data.getVariantList()
         if data.error is not None:
@@ -294,11 +320,13 @@ class OBJECT_OT_LilyWorldScraper(PopupOperator, CallbackProps):
                 callback_handle=self.callback_handle)
         else:
             if data.selectVariant(selected_variant):
+                self.reportMissingMaps(data)
                 if self.create_world:
                     world = data.createWorld()
                     context.scene.world = world
                 else:
                     data.loadImages()
+                enforceQuota(context)
             else:
                 print("scraping failed :/")
             cb = get_callback(self.callback_handle)
@@ -332,9 +360,14 @@ def list_variant_enum(self, context):
     global internal_states
     data = internal_states[self.internal_state]
     items = []
-    for i, v in enumerate(data.getVariantList()):
-        icon = "CHECKMARK" if data.isDownloaded(v) else "IMPORT"
-        items.append((str(i), v, v, icon, i))
+    variants = data.getVariantList()
+    sizes = data.getVariantSizes() if variants else {}
+    redrawWhenSizesReady(data)
+    for i, v in enumerate(variants or []):
+        downloaded = data.isDownloaded(v)
+        icon = "CHECKMARK" if downloaded else "IMPORT"
+        label, description = variantSizeLabel(v, sizes.get(v), downloaded)
+        items.append((str(i), label, description, icon, i))
     internal_states['ikdrtvhdlvhn'] = items  # keep a reference to avoid a known crash of blander, says the doc
     return items
 
@@ -378,11 +411,13 @@ class OBJECT_OT_LilyWorldPromptVariant(PopupOperator, CallbackProps):
         data = internal_states[self.internal_state]
         data.setReinstall(bool(self.reisntall))
         if data.selectVariant(int(self.variant)):
+            self.reportMissingMaps(data)
             if self.create_world:
                 world = data.createWorld()
                 context.scene.world = world
             else:
                 data.loadImages()
+            enforceQuota(context)
         else:
             print("scraping failed :/")
         cb = get_callback(self.callback_handle)
@@ -419,6 +454,8 @@ class OBJECT_OT_LilyLightScraper(PopupOperator, CallbackProps):
         texdir = os.path.dirname(bpy.data.filepath)
         name = None if not self.name else self.name
         data = CyclesLightData(self.url, texture_root=texdir, asset_name=name)
+        if pref.use_worker:
+            data.useWorker(snapshotPreferences(context))
         if data.error is None:
             data.getVariantList()
         if data.error is not None:
@@ -427,7 +464,9 @@ class OBJECT_OT_LilyLightScraper(PopupOperator, CallbackProps):
 
         selected_variant = 0
         if data.selectVariant(selected_variant):
+            self.reportMissingMaps(data)
             data.createLights()
+            enforceQuota(context)
         else:
             print("scraping failed :/")
         cb = get_callback(self.callback_handle)
@@ -574,6 +613,47 @@ class LIGHT_PT_LilySurfaceScraper(bpy.types.Panel):
 ## Utils
 
 
+_awaiting_sizes = set()
+
+
+def redrawWhenSizesReady(data):
+    """Redraw the interface once the variant sizes that data measures in the
+    background are known, rather than waiting for them while drawing"""
+    if not data.variantSizesPending() or id(data) in _awaiting_sizes:
+        return
+    _awaiting_sizes.add(id(data))
+
+    def poll():
+        if data.variantSizesPending():
+            return SIZES_POLL_INTERVAL
+        _awaiting_sizes.discard(id(data))
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                area.tag_redraw()
+        return None
+    bpy.app.timers.register(poll, first_interval=SIZES_POLL_INTERVAL)
+
+
+def variantSizeLabel(variant, sizes, downloaded):
+    """Return the label and description of a variant in the variant prompt,
+    given the number of bytes it needs to download and take on disk"""
+    if sizes is None:
+        return variant, variant
+    transfer, disk = sizes
+    description = "{}: {} on disk once extracted".format(variant, throughput.formatSize(disk))
+    if downloaded:
+        return variant, description
+    seconds = throughput.getMeter().estimate(transfer)
+    label = "{} ({}".format(variant, throughput.formatSize(transfer))
+    if seconds is not None:
+        label += ", ~" + throughput.formatDuration(seconds)
+    label += ")"
+    description += ", downloads {}".format(throughput.formatSize(transfer))
+    if seconds is not None:
+        description += " in about {} at the speed of recent imports".format(throughput.formatDuration(seconds))
+    return label, description
+
+
 def thumbnailGeneratorGenerator(scraper_cls):
     """
     TODO: It is bad design to have Blender halt for downloading metadata while drawing the UI
@@ -589,6 +669,8 @@ def thumbnailGeneratorGenerator(scraper_cls):
 
         texdir = os.path.dirname(bpy.data.filepath)
         scraper = scraper_cls(texture_root=texdir)
+        # Filling the asset browser must not hold back actual imports
+        scraper.priority = scheduler.PREFETCH
 
         if "missingThumbnail" not in registeredThumbnails:
             registeredThumbnails.add("missingThumbnail")
@@ -597,6 +679,15 @@ def thumbnailGeneratorGenerator(scraper_cls):
 
         basedir = scraper.getTextureDirectory(scraper_cls.home_dir)
 
+        # resolve all the assets missing a metadata file at once
+        missing = [i for i in os.listdir(basedir)
+                   if i not in metadataGetFailed and i not in registeredThumbnails
+                   and os.path.isdir(os.path.join(basedir, i))
+                   and not os.path.isfile(os.path.join(basedir, i, scraper_cls.metadata_filename))]
+        if missing:
+            print(f"No metadata for {len(missing)} assets of {scraper_cls.source_name}, getting it")
+        resolved = scraper.fetchMetadataBatch(missing) if missing else {}
+
         # iterate over assets in scrapers home dir
         for i in os.listdir(basedir):
             # these ones dont have a metadata file, so they will be fetched using the local scraper
@@ -617,16 +708,13 @@ def thumbnailGeneratorGenerator(scraper_cls):
             metadata_file = os.path.join(basedir, i, scraper_cls.metadata_filename)
             metadata = Metadata.open(metadata_file)
             # if no metadata file was found
+            if metadata.name == "" and i in resolved:
+                metadata = resolved[i]
             if metadata.name == "":
-                # try to get info
-                print(f"No metadata ('{metadata_file}' not found)! getting for {i}")
-                scraper.getVariantData(i)
                 # if its still empty then just skip this
-                if scraper.metadata.name == "":
-                    print(f"!! failed to get metadata for {i} from {scraper.home_url} !!")
-                    metadataGetFailed.append(i)
-                    continue
-                metadata = scraper.metadata
+                print(f"!! failed to get metadata for {i} from {scraper.home_url} !!")
+                metadataGetFailed.append(i)
+                continue
             thumb_name = metadata.thumbnail
 
             if thumb_name is None:
@@ -6,6 +6,8 @@
 
 import json
 import os
+import socket
+import threading
 
 
 class Metadata:
@@ -66,8 +68,19 @@ class Metadata:
             "variants": self.variants,
             "custom": self.custom
         }
-        with open(metadata_filepath, "w") as f:
-            json.dump(metadata, f, indent=4)
+        # replace the file rather than writing into it, as it may be a link
+        # to the copy of a shared cache. The temporary file is unique, as the
+        # metadata may be saved by several threads or machines at once.
+        tmp_filepath = "{}.{}.{}.{}.tmp".format(metadata_filepath, socket.gethostname(),
+                                                os.getpid(), threading.get_ident())
+        try:
+            with open(tmp_filepath, "w") as f:
+                json.dump(metadata, f, indent=4)
+            os.replace(tmp_filepath, metadata_filepath)
+        except BaseException:
+            if os.path.isfile(tmp_filepath):
+                os.remove(tmp_filepath)
+            raise
 
     def getCustom(self, key):
         """get a custom variable"""
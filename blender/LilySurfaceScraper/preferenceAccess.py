@@ -0,0 +1,51 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Access to the add-on preferences for code that does not depend on Blender.
+Outside of Blender, e.g. in the download worker (see worker.py), the values
+of the preferences are given as a snapshot instead.
+"""
+
+import types
+
+addon_idname = __package__.split(".")[0]
+
+_override = None
+
+
+def setPreferencesOverride(values):
+    """Make getPreferences return values (a dict) instead of the preferences
+    stored by Blender, or stop doing so if values is None"""
+    global _override
+    _override = None if values is None else types.SimpleNamespace(**values)
+
+
+def getPreferences(context=None):
+    if _override is not None:
+        return _override
+    import bpy
+    if context is None: context = bpy.context
+    preferences = context.preferences
+    addon_preferences = preferences.addons[addon_idname].preferences
+    return addon_preferences
@@ -21,17 +21,62 @@
 # This file is part of LilySurfaceScraper, a Blender add-on to import materials
 # from a single URL
 
+import os
+import threading
+
 import bpy
 
-addon_idname = __package__.split(".")[0]
+from .Network import session, transports, throughput
+from .Storage import blobStore, usage
+from .settings import MAX_DOWNLOAD_WORKERS, BLOB_STORE_DIR
+from .preferenceAccess import getPreferences, addon_idname
 
 # -----------------------------------------------------------------------------
 
-def getPreferences(context=None):
-    if context is None: context = bpy.context
-    preferences = context.preferences
-    addon_preferences = preferences.addons[addon_idname].preferences
-    return addon_preferences
+def getTextureRoot():
+    """Absolute path of the texture directory of the open blend file"""
+    from .Scrapers.AbstractScraper import AbstractScraper
+    return AbstractScraper(texture_root=os.path.dirname(bpy.data.filepath)).getTextureRoot()
+
+
+def referencedPaths():
+    """Absolute paths of the files that the open blend file uses"""
+    paths = set()
+    for image in bpy.data.images:
+        if image.filepath:
+            paths.add(os.path.normpath(bpy.path.abspath(image.filepath, library=image.library)))
+    trees = [d.node_tree for d in [*bpy.data.materials, *bpy.data.worlds, *bpy.data.lights] if d.node_tree]
+    for tree in trees:
+        for node in tree.nodes:
+            if node.type == 'TEX_IES' and node.mode == 'EXTERNAL' and node.filepath:
+                paths.add(os.path.normpath(bpy.path.abspath(node.filepath)))
+    return paths
+
+
+def enforceQuota(context=None, wait=False):
+    """Evict textures until the texture directory fits in the quota set in
+    preferences, in the background unless wait is True.
+    Return the number of variants removed and the bytes freed if waiting."""
+    pref = getPreferences(context)
+    referenced = referencedPaths()
+    # Also kept by the local cache of remote storage, which trims it in download threads
+    usage.setReferencedPaths(referenced)
+    if pref.texture_quota <= 0:
+        return 0, 0
+    root = getTextureRoot()
+    store = blobStore.getBlobStore(os.path.join(root, BLOB_STORE_DIR)) if pref.deduplicate_textures else None
+    args = (root, pref.texture_quota * 1024 * 1024, referenced, pref.eviction_policy, store)
+    if wait:
+        return usage.evict(*args)
+    threading.Thread(target=usage.evict, args=args, daemon=True).start()
+    return 0, 0
+
+
+def snapshotPreferences(context=None):
+    """Return the values of all preferences as a dict, to be given to
+    setPreferencesOverride in a process that does not run Blender"""
+    pref = getPreferences(context)
+    return {name: getattr(pref, name) for name in LilySurfaceScraperPreferences.__annotations__}
 
 # -----------------------------------------------------------------------------
 
@@ -44,6 +89,75 @@ class LilySurfaceScraperPreferences(bpy.types.AddonPreferences):
         default="LilySurface",
     )
 
+    storage_backend: bpy.props.EnumProperty(
+        name="Shared storage",
+        description="Where downloaded textures are shared with other machines",
+        items=[
+            ('LOCAL', "None", "Only keep textures in the texture directory"),
+            ('SHARED', "Shared directory", "Keep textures in a directory shared by all projects, "
+                                           "and link them into the texture directory of each project"),
+            ('S3', "S3 bucket", "Upload textures to an S3 compatible bucket, and copy them from there "
+                                "before downloading them from the source (requires boto3)"),
+        ],
+        default='LOCAL',
+    )
+
+    shared_cache_dir: bpy.props.StringProperty(
+        name="Shared directory",
+        description="Machine-wide (or NAS) directory holding a single copy of the textures of all projects",
+        subtype='DIR_PATH',
+        default="",
+    )
+
+    s3_endpoint: bpy.props.StringProperty(
+        name="Endpoint",
+        description="Address of the S3 service, e.g. http://minio.local:9000. Leave empty for AWS",
+        default="",
+    )
+
+    s3_bucket: bpy.props.StringProperty(
+        name="Bucket",
+        default="",
+    )
+
+    s3_prefix: bpy.props.StringProperty(
+        name="Prefix",
+        description="Path of the textures within the bucket",
+        default="LilySurface",
+    )
+
+    storage_cache_size: bpy.props.IntProperty(
+        name="Local cache size (MB)",
+        description="Remove the least recently used textures from the texture directory "
+                    "once they are in the bucket and the directory exceeds this size, 0 for no limit",
+        default=0,
+        min=0,
+    )
+
+    deduplicate_textures: bpy.props.BoolProperty(
+        name="Deduplicate textures",
+        description="Keep identical texture files only once on disk, as clones or else hard links of a single copy. "
+                    "With hard links, editing one of the files in place changes all of them",
+        default=True,
+    )
+
+    texture_quota: bpy.props.IntProperty(
+        name="Texture directory quota (MB)",
+        description="Remove the least used variants once the texture directory exceeds this size, "
+                    "never those used by the open file. 0 for no limit",
+        default=0,
+        min=0,
+    )
+
+    eviction_policy: bpy.props.EnumProperty(
+        name="Remove first",
+        items=[
+            ('LRU', "Least recently used", "Remove the variants imported the longest time ago first"),
+            ('LFU', "Least frequently used", "Remove the variants imported the fewest times first"),
+        ],
+        default='LRU',
+    )
+
     use_ao: bpy.props.BoolProperty(
         name="Use AO map",
         default=False,
@@ -79,6 +193,188 @@ class LilySurfaceScraperPreferences(bpy.types.AddonPreferences):
         default=True,
     )
 
+    max_downloads: bpy.props.IntProperty(
+        name="Concurrent downloads",
+        description="Maximum number of files downloaded at the same time, all imports included",
+        default=MAX_DOWNLOAD_WORKERS,
+        min=1,
+        max=32,
+    )
+
+    max_downloads_per_host: bpy.props.IntProperty(
+        name="Concurrent downloads per host",
+        description="Maximum number of files downloaded at the same time from a single provider",
+        default=6,
+        min=1,
+        max=32,
+    )
+
+    bandwidth_limit: bpy.props.IntProperty(
+        name="Bandwidth limit (KB/s)",
+        description="Total download bandwidth the add-on may use, 0 for no limit",
+        default=0,
+        min=0,
+    )
+
+    connect_timeout: bpy.props.FloatProperty(
+        name="Connection timeout (s)",
+        description="Give up on a request if the server does not accept the connection within this delay",
+        default=10.0,
+        min=1.0,
+    )
+
+    read_timeout: bpy.props.FloatProperty(
+        name="Read timeout (s)",
+        description="Give up on a request if the server stops sending data for this long",
+        default=60.0,
+        min=1.0,
+    )
+
+    max_retries: bpy.props.IntProperty(
+        name="Retries",
+        description="Number of times a failed request is retried, with increasing delays",
+        default=3,
+        min=0,
+        max=10,
+    )
+
+    import_deadline: bpy.props.IntProperty(
+        name="Import deadline (s)",
+        description="Abort the downloads of an import taking longer than this, 0 for no limit",
+        default=600,
+        min=0,
+    )
+
+    use_http_cache: bpy.props.BoolProperty(
+        name="Cache provider API responses",
+        description="Keep API and page responses on disk and revalidate them instead of downloading them again",
+        default=True,
+    )
+
+    http_cache_ttl: bpy.props.IntProperty(
+        name="Cache lifetime (hours)",
+        description="How long a cached response is used before checking whether it changed on the server",
+        default=24,
+        min=0,
+    )
+
+    stream_zip_extraction: bpy.props.BoolProperty(
+        name="Extract zip files while downloading",
+        description="Decompress texture archives as they arrive instead of downloading them entirely first",
+        default=True,
+    )
+
+    sparse_zip_fetch: bpy.props.BoolProperty(
+        name="Download only useful maps from zip files",
+        description="Read the content of remote texture archives and only download the maps that are used",
+        default=True,
+    )
+
+    transport: bpy.props.EnumProperty(
+        name="Transport",
+        description="Library used to send the requests",
+        items=[
+            ('REQUESTS', "requests", "HTTP/1.1 with kept-alive connections"),
+            ('HTTP2', "HTTP/2", "Multiplex all requests to a host over a single connection (requires httpx)"),
+            ('LOCAL', "Local mirror", "Read files from a local directory instead of the network"),
+        ],
+        default='REQUESTS',
+    )
+
+    local_mirror_dir: bpy.props.StringProperty(
+        name="Mirror directory",
+        description="Directory holding a copy of the sources, in host/path sub-directories",
+        subtype='DIR_PATH',
+        default="",
+    )
+
+    proxy_url: bpy.props.StringProperty(
+        name="Caching proxy",
+        description="Address of a caching proxy shared with other instances (e.g. http://192.168.1.10:8765), "
+                    "started with 'python Network/cachingProxy.py'. Leave empty to connect directly",
+        default="",
+    )
+
+    cassette_mode: bpy.props.EnumProperty(
+        name="Record/Replay",
+        description="Record the requests sent during imports, or answer them from a previous recording",
+        items=[
+            ('OFF', "Off", "Use the network normally"),
+            ('RECORD', "Record", "Save every request and its answer in the cassette directory"),
+            ('REPLAY', "Replay", "Answer requests from the cassette directory, without network"),
+        ],
+        default='OFF',
+    )
+
+    cassette_dir: bpy.props.StringProperty(
+        name="Cassette directory",
+        description="Directory where requests are recorded to or replayed from",
+        subtype='DIR_PATH',
+        default="",
+    )
+
+    cassette_max_body: bpy.props.IntProperty(
+        name="Max recorded size (KB)",
+        description="Only record the beginning of larger answers, 0 to record them entirely",
+        default=0,
+        min=0,
+    )
+
+    replay_latency: bpy.props.IntProperty(
+        name="Simulated latency (ms)",
+        description="Delay before each replayed answer",
+        default=0,
+        min=0,
+    )
+
+    replay_bandwidth: bpy.props.IntProperty(
+        name="Simulated bandwidth (KB/s)",
+        description="Rate at which replayed answers are delivered, 0 for no limit",
+        default=0,
+        min=0,
+    )
+
+    hedge_requests: bpy.props.BoolProperty(
+        name="Hedge slow requests",
+        description="When a server is slower to answer than usual, send the same request again (or to a mirror) and use the first answer",
+        default=True,
+    )
+
+    hedge_percentile: bpy.props.IntProperty(
+        name="Hedging percentile",
+        description="A request is hedged once it has waited longer than this percentile of the latencies recorded for its host",
+        default=95,
+        min=50,
+        max=99,
+    )
+
+    use_worker: bpy.props.BoolProperty(
+        name="Download in a separate process",
+        description="Run downloads and extraction out of Blender, so that they do not slow down the interface",
+        default=False,
+    )
+
+    use_segmented_download: bpy.props.BoolProperty(
+        name="Segmented downloads",
+        description="Download very large files (e.g. high resolution HDRIs) over several parallel connections",
+        default=False,
+    )
+
+    segment_threshold: bpy.props.IntProperty(
+        name="Segmentation threshold (MB)",
+        description="Only files larger than this are downloaded in segments",
+        default=64,
+        min=1,
+    )
+
+    segment_connections: bpy.props.IntProperty(
+        name="Connections per file",
+        description="Number of parallel connections used for a segmented download",
+        default=4,
+        min=2,
+        max=16,
+    )
+
     def draw(self, context):
         layout = self.layout
 
@@ -86,6 +382,29 @@ class LilySurfaceScraperPreferences(bpy.types.AddonPreferences):
         layout.label(text="It can either be relative to the blend file, or global to all files.")
         layout.label(text="If it is relative, you must always save the blend file before importing materials and worlds.")
         layout.prop(self, "texture_dir")
+        row = layout.row()
+        row.prop(self, "deduplicate_textures")
+        row.operator("preferences.lily_dedup_report")
+        for line in _dedup_report:
+            layout.label(text=line)
+        layout.prop(self, "storage_backend")
+        if self.storage_backend == 'SHARED':
+            layout.prop(self, "shared_cache_dir")
+        if self.storage_backend == 'S3':
+            layout.prop(self, "s3_endpoint")
+            layout.prop(self, "s3_bucket")
+            layout.prop(self, "s3_prefix")
+            layout.prop(self, "storage_cache_size")
+        row = layout.row()
+        row.prop(self, "texture_quota")
+        if self.texture_quota > 0:
+            row.prop(self, "eviction_policy")
+        row = layout.row()
+        row.operator("preferences.lily_measure_usage")
+        row.operator("preferences.lily_free_space")
+        measured = usage.cachedUsage(getTextureRoot(), max_age=float("inf"))
+        for name, size in sorted((measured or {}).items(), key=lambda item: -item[1]):
+            layout.label(text="{}: {}".format(name, throughput.formatSize(size)))
 
         split1 = layout.split(factor=1/3)
 
@@ -126,8 +445,126 @@ class LilySurfaceScraperPreferences(bpy.types.AddonPreferences):
         # textures.separator()
         textures.prop(self, "ies_pack_files")
 
+        network = layout.box()
+        network.label(text="Network")
+        network.prop(self, "max_downloads")
+        network.prop(self, "max_downloads_per_host")
+        network.prop(self, "bandwidth_limit")
+        network.prop(self, "connect_timeout")
+        network.prop(self, "read_timeout")
+        network.prop(self, "max_retries")
+        network.prop(self, "import_deadline")
+        network.prop(self, "use_worker")
+        network.prop(self, "use_http_cache")
+        if self.use_http_cache:
+            network.prop(self, "http_cache_ttl")
+        network.prop(self, "sparse_zip_fetch")
+        network.prop(self, "stream_zip_extraction")
+        network.prop(self, "transport")
+        if self.transport == 'LOCAL':
+            network.prop(self, "local_mirror_dir")
+        else:
+            network.prop(self, "proxy_url")
+        row = network.row()
+        row.operator("preferences.lily_benchmark_transports")
+        for line in _benchmark_report:
+            row = network.row()
+            row.label(text=line)
+        network.prop(self, "cassette_mode")
+        if self.cassette_mode != 'OFF':
+            network.prop(self, "cassette_dir")
+        if self.cassette_mode == 'RECORD':
+            network.prop(self, "cassette_max_body")
+        elif self.cassette_mode == 'REPLAY':
+            network.prop(self, "replay_latency")
+            network.prop(self, "replay_bandwidth")
+        network.prop(self, "hedge_requests")
+        if self.hedge_requests:
+            network.prop(self, "hedge_percentile")
+        network.prop(self, "use_segmented_download")
+        if self.use_segmented_download:
+            network.prop(self, "segment_threshold")
+            network.prop(self, "segment_connections")
+        stats = session.connectionStats()
+        network.label(text="{requests} requests sent, {reused} reused a kept-alive connection.".format(**stats))
+
+# -----------------------------------------------------------------------------
+
+_benchmark_report = []
+_dedup_report = []
+
+
+class PREFERENCES_OT_LilyBenchmarkTransports(bpy.types.Operator):
+    """Compare the transports by fetching the home page of every source"""
+    bl_idname = "preferences.lily_benchmark_transports"
+    bl_label = "Benchmark transports"
+
+    def execute(self, context):
+        from .ScrapersManager import ScrapersManager
+        pref = getPreferences(context)
+        urls = [s.home_url for s in ScrapersManager.getScrapersList() if s.home_url]
+        names = [n for n in transports.availableBackends() if n != 'LOCAL' or pref.local_mirror_dir]
+        results = transports.benchmark(urls, names, pref.local_mirror_dir,
+                                       (pref.connect_timeout, pref.read_timeout))
+        _benchmark_report.clear()
+        for name, (seconds, size, failures) in results.items():
+            line = "{}: {:.2f}s for {} requests ({} KB, {} failed)".format(
+                name, seconds, len(urls), size // 1024, failures)
+            print(line)
+            _benchmark_report.append(line)
+        return {'FINISHED'}
+
+# -----------------------------------------------------------------------------
+
+class PREFERENCES_OT_LilyDedupReport(bpy.types.Operator):
+    """Measure how much disk space deduplication saved in the texture directory"""
+    bl_idname = "preferences.lily_dedup_report"
+    bl_label = "Deduplication report"
+
+    def execute(self, context):
+        root = getTextureRoot()
+        report = blobStore.getBlobStore(os.path.join(root, BLOB_STORE_DIR)).report()
+        line = "{} saved on {} files, {} distinct files take {}".format(
+            throughput.formatSize(report["saved_bytes"]), report["deduplicated_files"],
+            report["blobs"], throughput.formatSize(report["blob_bytes"]))
+        print(line)
+        _dedup_report[:] = [line]
+        return {'FINISHED'}
+
+class PREFERENCES_OT_LilyMeasureUsage(bpy.types.Operator):
+    """Measure the disk space taken by each source in the texture directory"""
+    bl_idname = "preferences.lily_measure_usage"
+    bl_label = "Measure disk usage"
+
+    def execute(self, context):
+        measured = usage.measureUsage(getTextureRoot())
+        print("Texture directory: {}".format(throughput.formatSize(sum(measured.values()))))
+        return {'FINISHED'}
+
+
+class PREFERENCES_OT_LilyFreeSpace(bpy.types.Operator):
+    """Remove the least used variants until the texture directory fits in its quota"""
+    bl_idname = "preferences.lily_free_space"
+    bl_label = "Free space now"
+
+    @classmethod
+    def poll(cls, context):
+        return getPreferences(context).texture_quota > 0
+
+    def execute(self, context):
+        removed, freed = enforceQuota(context, wait=True)
+        self.report({'INFO'}, "Removed {} variants, freeing {}".format(removed, throughput.formatSize(freed)))
+        usage.measureUsage(getTextureRoot())
+        return {'FINISHED'}
+
 # -----------------------------------------------------------------------------
 
-classes = (LilySurfaceScraperPreferences,)
+classes = (
+    LilySurfaceScraperPreferences,
+    PREFERENCES_OT_LilyBenchmarkTransports,
+    PREFERENCES_OT_LilyDedupReport,
+    PREFERENCES_OT_LilyMeasureUsage,
+    PREFERENCES_OT_LilyFreeSpace,
+)
 
 register, unregister = bpy.utils.register_classes_factory(classes)
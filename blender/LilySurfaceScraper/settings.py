@@ -24,4 +24,14 @@
 ## Constants
 
 TEXTURE_DIR = "LilySurface"
+HTTP_CACHE_DIR = ".httpcache"  # relative to the texture directory
+BLOB_STORE_DIR = ".blobs"  # relative to the texture directory
+MANIFEST_FILE = ".manifest.json"  # files extracted from an archive, in the variant directory
 UNSUPPORTED_PROVIDER_ERR = "provider not supported. See the documentation for a list of supported providers."
+
+USER_AGENT = "Mozilla/5.0"  # fake user agent, some providers reject python-requests
+MAX_DOWNLOAD_WORKERS = 8  # concurrent map downloads, also the size of per-host connection pools
+MAX_POOLED_HOSTS = 16  # number of hosts for which connections are kept alive
+MAX_EXTRACT_WORKERS = 4  # members of a zip file decompressed in parallel
+VARIANT_SIZES_TTL = 7 * 24 * 3600  # seconds before the download sizes of variants are measured again
+SIZES_POLL_INTERVAL = 0.2  # seconds between checks of the variant prompt for sizes measured in the background
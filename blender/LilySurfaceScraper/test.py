@@ -1,25 +1,80 @@
+import os
+
 import bpy
 
+from LilySurfaceScraper.Network.stats import getStats
+from LilySurfaceScraper.Network.cassette import missedRequests
+from LilySurfaceScraper.preferenceAccess import getPreferences
+
+# Requests are answered from a cassette so that their number does not depend
+# on the providers. Set LILY_RECORD_CASSETTE=1 to record it again.
+CASSETTE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_cassette")
+
+pref = getPreferences()
+pref.cassette_dir = CASSETTE_DIR
+pref.cassette_mode = 'RECORD' if os.environ.get("LILY_RECORD_CASSETTE") else 'REPLAY'
+pref.replay_latency = 0
+pref.replay_bandwidth = 0
+# Requests sent by the worker process would not be counted here
+pref.use_worker = False
+
+def checkBudget(label, max_requests):
+	"""Fail if the last import sent more requests than expected, to catch
+	redundant round-trips. Cached answers do not count."""
+	global counts
+	requests, nbytes = getStats().total()
+	used = requests - counts[0]
+	print("{}: {} requests, {} bytes".format(label, used, nbytes - counts[1]))
+	assert used <= max_requests, "{} sent {} requests, budget is {}".format(label, used, max_requests)
+	missed = missedRequests()
+	assert missed == counts[2], "{} sent {} requests missing from {}".format(label, missed - counts[2], CASSETTE_DIR)
+	counts = (requests, nbytes, missed)
+
+counts = getStats().total() + (missedRequests(),)
+
 # Test regular material
+# (api + thumbnail + zip: head, tail, central directory and up to 5 map ranges)
 bpy.ops.object.lily_surface_import(
-	url="https://cc0textures.com/view?id=Ground023",
+	url="https://ambientcg.com/view?id=Ground023",
 	variant="2K-JPG"
 )
+checkBudget("ambientCG", 10)
 
 # Test two-sided
+# (api + thumbnail page + thumbnail + zip: head, tail, central directory and up to 14 map ranges)
 bpy.ops.object.lily_surface_import(
 	url="https://www.cgbookcase.com/textures/autumn-leaf-30",
-	variant="2K Twosided"
+	variant="2K (double-sided)"
 )
+checkBudget("cgbookcase", 20)
 
 # Test World
+# (info + files + thumbnail + map)
 bpy.ops.object.lily_world_import(
-	url="https://hdrihaven.com/hdri/?h=the_lost_city",
-	variant="4k"
+	url="https://polyhaven.com/a/the_lost_city",
+	variant="4k (hdr)"
 )
+checkBudget("Poly Haven HDRI", 4)
 
 # Test multiple base colors
-bpy.ops.object.lily_world_import(
-	url="https://texturehaven.com/tex/?t=fabric_pattern_05",
-	variant="1k JPG 4 MB"
+# (info + files + thumbnail + one request per map)
+bpy.ops.object.lily_surface_import(
+	url="https://polyhaven.com/a/fabric_pattern_05",
+	variant="1k (jpg)"
+)
+checkBudget("Poly Haven texture", 12)
+
+# Test a material found through 3Dassets.one
+# (redirection + the budget of the source site)
+bpy.ops.object.lily_surface_import(
+	url="https://3dassets.one/go/?id=ambientcg-Bricks076C",
+	variant="1K-JPG"
+)
+checkBudget("3Dassets.one", 11)
+
+# Test IES light
+# (api + thumbnail + ies file)
+bpy.ops.object.lily_light_import(
+	url="https://ieslibrary.com/en/browse#ies-bd1adc3d30b1b33ce0dbf2e22ebfb1c8"
 )
+checkBudget("IES Library", 3)
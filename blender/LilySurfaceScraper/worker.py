@@ -0,0 +1,241 @@
+# Copyright (c) 2019 - 2020 Elie Michel
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# The Software is provided “as is”, without warranty of any kind, express or
+# implied, including but not limited to the warranties of merchantability,
+# fitness for a particular purpose and noninfringement. In no event shall
+# the authors or copyright holders be liable for any claim, damages or other
+# liability, whether in an action of contract, tort or otherwise, arising from,
+# out of or in connection with the software or the use or other dealings in the
+# Software.
+#
+# This file is part of LilySurfaceScraper, a Blender add-on to import materials
+# from a single URL
+
+"""
+Worker process running the scraping and download pipeline out of Blender, so
+that parsing, extraction and hashing do not compete with the interface for
+the GIL. It runs the Blender independent part of ScrapedData.selectVariant
+and sends back the maps for the Cycles builders to use on the main thread.
+
+The worker reads one JSON message per line on its standard input:
+    {"op": "import", "id": 1, "kind": "MATERIAL", "url": ..., "asset_name": ...,
+     "texture_root": ..., "variant": 0, "reinstall": false, "deep_check": false,
+     "preferences": {...}}
+    {"op": "shutdown"}
+and answers with one JSON message per line on its standard output:
+    {"event": "ready", "pid": 1234}
+    {"event": "progress", "id": 1, "received": 1048576}
+    {"event": "done", "id": 1, "ok": true, "name": ..., "maps": {...}, "error": null,
+     "results": [...], "received": 4194304, "seconds": 2.5}
+where results are the DownloadResult of each map, as dicts.
+Everything the pipeline prints goes to the standard error.
+"""
+
+import itertools
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+from .preferenceAccess import setPreferencesOverride
+
+PROGRESS_INTERVAL = 0.5  # seconds between progress events
+START_TIMEOUT = 30  # seconds for the worker to be ready
+SILENCE_TIMEOUT = 30  # seconds without any message after which the worker is deemed hung
+DEADLINE_GRACE = 60  # seconds granted to a job beyond the import deadline
+
+
+class WorkerError(Exception):
+    pass
+
+
+# -----------------------------------------------------------------------------
+# Worker side
+
+def runJob(job, send):
+    """Import the variant described by job, return the fields of the done
+    message"""
+    from .MaterialData import MaterialData
+    from .WorldData import WorldData
+    from .LightData import LightData
+    data_classes = {'MATERIAL': MaterialData, 'WORLD': WorldData, 'LIGHT': LightData}
+
+    setPreferencesOverride(job["preferences"])
+    data = data_classes[job["kind"]](job["url"], texture_root=job["texture_root"], asset_name=job["asset_name"])
+    if data.error is not None:
+        return {"ok": False, "name": data.name, "maps": data.maps, "error": data.error}
+    data._scraper.metadata.deep_check = job.get("deep_check", False)
+    data.setReinstall(job["reinstall"])
+
+    scraper = data._scraper
+    done = threading.Event()
+
+    def reportProgress():
+        while not done.wait(PROGRESS_INTERVAL):
+            send({"event": "progress", "id": job["id"], "received": scraper.received})
+    threading.Thread(target=reportProgress, daemon=True).start()
+
+    start = time.monotonic()
+    try:
+        ok = data.selectVariant(job["variant"])
+    finally:
+        done.set()
+    return {
+        "ok": ok,
+        "name": data.name,
+        "maps": data.maps,
+        "error": data.error or scraper.error,
+        "results": [r.toDict() for r in data.download_results.values()],
+        "received": scraper.received,
+        "seconds": time.monotonic() - start,
+    }
+
+
+def main():
+    protocol = sys.stdout
+    # Messages of the pipeline must not mix with the protocol
+    sys.stdout = sys.stderr
+    lock = threading.Lock()
+
+    def send(message):
+        with lock:
+            protocol.write(json.dumps(message) + "\n")
+            protocol.flush()
+
+    send({"event": "ready", "pid": os.getpid()})
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        if job.get("op") == "shutdown":
+            break
+        try:
+            result = runJob(job, send)
+        except Exception as err:
+            traceback.print_exc()
+            result = {"ok": False, "error": "Worker failed: {}".format(err)}
+        result.update(event="done", id=job["id"])
+        send(result)
+
+
+# -----------------------------------------------------------------------------
+# Blender side
+
+class WorkerClient():
+    """Runs a worker process and sends it jobs, one at a time"""
+    def __init__(self):
+        addon_dir = os.path.dirname(os.path.realpath(__file__))
+        parent_dir = os.path.dirname(addon_dir)
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [parent_dir, env.get("PYTHONPATH")]))
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", "from {}.worker import main; main()".format(os.path.basename(addon_dir))],
+            cwd=parent_dir, env=env, text=True, bufsize=1,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        )
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # Lines are read by a thread, so that waiting for them can time out
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read, daemon=True).start()
+        ready = self._receive(START_TIMEOUT)
+        print("Started download worker (pid {}).".format(ready.get("pid")))
+
+    def isAlive(self):
+        return self.process.poll() is None
+
+    def _read(self):
+        for line in self.process.stdout:
+            self._lines.put(line)
+        self._lines.put(None)
+
+    def _fail(self, reason):
+        """Kill the worker, which is restarted for the next job"""
+        self.process.kill()
+        self.process.wait()
+        raise WorkerError(reason)
+
+    def _receive(self, timeout=None):
+        try:
+            line = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            self._fail("The download worker did not answer for {} seconds".format(timeout))
+        if line is None:
+            raise WorkerError("The download worker exited with code {}".format(self.process.wait()))
+        try:
+            return json.loads(line)
+        except ValueError:
+            self._fail("Unexpected output from the download worker: {!r}".format(line[:200]))
+
+    def run(self, job, on_progress=None):
+        """Send job (without its id) and wait for it to be done.
+        on_progress(received_bytes) is called on progress events.
+        Return the done message."""
+        import_deadline = job["preferences"].get("import_deadline")
+        end = time.monotonic() + import_deadline + DEADLINE_GRACE if import_deadline else None
+        with self._lock:
+            job = dict(job, id=next(self._ids))
+            try:
+                self.process.stdin.write(json.dumps(job) + "\n")
+                self.process.stdin.flush()
+            except OSError as err:
+                raise WorkerError("Could not send a job to the download worker: {}".format(err))
+            while True:
+                timeout = SILENCE_TIMEOUT
+                if end is not None:
+                    if time.monotonic() >= end:
+                        self._fail("The download worker exceeded the import deadline")
+                    timeout = min(timeout, end - time.monotonic())
+                message = self._receive(timeout)
+                if message.get("id") != job["id"]:
+                    continue
+                if message["event"] == "progress":
+                    if on_progress is not None:
+                        on_progress(message["received"])
+                elif message["event"] == "done":
+                    return message
+
+    def shutdown(self):
+        if not self.isAlive():
+            return
+        try:
+            self.process.stdin.write(json.dumps({"op": "shutdown"}) + "\n")
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def getWorker():
+    """Return the worker process, starting it if needed"""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.isAlive():
+            _worker = WorkerClient()
+        return _worker
+
+
+def shutdownWorker():
+    global _worker
+    with _worker_lock:
+        if _worker is not None:
+            _worker.shutdown()
+            _worker = None